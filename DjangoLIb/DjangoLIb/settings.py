@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -55,14 +56,63 @@ REST_FRAMEWORK = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'LibHub.metrics.MetricsMiddleware',
+    'LibHub.query_budget.QueryBudgetMiddleware',
+    'LibHub.slow_queries.SlowQueryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'LibHub.profiling.ProfilingMiddleware',
 ]
 
+# Бюджет SQL-запросов на представление (см. LibHub/query_budget.py).
+# В строгом режиме (по умолчанию при DEBUG и в тестах) превышение - ошибка,
+# иначе - предупреждение в логе.
+QUERY_BUDGET_STRICT = None
+QUERY_BUDGET_DEFAULT = None
+
+# Профилирование запросов (LibHub/profiling.py): Server-Timing для каждого
+# запроса и профиль для доли SAMPLE_RATE запросов; по умолчанию выключено
+PROFILING = {
+    'ENABLED': os.environ.get('PROFILING_ENABLED') == '1',
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', '0.01')),
+    'MODE': os.environ.get('PROFILING_MODE', 'cprofile'),
+    'BUFFER_SIZE': 50,
+}
+
+# Журнал медленных SQL-запросов (LibHub/slow_queries.py,
+# manage.py slow_queries): запросы дольше THRESHOLD_MS группируются по
+# отпечатку, для части снимается EXPLAIN
+SLOW_QUERY_LOG = {
+    'ENABLED': os.environ.get('SLOW_QUERY_LOG_ENABLED') == '1',
+    'THRESHOLD_MS': float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '200')),
+    'EXPLAIN_SAMPLE_RATE': 0.1,
+    'EXPLAIN_ANALYZE': os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE') == '1',
+}
+
+# Метрики Prometheus по /metrics (LibHub/metrics.py). При нескольких
+# процессах-воркерах задайте METRICS_DIR - общий каталог снимков процессов,
+# очищаемый при перезапуске; METRICS_TOKEN - токен Bearer для чтения.
+# Без токена метрики выключены, а включённые (METRICS_ENABLED=1) видит
+# только персонал
+METRICS = {
+    'ENABLED': os.environ.get(
+        'METRICS_ENABLED',
+        '1' if os.environ.get('METRICS_TOKEN') else '0') == '1',
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_DIR'),
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+# Построение диаграмм отчётов (LibHub/charts.py): число процессов пула
+# (0 - в текущем процессе) и наибольшее число долей, остальные - "Другие"
+CHARTS = {
+    'PROCESSES': int(os.environ.get('CHART_PROCESSES', '2')),
+    'MAX_SLICES': 12,
+}
+
 ROOT_URLCONF = 'DjangoLIb.urls'
 LOGIN_URL = '/login/'
 TEMPLATES = [
@@ -97,6 +147,57 @@ DATABASES = {
     }
 }
 
+# Каталог утилит PostgreSQL (pg_dump, psql); по умолчанию они ищутся в PATH
+PG_BIN_DIR = os.environ.get('PG_BIN_DIR')
+# Каталог для загруженных и созданных резервных копий
+BACKUP_ROOT = Path(os.environ.get('BACKUP_ROOT', BASE_DIR / 'backups'))
+# Хранилище артефактов (загрузки и резервные копии, LibHub/artifacts.py)
+ARTIFACT_ROOT = Path(os.environ.get('ARTIFACT_ROOT',
+                                    BACKUP_ROOT / 'artifacts'))
+# Политики хранения по видам артефактов: удалять старше days, но оставлять
+# keep_last последних
+ARTIFACT_RETENTION = {
+    'UPLOAD': {'days': 30},
+    'BACKUP': {'days': 90, 'keep_last': 14},
+    'REPORT': {'days': 7},
+}
+# Очередь фоновых задач (LibHub/jobs.py, воркер - manage.py run_jobs):
+# пределы одновременно выполняемых задач по видам поверх заданных в
+# LibHub/tasks.py, через STALE_TIMEOUT секунд без отметки воркера задача
+# возвращается в очередь; SCHEDULE - интервалы периодических задач в
+# секундах (0 - не запускать), например {'EXPIRE_RENTALS': 600}
+JOB_QUEUE = {
+    'CONCURRENCY': {},
+    'STALE_TIMEOUT': 300,
+    'SCHEDULE': {},
+}
+# Базовая линия замеров представлений (manage.py bench_endpoints)
+BENCHMARK_BASELINE = Path(os.environ.get(
+    'BENCHMARK_BASELINE', BASE_DIR / 'benchmarks' / 'baseline.json'))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# По умолчанию - локальная память процесса; при заданном REDIS_URL - Redis,
+# общий для всех воркеров (нужен для общего счётчика версий и статистики).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'libhub',
+        }
+    }
+
+# Время жизни закэшированных ответов каталога, секунды (см. LibHub/cache.py)
+RESPONSE_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -35,6 +35,8 @@ api_patterns = [
     path('', include(routerGenre.urls)),
     path('', include(routerRequest.urls)),
     path('', include(routerPublisher.urls)),
+    path('analytics/rentals/', v.RentalAnalyticsView.as_view(),
+         name='rental_analytics'),
     # path('', include(routerComment.urls)),
     # path('', include(routerEvaluation.urls)),
 
@@ -108,8 +110,22 @@ urlpatterns = [
     path('register/', v.RegisterView.as_view(), name='registration'),
 
     path('db/backup/', v.backup_database, name='backup_database'),
+    path('db/backups/<int:pk>/download/', v.download_backup,
+         name='download_backup'),
 
     path('restore/', v.restore_database, name='restore_database'),
+    path('restore/<int:pk>/progress/', v.restore_progress,
+         name='restore_progress'),
     path('db/upload/', v.upload_file_view, name='upload_file'),
-    path('db/getBooksInfo', v.rented_books_statistics, name="rented_books_statistics")
+    path('db/artifacts/<str:sha256>/', v.artifact_lookup,
+         name='artifact_lookup'),
+    path('db/getBooksInfo', v.rented_books_statistics,
+         name="rented_books_statistics"),
+    path('jobs/<int:pk>/', v.job_detail, name='job_detail'),
+    path('jobs/<int:pk>/download/', v.job_download, name='job_download'),
+    path('db/cache-stats/', v.cache_stats_view, name='cache_stats'),
+    path('db/profiles/', v.profiles_view, name='profiles'),
+    path('metrics', v.metrics_view, name='metrics'),
+    path('db/profiles/<int:pk>/', v.profile_download_view,
+         name='profile_download'),
 ]
\ No newline at end of file
@@ -2,8 +2,14 @@ from django.contrib import admin, messages
 from django.http import HttpResponse
 import csv
 from django.utils.translation import gettext_lazy as _
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
 
-from .models import (Language, Publisher, Genre, Author, Book, User, Request)
+from . import backups, rentals
+from .forms import RequestForm
+from .models import (Language, Publisher, Genre, Author, Book, User, Request,
+                     Artifact, BackupArchive, Job, RestoreJob, SlowQuery)
 
 class BaseAdmin(admin.ModelAdmin):
     actions = ['export_to_csv', 'delete_multiple', 'restore_multiple']
@@ -77,21 +83,181 @@ class AuthorAdmin(BaseAdmin):
 
 @admin.register(Book)
 class BookAdmin(BaseAdmin):
-    list_display = ('name', 'publication_year', 'language', 'is_deleted', 'cover_url')
+    list_display = ('name', 'publication_year', 'language', 'quantity',
+                    'available', 'is_deleted', 'cover_url')
+    list_select_related = ('language',)
+    readonly_fields = ('available',)
     ordering = ('name', 'publication_year', 'language', 'is_deleted', 'cover_url')
     verbose_name = _("Книга")
     verbose_name_plural = _("Книги")
 
 @admin.register(Request)
 class RequestAdmin(admin.ModelAdmin):
-    list_display = ('user', 'borrow_date', 'return_date', 'book', 'status')
+    form = RequestForm
+    list_display = ('user', 'borrow_date', 'return_date', 'book', 'status',
+                    'returned_at')
+    list_select_related = ('user', 'book')
     ordering = ('user', 'borrow_date', 'return_date', 'book', 'status')
     verbose_name = _("Запрос")
     verbose_name_plural = _("Запросы")
 
+    # Экземпляры книги занимаются и освобождаются в LibHub/rentals.py;
+    # RequestForm проверяет их заранее, чтобы ошибка попала в форму
+    def save_model(self, request, obj, form, change):
+        rentals.save_rental(obj)
+
+    def delete_model(self, request, obj):
+        rentals.delete_rental(obj)
+
+    def delete_queryset(self, request, queryset):
+        for rental in queryset:
+            rentals.delete_rental(rental)
+
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('email', 'first_name', 'last_name', 'is_active', 'is_staff')
     ordering = ('email', 'first_name', 'last_name', 'is_active', 'is_staff')
     verbose_name = _("Пользователь")
     verbose_name_plural = _("Пользователи")
+
+
+@admin.register(BackupArchive)
+class BackupArchiveAdmin(admin.ModelAdmin):
+    """
+    Создание копии - форма добавления (число потоков), восстановление -
+    действие.
+    """
+    list_display = ('id', 'created_at', 'jobs', 'status', 'size', 'duration',
+                    'download')
+    fields = ('jobs',)
+    actions = ['restore_archives', 'repeat_backup']
+    verbose_name = _("Резервная копия")
+    verbose_name_plural = _("Резервные копии")
+
+    @admin.display(description=_("Файл"))
+    def download(self, obj):
+        if obj.status != BackupArchive.Status.DONE:
+            return obj.error[:100]
+        if not obj.artifact_id and not obj.file:
+            return _("Удалена политикой хранения")
+        return format_html('<a href="{}">{}</a>',
+                           reverse('download_backup', args=[obj.pk]),
+                           _("Скачать"))
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            backups.start_parallel_backup(obj, request.user)
+            self.message_user(
+                request,
+                _("Создание резервной копии поставлено в очередь задач."),
+                messages.SUCCESS)
+
+    @admin.action(
+        description=_("Восстановить базу из выбранной копии (pg_restore -j)"))
+    def restore_archives(self, request, queryset):
+        archives = list(queryset.filter(status=BackupArchive.Status.DONE)[:2])
+        if len(archives) != 1:
+            self.message_user(request, _("Выберите одну готовую копию."),
+                              messages.ERROR)
+            return
+        job = backups.start_archive_restore(archives[0], user=request.user)
+        self.message_user(request, format_html(
+            '{} <a href="{}">{}</a>',
+            _("Восстановление поставлено в очередь задач."),
+            reverse('restore_progress', args=[job.pk]), _("Прогресс")
+        ), messages.SUCCESS)
+
+    @admin.action(description=_("Создать новую копию с тем же числом потоков"))
+    def repeat_backup(self, request, queryset):
+        for archive in queryset:
+            backups.start_parallel_backup(
+                BackupArchive.objects.create(jobs=archive.jobs), request.user)
+        self.message_user(
+            request, _("Создание резервных копий поставлено в очередь задач."),
+            messages.SUCCESS)
+
+
+@admin.register(RestoreJob)
+class RestoreJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'archive_format', 'jobs', 'status',
+                    'bytes_processed', 'bytes_total', 'statements')
+    readonly_fields = [field.name for field in RestoreJob._meta.fields]
+    verbose_name = _("Восстановление")
+    verbose_name_plural = _("Восстановления")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Artifact)
+class ArtifactAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'kind', 'size', 'sha256', 'created_at')
+    list_filter = ('kind',)
+    list_select_related = ('blob',)
+    search_fields = ('name', 'blob__sha256')
+    readonly_fields = ('name', 'kind', 'blob', 'created_at')
+    verbose_name = _("Артефакт")
+    verbose_name_plural = _("Артефакты")
+
+    @admin.display(description=_("Размер"))
+    def size(self, obj):
+        return obj.blob.size
+
+    @admin.display(description="SHA-256")
+    def sha256(self, obj):
+        return obj.blob.sha256
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'progress_done',
+                    'progress_total', 'requested_by', 'worker', 'created_at',
+                    'finished_at')
+    list_filter = ('kind', 'status')
+    list_select_related = ('requested_by',)
+    readonly_fields = [field.name for field in Job._meta.fields]
+    actions = ['retry_jobs']
+    verbose_name = _("Задача")
+    verbose_name_plural = _("Задачи")
+
+    @admin.action(
+        description=_("Повторить выбранные завершившиеся ошибкой задачи"))
+    def retry_jobs(self, request, queryset):
+        retried = queryset.filter(status=Job.Status.FAILED).update(
+            status=Job.Status.PENDING, attempts=0, error='',
+            run_after=timezone.now(), finished_at=None)
+        self.message_user(request,
+                          _("Поставлено в очередь повторно: %d") % retried,
+                          messages.SUCCESS)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ('fingerprint_short', 'view', 'calls', 'total_ms',
+                    'average_ms', 'max_ms', 'last_seen')
+    list_filter = ('view',)
+    search_fields = ('normalized', 'view', 'location')
+    ordering = ('-total_ms',)
+    readonly_fields = ('fingerprint', 'normalized', 'sample_sql', 'view',
+                       'location', 'calls', 'total_ms', 'max_ms', 'plan',
+                       'plan_at', 'first_seen', 'last_seen')
+    verbose_name = _("Медленный запрос")
+    verbose_name_plural = _("Медленные запросы")
+
+    @admin.display(description=_("Отпечаток"))
+    def fingerprint_short(self, obj):
+        return obj.fingerprint[:12]
+
+    @admin.display(description=_("Среднее, мс"))
+    def average_ms(self, obj):
+        return round(obj.total_ms / obj.calls, 1) if obj.calls else None
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,297 @@
+"""
+Аналитика аренд по времени: объём выдач, длительность аренды и доля просрочек.
+
+Столбцы ``Request`` читаются через ``values_list`` порциями по диапазонам id
+целыми числами (даты - дни от 1970-01-01, статус - код) и одним вызовом
+превращаются в массивы NumPy; серии по периодам (день, неделя, месяц) и
+группам (жанрам) считаются векторно через ``bincount`` - без циклов Python по
+строкам. Перцентили длительности берутся из гистограмм длительности по
+ячейкам (период, группа), поэтому память не зависит от числа аренд.
+
+* Период аренды определяется датой выдачи ``borrow_date``.
+* Длительность считается для возвращённых аренд: от выдачи до дня возврата
+  ``returned_at``; длительности больше ``MAX_DURATION`` дней попадают в
+  последнюю корзину гистограммы.
+* Просроченная аренда - в статусе EXPIRED, не возвращённая к сроку RENTED или
+  возвращённая позже ``return_date``.
+
+Ответ столбцовый: ``columns`` - словарь одинаковых по длине списков, по
+строке на непустую ячейку (период, группа).
+"""
+import datetime
+from dataclasses import dataclass
+
+import numpy
+from django.db import connections
+from django.db.models import Case, Func, IntegerField, Max, Min, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Genre, Request
+
+BUCKETS = ('day', 'week', 'month')
+GROUPS = ('genre',)
+PERCENTILES = (50, 90)
+MAX_DURATION = 120
+# Строк Request в одном запросе (диапазон id)
+CHUNK_SIZE = 200_000
+# Предел числа ячеек (период x группа): гистограммы длительности занимают
+# ячейки x MAX_DURATION
+MAX_CELLS = 20_000
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+class EpochDays(Func):
+    """
+    Дата как число дней от 1970-01-01: целые столбцы без преобразования
+    каждой строки в ``date``.
+    """
+    output_field = IntegerField()
+    template = "(%(expressions)s - DATE '1970-01-01')"
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="CAST(julianday(%(expressions)s) - 2440587.5 AS INTEGER)",
+            **extra_context)
+
+
+# Коды статусов в столбце status
+STATUS_CODES = {status: code for code, status
+                in enumerate(Request.RequestStatus.values)}
+
+
+def bucket_start(days, bucket):
+    """
+    Начало периода (день, понедельник недели, первое число месяца) для
+    массива datetime64[D].
+    """
+    if bucket == 'day':
+        return days
+    if bucket == 'week':
+        # 1970-01-01 - четверг: сдвиг на 3 дня выравнивает недели по
+        # понедельникам
+        return days - (days.astype('int64') + 3) % 7
+    return days.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def periods(start, end, bucket):
+    """Начала всех периодов с ``start`` по ``end`` включительно."""
+    first, last = bucket_start(
+        numpy.array([start, end], dtype='datetime64[D]'), bucket)
+    if bucket == 'month':
+        return numpy.arange(first.astype('datetime64[M]'),
+                            last.astype('datetime64[M]') + 1
+                            ).astype('datetime64[D]')
+    step = 7 if bucket == 'week' else 1
+    return numpy.arange(first, last + 1, step, dtype='datetime64[D]')
+
+
+def _id_ranges(rows, chunk_size):
+    bounds = rows.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        yield low, low + chunk_size
+
+
+def read_chunks(start, end, group=None, chunk_size=CHUNK_SIZE):
+    """
+    Порции столбцов аренд, выданных с ``start`` по ``end``: словари массивов
+    ``borrow``, ``due``, ``returned`` (datetime64[D]), ``status`` (коды
+    ``STATUS_CODES``) и, для ``group='genre'``, ``group``.
+    """
+    rows = (Request.objects.filter(borrow_date__gte=start,
+                                   borrow_date__lte=end).order_by()
+            .annotate(borrow=EpochDays('borrow_date'),
+                      due=EpochDays('return_date'),
+                      # У невозвращённых аренд дня возврата нет - столбец
+                      # не читается
+                      returned=EpochDays(Coalesce('returned_at',
+                                                  'borrow_date')),
+                      code=Case(*(When(status=status, then=Value(code))
+                                  for status, code in STATUS_CODES.items()),
+                                output_field=IntegerField())))
+    fields = ['borrow', 'due', 'returned', 'code']
+    if group == 'genre':
+        # Аренда книги с несколькими жанрами учитывается в каждом из них
+        rows = rows.filter(book__genres__isnull=False)
+        fields.append('book__genres')
+    for low, high in _id_ranges(rows, chunk_size):
+        query = rows.filter(pk__gte=low, pk__lt=high).values_list(
+            *fields).query
+        # Столбцы целые: строки берутся из курсора без конвертеров Django
+        # для каждого значения
+        sql, params = query.get_compiler(using=rows.db).as_sql()
+        with connections[rows.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            chunk = cursor.fetchall()
+        if not chunk:
+            continue
+        # Все столбцы целые - одно преобразование на порцию
+        data = numpy.array(chunk, dtype='int64')
+        yield {
+            'borrow': data[:, 0].astype('datetime64[D]'),
+            'due': data[:, 1].astype('datetime64[D]'),
+            'returned': data[:, 2].astype('datetime64[D]'),
+            'status': data[:, 3],
+            **({'group': data[:, 4]} if group else {}),
+        }
+
+
+@dataclass
+class _Accumulator:
+    rentals: numpy.ndarray
+    overdue: numpy.ndarray
+    durations: numpy.ndarray
+
+    @classmethod
+    def empty(cls, cells):
+        return cls(numpy.zeros(cells, dtype='int64'),
+                   numpy.zeros(cells, dtype='int64'),
+                   numpy.zeros((cells, MAX_DURATION + 1), dtype='int64'))
+
+    def add(self, cell, overdue, returned, duration):
+        cells = len(self.rentals)
+        self.rentals += numpy.bincount(cell, minlength=cells)
+        self.overdue += numpy.bincount(cell[overdue], minlength=cells)
+        flat = (cell[returned] * (MAX_DURATION + 1)
+                + numpy.clip(duration[returned], 0, MAX_DURATION))
+        self.durations += numpy.bincount(
+            flat, minlength=self.durations.size).reshape(self.durations.shape)
+
+
+def _statistics(rentals, overdue, durations):
+    """
+    Столбцы показателей по ячейкам; ``durations`` - гистограммы
+    длительности.
+    """
+    returned = durations.sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        columns = {
+            'rentals': rentals,
+            'returned': returned,
+            'overdue': overdue,
+            'overdue_rate': overdue / rentals,
+            'avg_duration': ((durations * numpy.arange(MAX_DURATION + 1))
+                             .sum(axis=1) / returned),
+        }
+    cumulative = durations.cumsum(axis=1)
+    for percentile in PERCENTILES:
+        # Ранговый перцентиль: наименьшая длительность, до которой
+        # включительно набрано p% возвратов
+        rank = numpy.ceil(returned * percentile / 100)
+        value = (cumulative < rank[:, None]).sum(axis=1).astype('float64')
+        value[returned == 0] = numpy.nan
+        columns[f'p{percentile}_duration'] = value
+    return columns
+
+
+def _json_column(values):
+    if values.dtype.kind == 'f':
+        return [None if numpy.isnan(value) else value
+                for value in numpy.round(values, 4).tolist()]
+    return values.tolist()
+
+
+def rental_series(start=None, end=None, bucket='day', group=None, today=None,
+                  chunk_size=CHUNK_SIZE):
+    """
+    Серии показателей аренд за период выдачи [start, end] по периодам
+    ``bucket``
+    и, если задано, по жанрам (``group='genre'``). Возвращает словарь для JSON.
+    """
+    if bucket not in BUCKETS:
+        raise AnalyticsError(f"Неизвестный период: {bucket}. "
+                             f"Допустимы: {', '.join(BUCKETS)}.")
+    if group is not None and group not in GROUPS:
+        raise AnalyticsError(f"Неизвестная группировка: {group}. "
+                             f"Допустимы: {', '.join(GROUPS)}.")
+    today = today or timezone.localdate()
+    end = end or today
+    start = start or end - datetime.timedelta(days=364)
+    if end < start:
+        raise AnalyticsError("Начало периода позже конца.")
+
+    starts = periods(start, end, bucket)
+    if group == 'genre':
+        groups = list(Genre.objects.order_by('pk').values_list('pk', 'name'))
+    else:
+        groups = [(None, None)]
+    group_ids = numpy.array([group_id or 0 for group_id, _ in groups],
+                            dtype='int64')
+    cells = len(starts) * len(groups)
+    if cells > MAX_CELLS:
+        raise AnalyticsError(f"Слишком много точек ({cells}, "
+                             f"не больше {MAX_CELLS}): "
+                             f"укрупните период или сократите интервал.")
+
+    totals = _Accumulator.empty(cells)
+    today_day = numpy.datetime64(today, 'D')
+    rows = 0
+    for chunk in read_chunks(start, end, group, chunk_size):
+        rows += len(chunk['borrow'])
+        if group:
+            group_index = numpy.minimum(
+                numpy.searchsorted(group_ids, chunk['group']),
+                len(group_ids) - 1)
+            # Жанр, созданный после начала расчёта, не учитывается
+            known = group_ids[group_index] == chunk['group']
+            chunk = {name: values[known] for name, values in chunk.items()}
+            group_index = group_index[known]
+        else:
+            group_index = 0
+        period = numpy.searchsorted(starts,
+                                    bucket_start(chunk['borrow'], bucket))
+        returned = (chunk['status']
+                    == STATUS_CODES[Request.RequestStatus.RETURNED])
+        overdue = ((chunk['status']
+                    == STATUS_CODES[Request.RequestStatus.EXPIRED])
+                   | ((chunk['status']
+                       == STATUS_CODES[Request.RequestStatus.RENTED])
+                      & (chunk['due'] < today_day))
+                   | (returned & (chunk['returned'] > chunk['due'])))
+        duration = (chunk['returned'] - chunk['borrow']).astype('int64')
+        totals.add(group_index * len(starts) + period, overdue, returned,
+                   duration)
+
+    # Строки ответа - только непустые ячейки
+    filled = numpy.flatnonzero(totals.rentals)
+    statistics = _statistics(totals.rentals[filled], totals.overdue[filled],
+                             totals.durations[filled])
+    columns = {'period': [str(day)
+                          for day in starts[filled % len(starts)].tolist()]}
+    if group:
+        columns['group'] = group_ids[filled // len(starts)].tolist()
+    columns.update((name, _json_column(values))
+                   for name, values in statistics.items())
+
+    # Итоги по группам за весь период
+    shape = (len(groups), len(starts))
+    group_rentals = totals.rentals.reshape(shape).sum(axis=1)
+    filled = numpy.flatnonzero(group_rentals) if group else numpy.arange(1)
+    statistics = _statistics(
+        group_rentals[filled],
+        totals.overdue.reshape(shape).sum(axis=1)[filled],
+        totals.durations.reshape(*shape, -1).sum(axis=1)[filled])
+    summary = {'group': group_ids[filled].tolist()} if group else {}
+    summary.update((name, _json_column(values))
+                   for name, values in statistics.items())
+
+    result = {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'bucket': bucket,
+        'group': group,
+        'rows_scanned': rows,
+        'columns': columns,
+        'summary': summary,
+    }
+    if group:
+        names = dict(groups)
+        result['groups'] = {str(group_id): names[group_id]
+                            for group_id in summary['group']}
+    return result
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class LibhubConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'LibHub'
+
+    def ready(self):
+        from . import metrics, signals, tasks  # noqa: F401 - tasks регистрирует обработчики очереди
+
+        post_migrate.connect(signals.install_search_structures, sender=self)
+        connection_created.connect(metrics.record_connection_opened)
@@ -0,0 +1,342 @@
+"""
+Хранилище артефактов (загруженные файлы и резервные копии) с адресацией по
+содержимому.
+
+Файл читается потоком и режется на фрагменты по содержимому: граница ставится
+после строки, CRC32 которой попадает в маску, но не раньше ``MIN_CHUNK`` и не
+позже ``MAX_CHUNK`` байт от начала фрагмента. Вставка или удаление строк в
+SQL-дампе меняет только соседние фрагменты, поэтому почти одинаковые дампы
+делят большую часть хранилища. Фрагменты лежат в
+``ARTIFACT_ROOT/chunks/<ab>/<sha256>`` и записываются, только если их ещё нет.
+
+Файл целиком (``Blob``) индексируется по SHA-256, который считается при
+записи: повторная загрузка известного содержимого находится одним запросом к
+уникальному индексу (``find_blob``) и стоит одной строки ``Artifact``.
+
+Политики хранения (``settings.ARTIFACT_RETENTION``) удаляют старые
+артефакты; ``collect_garbage`` затем удаляет Blob без артефактов и фрагменты,
+на которые не ссылается ни один Blob.
+"""
+import datetime
+import hashlib
+import io
+import os
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Artifact, Blob, BlobChunk, Chunk, RestoreJob
+
+MIN_CHUNK = 32 * 1024
+MAX_CHUNK = 256 * 1024
+# Граница после строки с crc32 & BOUNDARY_MASK == 0, то есть в среднем раз в
+# 256 строк
+BOUNDARY_MASK = 0xFF
+# Сколько фрагментов проверять и регистрировать одним запросом
+PENDING_CHUNKS = 16
+INSERT_BATCH = 1000
+# Фрагменты, использованные позже этого срока, сборщик не удаляет: на них может
+# ссылаться ещё не завершённая запись
+GC_GRACE = datetime.timedelta(hours=1)
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def chunk_path(digest):
+    return os.path.join(settings.ARTIFACT_ROOT, 'chunks', digest[:2], digest)
+
+
+class Chunker:
+    """
+    Нарезка потока байтов на фрагменты по содержимому (границы - концы
+    строк).
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # Начало ещё не просмотренной строки в буфере
+        self.scanned = 0
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        start = 0
+        pos = self.scanned
+        while True:
+            end = buffer.find(b'\n', pos)
+            if end == -1:
+                # Длинный участок без переводов строки режется на фрагменты
+                # MAX_CHUNK
+                while len(buffer) - start >= MAX_CHUNK:
+                    yield bytes(buffer[start:start + MAX_CHUNK])
+                    start += MAX_CHUNK
+                pos = max(pos, start)
+                break
+            end += 1
+            while end - start > MAX_CHUNK:
+                yield bytes(buffer[start:start + MAX_CHUNK])
+                start += MAX_CHUNK
+            size = end - start
+            if size == MAX_CHUNK or (
+                    size >= MIN_CHUNK
+                    and zlib.crc32(buffer[pos:end]) & BOUNDARY_MASK == 0):
+                yield bytes(buffer[start:end])
+                start = end
+            pos = end
+        del buffer[:start]
+        self.scanned = pos - start
+
+    def finish(self):
+        if self.buffer:
+            yield bytes(self.buffer)
+        self.buffer = bytearray()
+        self.scanned = 0
+
+
+def _write_chunk(digest, data):
+    path = chunk_path(digest)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Через временный файл: параллельная запись того же фрагмента не оставит
+    # обрывка
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                     delete=False) as file:
+        file.write(data)
+    os.replace(file.name, path)
+
+
+class ArtifactWriter:
+    """
+    Файловый объект для записи артефакта ``name`` вида ``kind``.
+
+    ``write`` режет поток на фрагменты и сохраняет новые; при выходе из блока
+    ``with`` без ошибки регистрируются Blob и Artifact (``self.artifact``).
+    """
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.artifact = None
+        self._chunker = Chunker()
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+        # Фрагменты файла по порядку: (digest, size)
+        self._parts = []
+        self._pending = {}
+
+    def write(self, data):
+        self._sha256.update(data)
+        self._size += len(data)
+        for chunk in self._chunker.feed(data):
+            self._add(chunk)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        # Фрагменты сохраняются пачками по PENDING_CHUNKS и при close()
+        pass
+
+    def _add(self, chunk):
+        digest = hashlib.sha256(chunk).hexdigest()
+        self._parts.append((digest, len(chunk)))
+        self._pending[digest] = chunk
+        if len(self._pending) >= PENDING_CHUNKS:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        now = timezone.now()
+        known = set(Chunk.objects.filter(digest__in=self._pending)
+                    .values_list('digest', flat=True))
+        if known:
+            Chunk.objects.filter(digest__in=known).update(used_at=now)
+        new = [digest for digest in self._pending if digest not in known]
+        for digest in new:
+            _write_chunk(digest, self._pending[digest])
+        Chunk.objects.bulk_create(
+            [Chunk(digest=digest, size=len(self._pending[digest]), used_at=now)
+             for digest in new],
+            ignore_conflicts=True,
+        )
+        self._pending = {}
+
+    def close(self):
+        for chunk in self._chunker.finish():
+            self._add(chunk)
+        self._flush()
+        sha256 = self._sha256.hexdigest()
+        with transaction.atomic():
+            blob = find_blob(sha256)
+            if blob is None:
+                blob = _create_blob(sha256, self._size, self._parts)
+            self.artifact = link(blob, self.name, self.kind)
+        return self.artifact
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Записанные фрагменты незавершённой записи удалит сборщик мусора
+        if exc_type is None:
+            self.close()
+
+
+def _create_blob(sha256, size, parts):
+    try:
+        with transaction.atomic():
+            blob = Blob.objects.create(sha256=sha256, size=size)
+            for start in range(0, len(parts), INSERT_BATCH):
+                BlobChunk.objects.bulk_create([
+                    BlobChunk(blob=blob, position=start + index,
+                              chunk_id=digest)
+                    for index, (digest, _)
+                    in enumerate(parts[start:start + INSERT_BATCH])
+                ])
+        return blob
+    except IntegrityError:
+        # То же содержимое одновременно записал другой процесс
+        return Blob.objects.get(sha256=sha256)
+
+
+def find_blob(sha256):
+    """
+    Содержимое с контрольной суммой ``sha256`` (hex) или None - один запрос
+    к индексу.
+    """
+    return Blob.objects.filter(sha256=sha256.lower()).first()
+
+
+def link(blob, name, kind):
+    """
+    Новый артефакт с уже хранящимся содержимым: на диск ничего не пишется.
+    """
+    return Artifact.objects.create(blob=blob, name=name, kind=kind)
+
+
+def store(chunks, name, kind):
+    """Сохранить поток байтов ``chunks`` как артефакт. Возвращает Artifact."""
+    with ArtifactWriter(name, kind) as writer:
+        for data in chunks:
+            writer.write(data)
+    return writer.artifact
+
+
+def store_upload(uploaded_file, kind):
+    return store(uploaded_file.chunks(), uploaded_file.name, kind)
+
+
+class _BlobReader(io.RawIOBase):
+    def __init__(self, blob, name):
+        self.blob = blob
+        self.name = name
+        self._digests = iter(list(blob.parts.order_by('position')
+                                  .values_list('chunk_id', flat=True)))
+        self._current = b''
+        self._offset = 0
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, target):
+        while self._offset >= len(self._current):
+            digest = next(self._digests, None)
+            if digest is None:
+                return 0
+            try:
+                with open(chunk_path(digest), 'rb') as file:
+                    self._current = file.read()
+            except FileNotFoundError:
+                raise ArtifactError(f"Фрагмент {digest} содержимого "
+                                    f"{self.blob.sha256} отсутствует "
+                                    f"в хранилище.")
+            self._offset = 0
+        size = min(len(target), len(self._current) - self._offset)
+        target[:size] = self._current[self._offset:self._offset + size]
+        self._offset += size
+        self._position += size
+        return size
+
+
+class ArtifactFile(io.BufferedReader):
+    """Двоичный файл только для чтения с содержимым артефакта."""
+
+    def __init__(self, artifact):
+        super().__init__(_BlobReader(artifact.blob, artifact.name),
+                         buffer_size=MAX_CHUNK)
+        self.size = artifact.blob.size
+
+
+def open_artifact(artifact):
+    return ArtifactFile(artifact)
+
+
+def _expired(kind, policy, now):
+    artifacts = Artifact.objects.filter(kind=kind)
+    if 'days' not in policy:
+        return Artifact.objects.none()
+    expired = artifacts.filter(
+        created_at__lt=now - datetime.timedelta(days=policy['days']))
+    keep_last = policy.get('keep_last')
+    if keep_last:
+        expired = expired.exclude(pk__in=list(
+            artifacts.order_by('-created_at', '-pk')
+            .values_list('pk', flat=True)[:keep_last]))
+    # Копии, из которых сейчас идёт восстановление, не удаляются
+    active = RestoreJob.objects.filter(
+        status__in=[RestoreJob.Status.PENDING, RestoreJob.Status.RUNNING],
+        artifact__isnull=False)
+    return expired.exclude(pk__in=active.values('artifact'))
+
+
+def apply_retention(now=None, dry_run=False):
+    """
+    Удалить артефакты по ``settings.ARTIFACT_RETENTION``. Возвращает
+    {вид: число}.
+    """
+    now = now or timezone.now()
+    removed = {}
+    for kind, policy in settings.ARTIFACT_RETENTION.items():
+        expired = _expired(kind, policy, now)
+        removed[kind] = expired.count() if dry_run else expired.delete()[0]
+    return removed
+
+
+def collect_garbage(now=None):
+    """
+    Удалить Blob без артефактов и фрагменты без Blob (с их файлами).
+
+    Возвращает (число Blob, число фрагментов, освобождено байт).
+    """
+    now = now or timezone.now()
+    blobs = Blob.objects.filter(artifacts__isnull=True).delete()[1].get(
+        Blob._meta.label, 0)
+    unused = Chunk.objects.filter(parts__isnull=True,
+                                  used_at__lt=now - GC_GRACE)
+    chunks = freed = 0
+    while True:
+        batch = list(unused.values_list('digest', 'size')[:INSERT_BATCH])
+        if not batch:
+            break
+        Chunk.objects.filter(
+            digest__in=[digest for digest, _ in batch]).delete()
+        for digest, size in batch:
+            try:
+                os.remove(chunk_path(digest))
+            except FileNotFoundError:
+                pass
+            chunks += 1
+            freed += size
+    return blobs, chunks, freed
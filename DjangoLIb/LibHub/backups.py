@@ -0,0 +1,504 @@
+"""
+Резервное копирование PostgreSQL утилитами pg_dump / psql.
+
+Вывод ``pg_dump`` читается из канала порциями и сразу пишется дальше - в
+хранилище артефактов задачей очереди (LibHub/tasks.py) или клиенту -
+при необходимости сжимаясь на лету gzip или zstd, поэтому дамп целиком
+никогда не находится в памяти. Исполняемые файлы ищутся в каталоге
+``settings.PG_BIN_DIR`` (если задан), иначе в ``PATH``.
+
+Код завершения ``pg_dump`` известен только после отправки всех данных.
+Ошибки, возникшие до первого байта (неверный пароль, нет базы), превращаются
+в ``BackupError`` до начала ответа; ошибка в середине дампа прерывает поток
+исключением, и клиент получает оборванную (а не "успешную") загрузку.
+
+Восстановление выполняется в очереди задач (LibHub/jobs.py), прогресс -
+в ``RestoreJob``: загруженный файл
+сохраняется в хранилище артефактов (LibHub/artifacts.py), распаковывается на
+лету (gzip/zstd определяются по сигнатуре) и порциями пишется в stdin
+``psql``; прогресс (обработанные байты и выполненные команды) сохраняется в
+задаче.
+
+Параллельный режим (``BackupArchive``): ``pg_dump -Fd -j N`` пишет каталог,
+который упаковывается в один tar-поток без сжатия (файлы таблиц уже сжаты
+pg_dump) прямо в хранилище артефактов; восстановление распаковывает архив и
+вызывает ``pg_restore -j N``.
+"""
+import contextlib
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.db import connections
+
+from . import artifacts
+from .jobs import enqueue
+from .models import Artifact, BackupArchive, Job, RestoreJob
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('LibHub.backups')
+
+CHUNK_SIZE = 64 * 1024
+STDERR_LIMIT = 4000
+
+
+class BackupError(Exception):
+    pass
+
+
+def find_executable(name):
+    """Путь к утилите PostgreSQL: ``PG_BIN_DIR`` или ``PATH``."""
+    bin_dir = getattr(settings, 'PG_BIN_DIR', None)
+    path = shutil.which(name, path=bin_dir) if bin_dir else shutil.which(name)
+    if path is None:
+        where = f"каталоге {bin_dir}" if bin_dir else "PATH"
+        raise BackupError(f"Утилита {name} не найдена в {where}.")
+    return path
+
+
+def connection_args(alias='default'):
+    """
+    Аргументы подключения и окружение (с PGPASSWORD) для утилит PostgreSQL.
+    """
+    db_settings = settings.DATABASES[alias]
+    args = [
+        '-h', db_settings.get('HOST') or 'localhost',
+        '-p', str(db_settings.get('PORT') or 5432),
+        '-U', db_settings['USER'],
+    ]
+    env = os.environ.copy()
+    if db_settings.get('PASSWORD'):
+        env['PGPASSWORD'] = db_settings['PASSWORD']
+    return args, env, db_settings['NAME']
+
+
+class _Identity:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def _gzip():
+    # wbits=31 - формат gzip (заголовок и CRC), совместимый с gunzip
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def _zstd():
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+
+COMPRESSIONS = {
+    None: (_Identity, ''),
+    'gzip': (_gzip, '.gz'),
+    'zstd': (_zstd, '.zst'),
+}
+
+
+def available_compressions():
+    return [name for name in COMPRESSIONS
+            if name != 'zstd' or zstandard is not None]
+
+
+def _read_stderr(file):
+    file.seek(0)
+    return file.read(STDERR_LIMIT).decode('utf-8', errors='replace').strip()
+
+
+class DumpStream:
+    """
+    Итератор по сжатому выводу ``pg_dump``.
+
+    Процесс запускается в конструкторе, и первая порция читается сразу: если
+    ``pg_dump`` завершился с ошибкой, ничего не выдав, ``BackupError``
+    возникает до начала HTTP-ответа.
+    """
+
+    def __init__(self, args, env=None, compression=None,
+                 chunk_size=CHUNK_SIZE):
+        if compression not in available_compressions():
+            raise BackupError(f"Сжатие недоступно: {compression}")
+        self.args = args
+        self.chunk_size = chunk_size
+        self.compressor = COMPRESSIONS[compression][0]()
+        # stderr - во временный файл: чтение только stdout не может
+        # заблокировать процесс
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                        stderr=self.stderr, env=env)
+        self.bytes_read = 0
+        self.first_chunk = self._read()
+        if not self.first_chunk:
+            self._finish()
+
+    def _read(self):
+        chunk = self.process.stdout.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def _finish(self):
+        self.process.stdout.close()
+        returncode = self.process.wait()
+        message = _read_stderr(self.stderr)
+        self.stderr.close()
+        if returncode != 0:
+            logger.error("%s завершился с кодом %s после %s байт: %s",
+                         os.path.basename(self.args[0]), returncode,
+                         self.bytes_read, message)
+            raise BackupError(f"Ошибка при создании резервной копии "
+                              f"(код {returncode}): {message}")
+
+    def __iter__(self):
+        try:
+            chunk = self.first_chunk
+            while chunk:
+                data = self.compressor.compress(chunk)
+                if data:
+                    yield data
+                chunk = self._read()
+            self._finish()
+            tail = self.compressor.flush()
+            if tail:
+                yield tail
+        finally:
+            self.close()
+
+    def close(self):
+        # Клиент разорвал соединение - останавливаем pg_dump
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if not self.process.stdout.closed:
+            self.process.stdout.close()
+        if not self.stderr.closed:
+            self.stderr.close()
+
+
+def dump_database(compression=None, alias='default'):
+    """
+    Запустить ``pg_dump`` в SQL-формате. Возвращает (DumpStream, имя файла).
+    """
+    args, env, db_name = connection_args(alias)
+    stream = DumpStream(
+        [find_executable('pg_dump'), *args, '-F', 'p', db_name],
+        env, compression)
+    return stream, f"{db_name}_backup.sql{COMPRESSIONS[compression][1]}"
+
+
+# Сигнатуры сжатых файлов
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Как часто сохранять прогресс восстановления, секунд
+PROGRESS_INTERVAL = 1.0
+
+
+class _Passthrough:
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def _open_source(source):
+    """
+    Путь открывается для чтения; открытый файл (например, артефакт)
+    используется как есть.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, 'rb')
+    return contextlib.nullcontext(source)
+
+
+def _source_size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    return source.size
+
+
+def detect_compression(source):
+    """
+    Сжатие по сигнатуре; ``source`` - путь или только что открытый двоичный
+    файл.
+    """
+    with _open_source(source) as file:
+        head = file.read(4)
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def _decompressor(compression):
+    if compression == 'gzip':
+        return zlib.decompressobj(31)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise BackupError(
+                "Для восстановления из zstd нужен пакет zstandard.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return _Passthrough()
+
+
+class _StatementCounter(threading.Thread):
+    """
+    Читает stdout psql: каждая строка - тег выполненной команды (SET,
+    INSERT 0 1, COPY 10...).
+    """
+
+    def __init__(self, stream):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.count = 0
+
+    def run(self):
+        for line in self.stream:
+            if line.strip():
+                self.count += 1
+
+
+def restore_file(source, compression=None, progress=None, alias='default',
+                 chunk_size=CHUNK_SIZE):
+    """
+    Выполнить SQL-дамп ``source`` (путь или двоичный файл) через ``psql``, не
+    загружая его в память.
+
+    ``progress(bytes_processed, statements)`` вызывается не чаще раза в
+    ``PROGRESS_INTERVAL`` секунд. Возвращает (bytes_processed, statements).
+    """
+    args, env, db_name = connection_args(alias)
+    decompressor = _decompressor(compression)
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [find_executable('psql'), *args, '-d', db_name,
+         '-v', 'ON_ERROR_STOP=1', '-f', '-'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr, env=env,
+    )
+    counter = _StatementCounter(process.stdout)
+    counter.start()
+    processed = 0
+    reported = time.monotonic()
+    try:
+        with _open_source(source) as file:
+            while chunk := file.read(chunk_size):
+                processed += len(chunk)
+                process.stdin.write(decompressor.decompress(chunk))
+                if (progress is not None and
+                        time.monotonic() - reported >= PROGRESS_INTERVAL):
+                    progress(processed, counter.count)
+                    reported = time.monotonic()
+        process.stdin.write(decompressor.flush())
+        process.stdin.close()
+    except BrokenPipeError:
+        # psql остановился на ошибке (ON_ERROR_STOP) - причина будет в stderr
+        pass
+    except BaseException:
+        # Файл не читается или не распаковывается: psql ждал бы конца stdin
+        # вечно - останавливаем его и передаём исключение дальше
+        with contextlib.suppress(OSError):
+            process.stdin.close()
+        process.kill()
+        raise
+    finally:
+        returncode = process.wait()
+        counter.join()
+        message = _read_stderr(stderr)
+        stderr.close()
+    if returncode != 0:
+        raise BackupError(f"Ошибка при восстановлении базы данных "
+                          f"(код {returncode}): {message}")
+    return processed, counter.count
+
+
+def start_restore(artifact, user=None):
+    """
+    Создать ``RestoreJob`` для копии из хранилища артефактов и поставить
+    восстановление в очередь.
+    """
+    with artifacts.open_artifact(artifact) as file:
+        compression = detect_compression(file)
+    job = RestoreJob.objects.create(
+        file=artifact.name,
+        artifact=artifact,
+        compression=compression or '',
+        bytes_total=artifact.blob.size,
+    )
+    enqueue(Job.Kind.RESTORE, {'restore_job': job.pk}, user)
+    return job
+
+
+def run_restore_job(job_id, on_progress=None):
+    """
+    Выполнить восстановление ``RestoreJob``; ``on_progress(байт, всего)`` -
+    для очереди задач.
+    """
+    restores = RestoreJob.objects.filter(pk=job_id)
+    try:
+        job = restores.get()
+        restores.update(status=RestoreJob.Status.RUNNING)
+
+        def progress(processed, statements):
+            restores.update(bytes_processed=processed, statements=statements)
+            if on_progress is not None:
+                on_progress(processed, job.bytes_total)
+
+        # Копии до появления хранилища артефактов лежат файлами в BACKUP_ROOT
+        opened = (artifacts.open_artifact(job.artifact) if job.artifact_id
+                  else contextlib.nullcontext(job.file))
+        with opened as source:
+            if job.archive_format == RestoreJob.Format.DIRECTORY:
+                processed, statements = restore_archive(source, job.jobs,
+                                                        progress)
+            else:
+                processed, statements = restore_file(
+                    source, job.compression or None, progress)
+        restores.update(status=RestoreJob.Status.DONE,
+                        bytes_processed=processed, statements=statements)
+        # Файл неудачного восстановления остаётся для разбора; артефакты
+        # удаляются политикой хранения
+        if (job.archive_format == RestoreJob.Format.PLAIN
+                and not job.artifact_id):
+            os.remove(job.file)
+    except Exception as exc:
+        logger.exception("Восстановление #%s не удалось", job_id)
+        restores.update(status=RestoreJob.Status.FAILED, error=str(exc))
+    finally:
+        connections.close_all()
+
+
+def _run(args, env, capture=False):
+    with tempfile.TemporaryFile() as stderr:
+        result = subprocess.run(args,
+                                stdout=(subprocess.PIPE if capture
+                                        else subprocess.DEVNULL),
+                                stderr=stderr, env=env)
+        if result.returncode != 0:
+            raise BackupError(f"{os.path.basename(args[0])} завершился "
+                              f"с кодом {result.returncode}: "
+                              f"{_read_stderr(stderr)}")
+    return result.stdout
+
+
+def dump_directory_archive(output, jobs=4, alias='default'):
+    """
+    ``pg_dump -Fd -j jobs`` во временный каталог и упаковка в tar ``output``
+    (путь или файловый объект с ``write``/``tell``). Возвращает размер
+    архива в байтах.
+    """
+    args, env, db_name = connection_args(alias)
+    os.makedirs(settings.BACKUP_ROOT, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.BACKUP_ROOT) as workdir:
+        target = os.path.join(workdir, 'dump')
+        _run([find_executable('pg_dump'), *args, '-F', 'd', '-j', str(jobs),
+              '-f', target, db_name], env)
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, 'wb') as file:
+                _write_tar(target, file)
+            return os.path.getsize(output)
+        start = output.tell()
+        _write_tar(target, output)
+        return output.tell() - start
+
+
+def _write_tar(directory, file):
+    # Потоковый режим 'w|': архив пишется последовательно, без перемотки файла
+    with tarfile.open(fileobj=file, mode='w|') as tar:
+        for name in sorted(os.listdir(directory)):
+            tar.add(os.path.join(directory, name), arcname=name)
+
+
+def restore_archive(source, jobs=4, progress=None, alias='default'):
+    """
+    Распаковать tar-архив ``pg_dump -Fd`` (путь или двоичный файл) и
+    восстановить его ``pg_restore -j jobs``.
+
+    Объекты базы пересоздаются (``--clean --if-exists``). Возвращает
+    (размер архива, число записей оглавления).
+    """
+    args, env, db_name = connection_args(alias)
+    os.makedirs(settings.BACKUP_ROOT, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.BACKUP_ROOT) as workdir:
+        with _open_source(source) as file, \
+                tarfile.open(fileobj=file, mode='r|') as tar:
+            tar.extractall(workdir, filter='data')
+        if not os.path.exists(os.path.join(workdir, 'toc.dat')):
+            raise BackupError(
+                "Архив не содержит каталог pg_dump -Fd (нет toc.dat).")
+        size = _source_size(source)
+        pg_restore = find_executable('pg_restore')
+        # Оглавление архива: одна строка на объект, комментарии
+        # начинаются с ';'
+        toc = _run([pg_restore, '-l', workdir], env, capture=True)
+        entries = sum(1 for line in toc.splitlines()
+                      if line.strip() and not line.startswith(b';'))
+        if progress is not None:
+            progress(size, 0)
+        _run([pg_restore, *args, '-d', db_name, '-j', str(jobs),
+              '--clean', '--if-exists', workdir], env)
+    return size, entries
+
+
+def run_backup_archive(archive_id):
+    archives = BackupArchive.objects.filter(pk=archive_id)
+    try:
+        archive = archives.get()
+        archives.update(status=BackupArchive.Status.RUNNING)
+        started = time.perf_counter()
+        with artifacts.ArtifactWriter(f"backup-{archive.pk}.tar",
+                                      Artifact.Kind.BACKUP) as writer:
+            size = dump_directory_archive(writer, archive.jobs)
+        archives.update(status=BackupArchive.Status.DONE,
+                        artifact=writer.artifact, size=size,
+                        duration=time.perf_counter() - started)
+    except Exception as exc:
+        logger.exception("Резервная копия #%s не удалась", archive_id)
+        archives.update(status=BackupArchive.Status.FAILED, error=str(exc))
+    finally:
+        connections.close_all()
+
+
+def start_parallel_backup(archive, user=None):
+    """
+    Поставить в очередь создание архива для сохранённого ``BackupArchive``.
+    """
+    enqueue(Job.Kind.BACKUP_ARCHIVE, {'archive': archive.pk}, user)
+
+
+def start_archive_restore(archive, jobs=None, user=None):
+    """
+    Поставить в очередь восстановление из ``BackupArchive``. Возвращает
+    ``RestoreJob``.
+    """
+    job = RestoreJob.objects.create(
+        file=archive.file,
+        artifact=archive.artifact,
+        archive_format=RestoreJob.Format.DIRECTORY,
+        jobs=jobs or archive.jobs,
+        bytes_total=archive.size,
+    )
+    enqueue(Job.Kind.RESTORE, {'restore_job': job.pk}, user)
+    return job
+
+
+def open_backup_archive(archive):
+    """
+    Двоичный файл готового архива: из хранилища артефактов или (старые
+    копии) из BACKUP_ROOT.
+    """
+    if archive.artifact_id:
+        return artifacts.open_artifact(archive.artifact)
+    return open(archive.file, 'rb')
@@ -0,0 +1,250 @@
+"""
+Замеры производительности представлений LibHub на синтетических данных.
+
+Для каждого масштаба (``SCALES``) создаётся отдельная тестовая база
+(как у ``manage.py test``), заполняется генератором
+``library_data_populator`` и для каждого представления из ``endpoints()``
+измеряются:
+
+* задержка (медиана и 95-й перцентиль по ``iterations`` запросам, кэш ответов
+  и готовые задачи очереди удаляются перед каждым запросом - замеряется
+  честная обработка). Задачи, поставленные представлением (отчёты,
+  выгрузки), выполняются тут же и входят в замер: иначе замерялась бы только
+  постановка в очередь;
+* число SQL-запросов;
+* пик памяти Python (tracemalloc, отдельный запрос - трассировка замедляет).
+
+Результаты - JSON (``run``); ``compare`` сравнивает их с сохранённой базовой
+линией и возвращает список регрессий.
+"""
+import platform
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+
+import django
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import jobs
+from .library_data_populator import GeneratorConfig, generate
+from .models import Book, Job, Request, User
+from .query_budget import QueryCounter
+
+SCALES = {
+    'small': dict(users=200, books=2000, authors=400, rentals=20_000),
+    'medium': dict(users=2000, books=20_000, authors=4000, rentals=200_000),
+    'large': dict(users=20_000, books=200_000, authors=40_000,
+                  rentals=2_000_000),
+}
+# Регрессия, если метрика выросла больше чем на threshold и больше
+# абсолютного порога (шум)
+LATENCY_NOISE_MS = 2.0
+MEMORY_NOISE_KIB = 256
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+@dataclass
+class Endpoint:
+    name: str
+    path: str
+    method: str = 'get'
+    # Тяжёлые представления замеряются меньшее число раз
+    max_iterations: int = None
+    # Для запросов, изменяющих данные: путь для i-го повтора
+    path_for: object = None
+
+
+def _rentable_books(user):
+    rented = Request.objects.filter(
+        user=user, status__in=Request.ACTIVE_STATUSES).values('book_id')
+    return list(Book.objects.filter(is_deleted=False, available__gt=0)
+                .exclude(pk__in=rented)
+                .order_by('pk').values_list('pk', flat=True)[:1000])
+
+
+def endpoints(user):
+    """
+    Замеряемые представления; ``user`` - пользователь, от имени которого
+    идут запросы.
+    """
+    books = _rentable_books(user)
+    api = [
+        Endpoint(f"api {basename}", reverse(f'{basename}-list'))
+        for basename in ('user', 'book', 'request', 'genre', 'author',
+                         'language', 'publisher')
+    ]
+    return [
+        Endpoint('book_list', reverse('book_list')),
+        Endpoint('profile', reverse('profile')),
+        Endpoint('RequestsList', reverse('requests')),
+        *api,
+        Endpoint('export_books_to_excel csv',
+                 reverse('export_books') + '?format=csv', max_iterations=5),
+        Endpoint('export_books_to_excel xlsx',
+                 reverse('export_books') + '?format=xlsx', max_iterations=3),
+        Endpoint('rented_books_statistics',
+                 reverse('rented_books_statistics'), max_iterations=3),
+        Endpoint('rent_book', '', method='post',
+                 path_for=lambda index: reverse(
+                     'rent_book', args=[books[index % len(books)]])
+                 if books else None),
+    ]
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _run_jobs(endpoint):
+    """Выполнить в текущем потоке задачи, поставленные представлением."""
+    while (job := jobs.claim('benchmark')) is not None:
+        jobs.execute(job)
+        job.refresh_from_db()
+        if job.status != Job.Status.DONE:
+            raise BenchmarkError(f"{endpoint.name}: задача {job.kind} "
+                                 f"не выполнена: {job.error}")
+
+
+def _request(client, endpoint, index):
+    path = endpoint.path_for(index) if endpoint.path_for else endpoint.path
+    if path is None:
+        raise BenchmarkError(f"{endpoint.name}: нет данных для запроса.")
+    cache.clear()
+    Job.objects.all().delete()
+    counter = QueryCounter()
+    started = time.perf_counter()
+    with counter.track():
+        response = getattr(client, endpoint.method)(path)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        _run_jobs(endpoint)
+    elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise BenchmarkError(
+            f"{endpoint.name}: ответ {response.status_code} на {path}")
+    return elapsed, counter.count, response.status_code
+
+
+def measure(client, endpoint, iterations, warmup=1):
+    """Метрики одного представления: задержка, SQL-запросы, пик памяти."""
+    iterations = min(iterations, endpoint.max_iterations or iterations)
+    index = 0
+    for _ in range(warmup):
+        _request(client, endpoint, index)
+        index += 1
+    timings = []
+    queries = status = 0
+    for _ in range(iterations):
+        elapsed, queries, status = _request(client, endpoint, index)
+        timings.append(elapsed * 1000)
+        index += 1
+    tracemalloc.start()
+    try:
+        _request(client, endpoint, index)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': status,
+        'iterations': iterations,
+        'p50_ms': round(_percentile(timings, 0.5), 2),
+        'p95_ms': round(_percentile(timings, 0.95), 2),
+        'queries': queries,
+        'peak_kib': round(peak / 1024),
+    }
+
+
+def run_scale(scale, iterations=20, seed=42, only=None, progress=None):
+    """
+    Заполнить тестовую базу данными масштаба ``scale`` и замерить
+    представления.
+    """
+    config = GeneratorConfig(**SCALES[scale], seed=seed)
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    try:
+        started = time.perf_counter()
+        generate(config)
+        seeded = time.perf_counter() - started
+        # Пользователь с наибольшим числом активных аренд - самый тяжёлый
+        # профиль
+        user = (User.objects
+                .annotate(active=Count('request', filter=Q(
+                    request__status__in=Request.ACTIVE_STATUSES)))
+                .order_by('-active', 'pk').first())
+        client = Client()
+        client.force_login(user)
+        results = {}
+        for endpoint in endpoints(user):
+            if only and endpoint.name not in only:
+                continue
+            results[endpoint.name] = measure(client, endpoint, iterations)
+            if progress is not None:
+                progress(scale, endpoint.name, results[endpoint.name])
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    return {'config': {key: value for key, value in asdict(config).items()
+                       if key != 'today'},
+            'seed_seconds': round(seeded, 1), 'endpoints': results}
+
+
+def run(scales, iterations=20, seed=42, only=None, progress=None):
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'iterations': iterations,
+        },
+        'scales': {scale: run_scale(scale, iterations, seed, only, progress)
+                   for scale in scales},
+    }
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Регрессии ``results`` относительно ``baseline``: рост медианной задержки
+    или пика памяти больше чем на ``threshold`` (доля) и шумового порога,
+    любой рост числа SQL-запросов. Представление или масштаб, которых нет в
+    базовой линии, - тоже ошибка: новое представление без замера прошло бы
+    проверку.
+    Возвращает список строк.
+    """
+    regressions = []
+    for scale, measured in results['scales'].items():
+        expected = (baseline.get('scales', {}).get(scale, {})
+                    .get('endpoints', {}))
+        for name, current in measured['endpoints'].items():
+            label = f"{scale} / {name}"
+            previous = expected.get(name)
+            if previous is None:
+                regressions.append(f"{label}: нет в базовой линии "
+                                   f"(обновите её, --update-baseline)")
+                continue
+            if current['queries'] > previous['queries']:
+                regressions.append(f"{label}: SQL-запросов "
+                                   f"{previous['queries']} -> "
+                                   f"{current['queries']}")
+            if (current['p50_ms'] > previous['p50_ms'] * (1 + threshold)
+                    and (current['p50_ms'] - previous['p50_ms']
+                         > LATENCY_NOISE_MS)):
+                regressions.append(f"{label}: медиана {previous['p50_ms']} "
+                                   f"-> {current['p50_ms']} мс")
+            if (current['peak_kib'] > previous['peak_kib'] * (1 + threshold)
+                    and (current['peak_kib'] - previous['peak_kib']
+                         > MEMORY_NOISE_KIB)):
+                regressions.append(f"{label}: пик памяти "
+                                   f"{previous['peak_kib']} -> "
+                                   f"{current['peak_kib']} КиБ")
+    return regressions
@@ -0,0 +1,199 @@
+"""
+Кэш ответов с версионированием по моделям.
+
+Для каждой модели в кэше хранится счётчик версии. Ключ закэшированного ответа
+включает версии всех моделей, от которых он зависит, поэтому любое изменение
+модели (сигналы post_save/post_delete/m2m_changed и массовые операции
+``VersionedQuerySet``) увеличивает версию, и старые записи просто перестают
+находиться - явная инвалидация не нужна.
+
+Работает с любым backend'ом Django (locmem, Redis): используются только
+``get_many``/``add``/``incr``/``set``.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+CACHE_ALIAS = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+KEY_PREFIX = 'libhub'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(model):
+    return f"{KEY_PREFIX}:version:{model._meta.label_lower}"
+
+
+def _initial_version():
+    # Начальная версия уникальна во времени: после вытеснения счётчика из кэша
+    # старые записи не "оживут" с совпавшей версией
+    return time.time_ns()
+
+
+def bump_model_version(model):
+    """Увеличить версию модели после фиксации текущей транзакции."""
+    def bump():
+        cache = _cache()
+        key = _version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def get_model_versions(models):
+    cache = _cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _stats_key(namespace, outcome):
+    return f"{KEY_PREFIX}:stats:{namespace}:{outcome}"
+
+
+def _record(namespace, outcome):
+    cache = _cache()
+    key = _stats_key(namespace, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+# Пространства имён, для которых собирается статистика
+_NAMESPACES = set()
+
+
+def register_namespace(namespace):
+    _NAMESPACES.add(namespace)
+    return namespace
+
+
+def cache_stats():
+    """Статистика попаданий/промахов по пространствам имён кэша."""
+    cache = _cache()
+    stats = {}
+    for namespace in sorted(_NAMESPACES):
+        values = cache.get_many([_stats_key(namespace, 'hit'),
+                                 _stats_key(namespace, 'miss')])
+        hits = values.get(_stats_key(namespace, 'hit'), 0)
+        misses = values.get(_stats_key(namespace, 'miss'), 0)
+        total = hits + misses
+        stats[namespace] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None,
+        }
+    return stats
+
+
+def response_cache_key(namespace, request, models, vary=''):
+    path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+    versions = '.'.join(str(version) for version in get_model_versions(models))
+    return f"{KEY_PREFIX}:response:{namespace}:{path}:{versions}:{vary}"
+
+
+def _html_vary(request):
+    """
+    Вариант ключа для HTML-страниц.
+
+    Анонимные пользователи получают общую копию. Страницы авторизованных
+    содержат CSRF-токен, поэтому кэшируются отдельно для каждой пары
+    (пользователь, CSRF-cookie); без cookie страница не кэшируется.
+    """
+    if not request.user.is_authenticated:
+        return 'anon'
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not csrf_cookie:
+        return None
+    return (f"{request.user.pk}:"
+            f"{hashlib.md5(csrf_cookie.encode('ascii')).hexdigest()}")
+
+
+def versioned_cache_page(*models, namespace=None, timeout=None):
+    """
+    Закэшировать GET-ответ функции-представления до изменения любой из
+    ``models``.
+    """
+    def decorator(view_func):
+        name = register_namespace(namespace or view_func.__name__)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            vary = _html_vary(request) if request.method == 'GET' else None
+            if vary is None:
+                return view_func(request, *args, **kwargs)
+
+            cache = _cache()
+            key = response_cache_key(name, request, models, vary)
+            response = cache.get(key)
+            if response is not None:
+                _record(name, 'hit')
+                return response
+
+            _record(name, 'miss')
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+                cache.set(key, response, RESPONSE_CACHE_TIMEOUT
+                          if timeout is None else timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+class VersionedCacheMixin:
+    """
+    Кэширование ``list`` для ViewSet'ов.
+
+    ``cache_models`` - модели, от которых зависит выдача. Кэшируются
+    сериализованные данные, поэтому формат ответа по-прежнему выбирается
+    согласованием содержимого.
+    """
+    cache_models = ()
+    cache_timeout = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if getattr(cls, 'queryset', None) is not None:
+            register_namespace(cls.cache_namespace())
+
+    @classmethod
+    def cache_namespace(cls):
+        return f"api:{cls.queryset.model._meta.model_name}"
+
+    def get_cache_models(self):
+        return self.cache_models or (self.queryset.model,)
+
+    def list(self, request, *args, **kwargs):
+        namespace = self.cache_namespace()
+        cache = _cache()
+        key = response_cache_key(namespace, request, self.get_cache_models())
+        data = cache.get(key)
+        if data is not None:
+            _record(namespace, 'hit')
+            return Response(data)
+
+        _record(namespace, 'miss')
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            timeout = (RESPONSE_CACHE_TIMEOUT if self.cache_timeout is None
+                       else self.cache_timeout)
+            cache.set(key, response.data, timeout)
+        return response
@@ -0,0 +1,147 @@
+"""
+Построение диаграмм для отчётов.
+
+Диаграмма строится через объектный API matplotlib (``Figure`` и холст Agg) без
+глобального состояния ``pyplot``, поэтому рендер безопасен из любых потоков.
+Сам рендер выполняется в пуле процессов, где matplotlib импортирован заранее:
+одновременные отчёты строятся параллельно и не держат GIL процесса-воркера.
+
+* Форматы - PNG и SVG.
+* Подписей больше ``MAX_SLICES`` не бывает: мелкие доли объединяются в
+  "Другие", время рендера не растёт с числом книг.
+* ``PROCESSES = 0`` - рендер в текущем процессе (например, для отладки).
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger('LibHub.charts')
+
+DEFAULTS = {
+    'PROCESSES': 2,
+    'MAX_SLICES': 12,
+    'TIMEOUT': 60,
+}
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+OTHER_LABEL = 'Другие'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHARTS', {})}
+
+
+def bucket(counts, max_slices):
+    """
+    Оставить ``max_slices - 1`` крупнейших долей, остальные сложить в
+    "Другие".
+    """
+    counts = sorted(counts, key=lambda row: row[1], reverse=True)
+    if len(counts) <= max_slices:
+        return counts
+    head, tail = counts[:max_slices - 1], counts[max_slices - 1:]
+    return head + [(OTHER_LABEL, sum(count for _, count in tail))]
+
+
+def _warm_up():
+    # Импорт matplotlib и загрузка шрифтов - однократно при старте процесса
+    # пула
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: F401
+    from matplotlib.figure import Figure
+    Figure().savefig(BytesIO(), format='png')
+
+
+def _render_pie(counts, title, image_format):
+    from matplotlib import colormaps
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.set_title(title)
+    if not any(count > 0 for _, count in counts):
+        # Пустой pie() даёт NaN-доли (предупреждение) и пустые оси
+        axes.text(0.5, 0.5, 'Нет данных', ha='center', va='center',
+                  fontsize=20, color='gray', transform=axes.transAxes)
+        axes.axis('off')
+    else:
+        axes.pie([count for _, count in counts],
+                 labels=[label for label, _ in counts], autopct='%1.1f%%',
+                 startangle=90, colors=colormaps['tab20'].colors)
+        axes.axis('equal')  # Обеспечиваем круговую диаграмму
+    image = BytesIO()
+    figure.savefig(image, format=image_format)
+    return image.getvalue()
+
+
+def _get_pool(processes):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: процесс пула не наследует потоки и подключения к базе
+            # процесса-родителя
+            _pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_warm_up)
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    """Остановить пул (при завершении воркера)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def render_pie(counts, title, image_format='png'):
+    """
+    Круговая диаграмма по парам (подпись, значение); возвращает байты PNG
+    или SVG.
+    """
+    if image_format not in FORMATS:
+        raise ValueError(f"Неизвестный формат диаграммы: {image_format}")
+    config = get_config()
+    counts = bucket(counts, config['MAX_SLICES'])
+    started = time.perf_counter()
+    if not config['PROCESSES']:
+        image = _render_pie(counts, title, image_format)
+    else:
+        pool = _get_pool(config['PROCESSES'])
+        try:
+            image = pool.submit(_render_pie, counts, title,
+                                image_format).result(timeout=config['TIMEOUT'])
+        except BrokenProcessPool:
+            # Процесс пула упал (например, по памяти) - пул пересоздаётся
+            # при следующем вызове
+            logger.exception("Пул построения диаграмм недоступен, "
+                             "диаграмма строится в текущем процессе")
+            _reset_pool(pool)
+            image = _render_pie(counts, title, image_format)
+    metrics.CHART_RENDER_SECONDS.observe(time.perf_counter() - started,
+                                         format=image_format)
+    return image
@@ -0,0 +1,89 @@
+"""
+Условные GET-запросы (ETag) для API каталога.
+
+ETag считается одним агрегирующим запросом по отфильтрованному QuerySet -
+``MAX(updated_at)`` и ``COUNT(*)`` - без сериализации строк. Если клиент
+прислал совпадающий ``If-None-Match``, ответ ``304`` возвращается сразу
+после проверки прав, до выборки и сериализации данных.
+
+``Last-Modified`` не отдаётся: удаление строки (кроме самой новой) не
+меняет ``MAX(updated_at)``, и ``If-Modified-Since`` вернул бы 304 на
+устаревшие данные. В ETag удаление видно по числу строк.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class NotModified(Exception):
+    pass
+
+
+class ConditionalGetMixin:
+    """
+    Поддержка условных GET для ``list`` и ``retrieve`` ViewSet'а.
+
+    Модель должна иметь поле ``updated_at``.
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def get_conditional_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset
+
+    def get_etag(self, request):
+        """ETag текущего запроса."""
+        state = self.get_conditional_queryset().order_by().aggregate(
+            last_modified=Max('updated_at'), count=Count('pk')
+        )
+        last_modified = state['last_modified']
+        # ETag зависит и от представления: фильтры, курсор и формат ответа
+        fingerprint = ':'.join([
+            self.get_queryset().model._meta.label_lower,
+            last_modified.isoformat() if last_modified else '-',
+            str(state['count']),
+            request.get_full_path(),
+            getattr(request, 'accepted_media_type', '') or '',
+        ])
+        return quote_etag(hashlib.md5(fingerprint.encode('utf-8')).hexdigest())
+
+    def _is_not_modified(self, request, etag):
+        if_none_match = request.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags or f'W/{etag}' in etags
+
+    def initial(self, request, *args, **kwargs):
+        # Аутентификация, права и согласование формата - до проверки
+        # валидаторов
+        super().initial(request, *args, **kwargs)
+        self.conditional_etag = None
+        if (request.method in SAFE_METHODS
+                and self.action in self.conditional_actions):
+            self.conditional_etag = self.get_etag(request)
+            if self._is_not_modified(request, self.conditional_etag):
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args,
+                                             **kwargs)
+        etag = getattr(self, 'conditional_etag', None)
+        if etag and response.status_code in (status.HTTP_200_OK,
+                                             status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+        return response
@@ -0,0 +1,85 @@
+"""
+Операции миграций для построения индексов без блокировки записи.
+
+На PostgreSQL индексы создаются и удаляются ``CONCURRENTLY`` (как
+``django.contrib.postgres.operations.AddIndexConcurrently``), на остальных
+базах - обычными ``CREATE INDEX`` / ``DROP INDEX``. Своя реализация нужна,
+чтобы миграции не импортировали ``django.contrib.postgres`` (и psycopg) при
+разработке на SQLite.
+
+Миграция с этими операциями должна объявлять ``atomic = False``:
+``CREATE INDEX CONCURRENTLY`` нельзя выполнять внутри транзакции.
+"""
+from django.db import migrations
+from django.db.migrations.operations.base import OperationCategory
+from django.db.utils import NotSupportedError
+
+
+def _concurrently(schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    if schema_editor.connection.in_atomic_block:
+        raise NotSupportedError(
+            "Построение индекса CONCURRENTLY невозможно в транзакции: "
+            "объявите в миграции atomic = False."
+        )
+    return True
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    category = OperationCategory.ADDITION
+
+    def describe(self):
+        return (f"Concurrently create index {self.index.name} "
+                f"on {self.model_name}")
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if _concurrently(schema_editor):
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if _concurrently(schema_editor):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+
+class RemoveIndexConcurrently(migrations.RemoveIndex):
+    category = OperationCategory.REMOVAL
+
+    def describe(self):
+        return f"Concurrently remove index {self.name} from {self.model_name}"
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        index = from_state.models[
+            app_label, self.model_name_lower].get_index_by_name(self.name)
+        if _concurrently(schema_editor):
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        index = to_state.models[
+            app_label, self.model_name_lower].get_index_by_name(self.name)
+        if _concurrently(schema_editor):
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
@@ -0,0 +1,165 @@
+"""
+Потоковая выгрузка каталога книг в CSV, Excel и Parquet.
+
+Книги читаются порциями по ``id`` (keyset), авторы и жанры каждой порции -
+одним запросом на связь; строки сразу передаются писателю формата, поэтому
+потребление памяти не зависит от размера каталога:
+
+* CSV отдаётся клиенту по мере чтения;
+* Excel пишется через write-only книгу openpyxl (листы сбрасываются во
+  временные файлы), затем готовый файл отдаётся частями;
+* Parquet пишется группами строк через pyarrow (необязательная зависимость).
+"""
+import csv
+import io
+import tempfile
+from collections import defaultdict
+
+from .models import Book
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_COLUMNS = ('Title', 'Publication Year', 'Authors', 'Genres')
+EXPORT_CHUNK_SIZE = 2000
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class ExportFormatUnavailable(Exception):
+    pass
+
+
+def export_queryset():
+    return Book.objects.all()
+
+
+def _related_names(through, target, fields, ids):
+    """{id книги: "имя, имя"} для связи M2M одним запросом по порции книг."""
+    names = defaultdict(list)
+    rows = through.objects.filter(book_id__in=ids).order_by('pk').values_list(
+        'book_id', *(f'{target}__{name}' for name in fields)
+    )
+    for book_id, *parts in rows:
+        names[book_id].append(' '.join(parts))
+    return {book_id: ', '.join(values) for book_id, values in names.items()}
+
+
+def export_rows(queryset=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Строки выгрузки в порядке ``EXPORT_COLUMNS``.
+
+    Книги читаются порциями по ``id`` (keyset), авторы и жанры порции - двумя
+    запросами к промежуточным таблицам; объекты моделей не создаются.
+    """
+    queryset = export_queryset() if queryset is None else queryset
+    queryset = queryset.order_by('id').values_list('id', 'name',
+                                                   'publication_year')
+    last_id = 0
+    while True:
+        books = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not books:
+            return
+        ids = [book[0] for book in books]
+        authors = _related_names(Book.authors.through, 'author',
+                                 ('first_name', 'last_name'), ids)
+        genres = _related_names(Book.genres.through, 'genre', ('name',), ids)
+        for book_id, name, publication_year in books:
+            yield (name, publication_year, authors.get(book_id, ''),
+                   genres.get(book_id, ''))
+        last_id = ids[-1]
+
+
+def _stream_file(file):
+    file.seek(0)
+    while True:
+        block = file.read(STREAM_BLOCK_SIZE)
+        if not block:
+            break
+        yield block
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM - чтобы Excel правильно открыл UTF-8 с кириллицей
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= STREAM_BLOCK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def stream_xlsx(rows):
+    # Импорт здесь: openpyxl нужен только для этого формата
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Books')
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        yield from _stream_file(file)
+
+
+def stream_parquet(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    if pyarrow is None:
+        raise ExportFormatUnavailable(
+            "Для выгрузки в Parquet нужен пакет pyarrow.")
+    schema = pyarrow.schema([
+        ('Title', pyarrow.string()),
+        ('Publication Year', pyarrow.int32()),
+        ('Authors', pyarrow.string()),
+        ('Genres', pyarrow.string()),
+    ])
+
+    def batches():
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    with tempfile.TemporaryFile() as file:
+        with pyarrow.parquet.ParquetWriter(file, schema) as writer:
+            for batch in batches():
+                arrays = [pyarrow.array(column, type=field.type)
+                          for column, field in zip(zip(*batch), schema)]
+                writer.write_batch(
+                    pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+        yield from _stream_file(file)
+
+
+EXPORT_FORMATS = {
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument'
+                          '.spreadsheetml.sheet'),
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'parquet': (stream_parquet, 'application/vnd.apache.parquet'),
+}
+
+
+def available_formats():
+    return [name for name in EXPORT_FORMATS
+            if name != 'parquet' or pyarrow is not None]
+
+
+def export_books(export_format, rows=None):
+    """
+    Вернуть (генератор байтов, content type) для формата ``export_format``.
+    """
+    if export_format not in available_formats():
+        raise ExportFormatUnavailable(
+            f"Формат выгрузки недоступен: {export_format}")
+    writer, content_type = EXPORT_FORMATS[export_format]
+    return writer(export_rows() if rows is None else rows), content_type
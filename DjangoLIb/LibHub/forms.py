@@ -1,4 +1,5 @@
 from django import forms
+from . import rentals
 from .models import User, Language, Publisher, Genre, Author, Book, Request
 from django.contrib.auth.forms import AuthenticationForm
 
@@ -70,7 +71,7 @@ class BookForm(forms.ModelForm):
     class Meta:
         model = Book
         fields = [
-            'name', 'publication_year', 'language', 'cover_url',
+            'name', 'publication_year', 'language', 'cover_url', 'quantity',
             'is_deleted', 'publishers', 'genres', 'authors'
         ]
         labels = {
@@ -78,6 +79,7 @@ class BookForm(forms.ModelForm):
             'publication_year': 'Год публикации',
             'language': 'Язык',
             'cover_url': 'Ссылка на обложку',
+            'quantity': 'Количество экземпляров',
             'is_deleted': 'Удалено',
             'publishers': 'Издатели',
             'genres': 'Жанры',
@@ -97,6 +99,17 @@ class RequestForm(forms.ModelForm):
             'status': 'Статус',
         }
 
+    def clean(self):
+        cleaned_data = super().clean()
+        fields = {name: cleaned_data.get(name)
+                  for name in ('user', 'book', 'status')}
+        if all(fields.values()):
+            try:
+                rentals.check_rental(Request(pk=self.instance.pk, **fields))
+            except rentals.RentalError as e:
+                raise forms.ValidationError(str(e))
+        return cleaned_data
+
 
 class AuthenticationForm(AuthenticationForm):
     username = forms.CharField(
@@ -0,0 +1,291 @@
+"""
+Очередь фоновых задач в базе данных.
+
+Тяжёлая работа (отчёты, выгрузки, резервные копии, восстановление) не
+выполняется в HTTP-запросе: представление создаёт ``Job`` (``enqueue``) и
+сразу отвечает, а задачи выполняет ``manage.py run_jobs``. Обработчики
+объявляются декоратором ``@task`` в ``LibHub/tasks.py``.
+
+* Захват задачи - условный ``UPDATE ... WHERE status = 'PENDING'``: из
+  нескольких воркеров задачу получит ровно один.
+* Для каждого вида задач задан предел одновременно выполняемых
+  (``concurrency``, переопределяется ``JOB_QUEUE['CONCURRENCY']``); после
+  захвата предел проверяется ещё раз, лишняя задача возвращается в очередь.
+* Упавшая задача повторяется до ``max_attempts`` раз с растущей паузой;
+  ``PermanentJobError`` завершает её сразу.
+* Воркер отмечает свои задачи (``heartbeat_at``); задачи остановившегося
+  воркера через ``STALE_TIMEOUT`` возвращаются в очередь.
+* Периодические задачи (``@task(..., every=...)``, интервал
+  переопределяется ``JOB_QUEUE['SCHEDULE']``) ставит в очередь сам воркер
+  (``enqueue_periodic``): одна задача на интервал, ключ - номер интервала.
+* Медленные SQL-запросы обработчика записываются в журнал
+  (LibHub/slow_queries.py) под именем ``job:<вид>``.
+* Результат - словарь ``Job.result`` и, если обработчик записал файл через
+  ``context.writer()``, артефакт для скачивания. Задачи с ключом (``key``)
+  переиспользуют готовый результат, пока ключ не изменится.
+"""
+import datetime
+import logging
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import artifacts, slow_queries
+from .models import Artifact, Job
+
+logger = logging.getLogger('LibHub.jobs')
+
+DEFAULTS = {
+    'CONCURRENCY': {},
+    'STALE_TIMEOUT': 300,
+    'HEARTBEAT_INTERVAL': 15,
+    # {вид задачи: интервал в секундах} поверх заданных в @task(every=...)
+    'SCHEDULE': {},
+}
+# Как часто сохранять прогресс задачи, секунд
+PROGRESS_INTERVAL = 1.0
+# Сколько ожидающих задач рассматривать за один выбор
+CLAIM_WINDOW = 50
+# Как часто воркер ставит периодические задачи (enqueue_periodic), секунд
+SCHEDULE_CHECK_INTERVAL = 60
+
+TASKS = {}
+
+
+class PermanentJobError(Exception):
+    """Ошибка, при которой повтор бесполезен (неверные параметры и т.п.)."""
+
+
+@dataclass
+class TaskType:
+    kind: str
+    handler: object
+    concurrency: int
+    max_attempts: int
+    retry_delay: datetime.timedelta
+    every: datetime.timedelta = None
+
+    @property
+    def limit(self):
+        return get_config()['CONCURRENCY'].get(self.kind, self.concurrency)
+
+    @property
+    def interval(self):
+        """Интервал периодического запуска или None."""
+        seconds = get_config()['SCHEDULE'].get(self.kind)
+        if seconds is not None:
+            return datetime.timedelta(seconds=seconds)
+        return self.every
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JOB_QUEUE', {})}
+
+
+def task(kind, concurrency=1, max_attempts=3,
+         retry_delay=datetime.timedelta(seconds=30), every=None):
+    """
+    Зарегистрировать обработчик ``handler(job, context)`` задач вида ``kind``.
+    С ``every`` задача ставится в очередь каждые ``every`` (см.
+    ``enqueue_periodic``).
+    """
+    def decorator(handler):
+        TASKS[kind] = TaskType(kind, handler, concurrency, max_attempts,
+                               retry_delay, every)
+        return handler
+    return decorator
+
+
+def enqueue(kind, params=None, user=None, key=''):
+    """
+    Поставить задачу в очередь. В транзакции задача станет видна воркерам
+    после её фиксации.
+
+    Если задан ``key`` и задача того же вида с этим ключом ждёт, выполняется
+    или выполнена и её файл ещё хранится, новая не создаётся - возвращается
+    она.
+    """
+    task_type = TASKS[kind]
+    if key:
+        existing = (Job.objects.filter(kind=kind, key=key)
+                    .filter(Q(status__in=[Job.Status.PENDING,
+                                          Job.Status.RUNNING])
+                            | Q(status=Job.Status.DONE,
+                                artifact__isnull=False))
+                    .select_related('artifact__blob').order_by('-pk').first())
+        if existing is not None:
+            return existing
+    return Job.objects.create(
+        kind=kind,
+        params=params or {},
+        key=key,
+        requested_by=(user if user is not None and user.is_authenticated
+                      else None),
+        max_attempts=task_type.max_attempts,
+    )
+
+
+def enqueue_periodic(now=None):
+    """
+    Поставить в очередь периодические задачи, которых ещё нет в текущем
+    интервале. Возвращает созданные задачи.
+
+    Ключ задачи - номер интервала от начала эпохи, поэтому воркеры,
+    вызывающие функцию одновременно, почти всегда находят задачу друг друга;
+    редкий дубль безопасен - периодические обработчики идемпотентны.
+    """
+    now = now or timezone.now()
+    created = []
+    for kind, task_type in TASKS.items():
+        interval = task_type.interval
+        if not interval:
+            continue
+        key = f'periodic:{int(now.timestamp() // interval.total_seconds())}'
+        if Job.objects.filter(kind=kind, key=key).exists():
+            continue
+        created.append(Job.objects.create(
+            kind=kind, key=key, max_attempts=task_type.max_attempts))
+    return created
+
+
+class JobContext:
+    """
+    Передаётся обработчику: прогресс и запись результата в хранилище
+    артефактов.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.writers = []
+        self._saved_at = 0.0
+
+    def progress(self, done, total=None, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._saved_at < PROGRESS_INTERVAL:
+            return
+        self._saved_at = now
+        fields = {'progress_done': done, 'heartbeat_at': timezone.now()}
+        if total is not None:
+            fields['progress_total'] = total
+        if message is not None:
+            fields['progress_message'] = message[:200]
+        Job.objects.filter(pk=self.job.pk).update(**fields)
+
+    def writer(self, name, kind=Artifact.Kind.REPORT):
+        """
+        Файловый объект для результата; артефакт привязывается к задаче
+        после записи.
+        """
+        writer = artifacts.ArtifactWriter(name, kind)
+        self.writers.append(writer)
+        return writer
+
+    @property
+    def artifact(self):
+        saved = [writer.artifact for writer in self.writers
+                 if writer.artifact is not None]
+        return saved[-1] if saved else None
+
+
+def claim(worker, kinds=None):
+    """
+    Захватить следующую задачу с учётом пределов по видам. Возвращает
+    ``Job`` или None.
+    """
+    kinds = [kind for kind in TASKS if kinds is None or kind in kinds]
+    running = dict(Job.objects.filter(status=Job.Status.RUNNING,
+                                      kind__in=kinds)
+                   .values_list('kind').annotate(count=Count('id')))
+    free = {kind: TASKS[kind].limit - running.get(kind, 0) for kind in kinds}
+    now = timezone.now()
+    pending = (Job.objects.filter(status=Job.Status.PENDING,
+                                  run_after__lte=now,
+                                  kind__in=[kind for kind, slots
+                                            in free.items() if slots > 0])
+               .order_by('run_after', 'pk')
+               .values_list('pk', 'kind')[:CLAIM_WINDOW])
+    for pk, kind in pending:
+        if free[kind] <= 0:
+            continue
+        taken = Job.objects.filter(pk=pk, status=Job.Status.PENDING).update(
+            status=Job.Status.RUNNING, worker=worker, started_at=now,
+            heartbeat_at=now, attempts=F('attempts') + 1,
+        )
+        if not taken:
+            continue
+        # Два воркера могли одновременно увидеть свободное место: из
+        # выполняющихся остаются limit самых ранних, остальные возвращаются
+        # в очередь
+        allowed = (Job.objects.filter(kind=kind, status=Job.Status.RUNNING)
+                   .order_by('started_at', 'pk')
+                   .values_list('pk', flat=True)[:TASKS[kind].limit])
+        if pk not in list(allowed):
+            Job.objects.filter(pk=pk).update(
+                status=Job.Status.PENDING, worker='', started_at=None,
+                attempts=F('attempts') - 1)
+            free[kind] = 0
+            continue
+        return Job.objects.get(pk=pk)
+    return None
+
+
+def _retry_at(task_type, attempts):
+    return timezone.now() + task_type.retry_delay * 2 ** max(attempts - 1, 0)
+
+
+def execute(job):
+    """Выполнить захваченную задачу и сохранить результат или ошибку."""
+    task_type = TASKS[job.kind]
+    context = JobContext(job)
+    jobs = Job.objects.filter(pk=job.pk)
+    try:
+        with ExitStack() as stack:
+            if slow_queries.get_config()['ENABLED']:
+                stack.enter_context(slow_queries.capture(f"job:{job.kind}"))
+            result = task_type.handler(job, context) or {}
+    except Exception as exc:
+        logger.exception(
+            "Задача #%s (%s) завершилась ошибкой, попытка %s из %s",
+            job.pk, job.kind, job.attempts, job.max_attempts)
+        if (isinstance(exc, PermanentJobError)
+                or job.attempts >= job.max_attempts):
+            jobs.update(status=Job.Status.FAILED, error=str(exc),
+                        finished_at=timezone.now())
+        else:
+            jobs.update(status=Job.Status.PENDING, error=str(exc), worker='',
+                        run_after=_retry_at(task_type, job.attempts))
+    else:
+        jobs.update(status=Job.Status.DONE, result=result,
+                    artifact=context.artifact, error='',
+                    finished_at=timezone.now())
+    finally:
+        for connection in connections.all(initialized_only=True):
+            connection.close()
+
+
+def heartbeat(job_ids):
+    if job_ids:
+        Job.objects.filter(pk__in=job_ids, status=Job.Status.RUNNING).update(
+            heartbeat_at=timezone.now())
+
+
+def requeue_stale(now=None):
+    """
+    Вернуть в очередь (или завершить ошибкой) задачи воркеров, переставших
+    отмечаться.
+    """
+    now = now or timezone.now()
+    stale = Job.objects.filter(status=Job.Status.RUNNING,
+                               heartbeat_at__lt=now - datetime.timedelta(
+                                   seconds=get_config()['STALE_TIMEOUT']))
+    message = "Воркер перестал отвечать."
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.Status.FAILED, error=message, finished_at=now)
+    retried = stale.update(status=Job.Status.PENDING, error=message,
+                           worker='', run_after=now)
+    return retried, failed
@@ -1,108 +1,402 @@
-import os
+"""
+Генератор тестовых данных LibHub.
+
+``populate_data()`` - небольшой набор (по 5 записей каждой модели) для ручной
+проверки; ``generate(config)`` - детерминированный генератор нагрузочных
+данных любого объёма (команда ``generate_library_data``).
+
+Строки вставляются ``bulk_create`` пачками, включая промежуточные таблицы
+M2M. Работа разбита на задачи по ``batch_size`` строк; у каждой задачи свой
+генератор случайных чисел, зависящий только от ``seed`` и номера задачи,
+а первичные ключи каталога назначаются заранее (максимальный id + номер
+строки). Поэтому задачи независимы, их можно выполнять в пуле процессов, и
+результат не зависит от числа процессов.
+
+Популярность книг распределена по закону Ципфа (книга с рангом r выдаётся
+пропорционально 1 / r^s), число авторов, жанров и издательств у книги -
+равномерно в заданных пределах. Активные аренды (RENTED/EXPIRED) создаются
+вместе с книгами, не больше числа экземпляров, и ``available`` сразу
+учитывает их; остальные аренды - завершённые (RETURNED).
+"""
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
 import django
+import numpy
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
 
-# Указание пути к настройкам Django
-os.environ['DJANGO_SETTINGS_MODULE'] = 'LibHub.settings'
+from . import rollups
+from .logical_backup import reset_sequences
+from .models import (Author, Book, Genre, Language, Publisher, RentalRollup,
+                     Request, User)
 
-# Если необходимо, инициализируем Django
+FIRST_NAMES = ['Anna', 'Ivan', 'Maria', 'Petr', 'Olga', 'Sergey', 'Elena',
+               'Dmitry', 'Irina', 'Alexey', 'Natalia', 'Mikhail', 'Tatiana',
+               'Nikolay', 'Svetlana', 'Andrey', 'Ekaterina', 'Pavel']
+LAST_NAMES = ['Ivanov', 'Petrova', 'Smirnov', 'Kuznetsova', 'Popov',
+              'Vasilieva', 'Sokolov', 'Mikhailova', 'Novikov', 'Fedorova',
+              'Morozov', 'Volkova', 'Alekseev', 'Lebedeva', 'Semenov',
+              'Egorova']
+TITLE_WORDS = ['Silent', 'Golden', 'Lost', 'Northern', 'Winter', 'Hidden',
+               'Last', 'Crimson', 'Distant', 'Old']
+TITLE_NOUNS = ['River', 'Garden', 'Empire', 'Letter', 'Island', 'Road',
+               'Kingdom', 'House', 'Song', 'Storm']
+COVER_URL = 'http://covers.example/{}.jpg'
+LOAN_DAYS = 14
+# Активные аренды начались не раньше, чем столько дней назад; завершённые -
+# раньше
+ACTIVE_WINDOW_DAYS = 30
+# Модели с заранее назначенными первичными ключами
+KEYED_MODELS = [Language, Publisher, Genre, Author, User, Book]
 
-django.setup()
 
-from LibHub.models import (
-    User, Language, Publisher, Genre, Author, Book, Request
-)
+@dataclass
+class GeneratorConfig:
+    users: int = 1000
+    books: int = 10_000
+    authors: int = 2000
+    genres: int = 50
+    publishers: int = 100
+    languages: int = 10
+    rentals: int = 100_000
+    seed: int = 42
+    # Показатель s распределения Ципфа для популярности книг
+    book_zipf: float = 1.1
+    authors_per_book: tuple = (1, 3)
+    genres_per_book: tuple = (1, 3)
+    publishers_per_book: tuple = (0, 2)
+    max_copies: int = 5
+    # Доля активных аренд среди всех
+    active_share: float = 0.05
+    history_days: int = 730
+    batch_size: int = 5000
+    today: date = field(default_factory=date.today)
 
-from datetime import datetime, timedelta
-from random import choice, randint, sample
-# Заполнение моделей тестовыми данными
-def populate_data():
-    # 2. User
-    # Удаление всех существующих записей пользователей с почтой user{n}@example.com, где n от 1 до 6
-    email_pattern_qs = User.objects.filter(email__regex=r'^user[0-6]@example\.com$')
-    for user in email_pattern_qs:
-        user.delete()
-
-    users = [
-        {"email": f"user{n}@example.com",
-         "first_name": f"FirstName{n}",
-         "last_name": f"LastName{n}",
-         "is_active": True,
-         "is_staff": False if n % 2 == 0 else True}
-        for n in range(1, 6)
-    ]
-    user_objects = [User.objects.create(**user) for user in users]
+    @property
+    def active_rentals(self):
+        return round(self.rentals * self.active_share)
 
-    # 3. Language
-    languages = [
-        {"name": lang, "chars_code": lang[:2], "is_deleted": False}
-        for lang in ["English", "Spanish", "French", "German", "Russian"]
-    ]
-    language_objects = [Language.objects.create(**language) for language in languages]
 
-    # 4. Publisher
-    publishers = [
-        {"name": f"Publisher{n}", "address": f"Address{n}", "is_deleted": False}
-        for n in range(1, 6)
-    ]
-    publisher_objects = [Publisher.objects.create(**publisher) for publisher in publishers]
+def letters(number):
+    """
+    Номер в виде слова из латинских букв: 0 - A, 25 - Z, 26 - BA (имена без
+    цифр для валидаторов).
+    """
+    word = ''
+    while True:
+        number, digit = divmod(number, 26)
+        word = chr(ord('A') + digit) + word
+        if not number:
+            return word
 
-    # 5. Genre
-    genres = [
-        {"name": f"Genre{n}", "is_deleted": False}
-        for n in range(1, 6)
-    ]
-    genre_objects = [Genre.objects.create(**genre) for genre in genres]
-
-    # 6. Author
-    authors = [
-        {"first_name": f"AuthorFirstName{n}",
-         "last_name": f"AuthorLastName{n}",
-         "middle_name": f"AuthorMiddleName{n}",
-         "is_deleted": False}
-        for n in range(1, 6)
-    ]
-    author_objects = [Author.objects.create(**author) for author in authors]
-
-    # 7. Book
-    books = [
-        {
-            "name": f"Book{n}",
-            "publication_year": randint(2000, 2023),
-            "language": choice(language_objects),
-            "cover_url": f"http://example.com/cover{n}.jpg",
-            "is_deleted": False,
-            "publishers": sample(publisher_objects, k=2),
-            "genres": sample(genre_objects, k=2),
-            "authors": sample(author_objects, k=2),
-        }
-        for n in range(1, 6)
-    ]
-    book_objects = []
-    for book in books:
-        publishers = book.pop("publishers")
-        genres = book.pop("genres")
-        authors = book.pop("authors")
-        book_obj = Book.objects.create(**book)
-        book_obj.publishers.set(publishers)
-        book_obj.genres.set(genres)
-        book_obj.authors.set(authors)
-        book_objects.append(book_obj)
-
-    # 8. Request
-    requests = [
-        {
-            "user": choice(user_objects),
-            "borrow_date": datetime.now() - timedelta(days=randint(1, 30)),
-            "return_date": datetime.now() + timedelta(days=randint(1, 30)),
-            "book": choice(book_objects),
-            "status": choice(["RENTED", "EXPIRED", "RETURNED"])
-        }
-        for _ in range(5)
+
+def _rng(config, phase, start):
+    return numpy.random.default_rng([config.seed, PHASES.index(phase), start])
+
+
+@functools.lru_cache(maxsize=4)
+def _popularity(books, exponent):
+    """Вероятности выдачи книг по рангу и их накопленная сумма."""
+    weights = 1.0 / numpy.arange(1, books + 1, dtype=numpy.float64) ** exponent
+    probabilities = weights / weights.sum()
+    return probabilities, numpy.cumsum(probabilities)
+
+
+def _fan_out(rng, count, bounds, total):
+    """
+    Для ``count`` книг - списки различных индексов связанных объектов (из
+    ``total``).
+    """
+    if not total:
+        return [[] for _ in range(count)]
+    low, high = bounds
+    sizes = numpy.minimum(rng.integers(low, high + 1, count), total)
+    targets = rng.integers(0, total, int(sizes.sum()))
+    # По возрастанию индекса - в том же порядке, в каком связи читает
+    # search.build_search_document
+    return [sorted(set(group.tolist()))
+            for group in numpy.split(targets, numpy.cumsum(sizes)[:-1])]
+
+
+def _author_name(index, seed):
+    return (FIRST_NAMES[index % len(FIRST_NAMES)],
+            LAST_NAMES[(index // len(FIRST_NAMES) + seed) % len(LAST_NAMES)])
+
+
+def _languages(config, bases, start, stop):
+    rows = []
+    for index in range(start, stop):
+        key = bases[Language] + 1 + index
+        rows.append(Language(id=key, name=f"Language {letters(key)}",
+                             chars_code='X' + letters(key)))
+    Language.objects.bulk_create(rows)
+    return {Language: len(rows)}
+
+
+def _publishers(config, bases, start, stop):
+    rows = []
+    for index in range(start, stop):
+        key = bases[Publisher] + 1 + index
+        rows.append(Publisher(id=key, name=f"Publisher {letters(key)}",
+                              address=f"Main street {key}, Moscow"))
+    Publisher.objects.bulk_create(rows)
+    return {Publisher: len(rows)}
+
+
+def _genres(config, bases, start, stop):
+    Genre.objects.bulk_create([
+        Genre(id=bases[Genre] + 1 + index,
+              name=f"Genre {letters(bases[Genre] + 1 + index)}")
+        for index in range(start, stop)
+    ])
+    return {Genre: stop - start}
+
+
+def _authors(config, bases, start, stop):
+    rows = []
+    for index in range(start, stop):
+        first_name, last_name = _author_name(index, config.seed)
+        rows.append(Author(id=bases[Author] + 1 + index,
+                           first_name=first_name, last_name=last_name))
+    Author.objects.bulk_create(rows)
+    return {Author: len(rows)}
+
+
+@functools.lru_cache(maxsize=1)
+def _password(seed):
+    # Один хэш на всех: PBKDF2 на каждого пользователя занял бы часы
+    return make_password('synthetic-password', salt=f'synthetic{seed}')
+
+
+def _users(config, bases, start, stop):
+    rng = _rng(config, 'users', start)
+    first = rng.integers(0, len(FIRST_NAMES), stop - start)
+    last = rng.integers(0, len(LAST_NAMES), stop - start)
+    password = _password(config.seed)
+    rows = []
+    for offset, index in enumerate(range(start, stop)):
+        key = bases[User] + 1 + index
+        rows.append(User(id=key,
+                         email=f"user{key}.{config.seed}@synthetic.example",
+                         password=password,
+                         first_name=FIRST_NAMES[first[offset]],
+                         last_name=LAST_NAMES[last[offset]]))
+    User.objects.bulk_create(rows)
+    return {User: len(rows)}
+
+
+def _books(config, bases, start, stop):
+    rng = _rng(config, 'books', start)
+    count = stop - start
+    years = rng.integers(1800, config.today.year + 1, count)
+    languages = rng.integers(0, config.languages, count)
+    quantities = rng.integers(1, config.max_copies + 1, count)
+    words = rng.integers(0, len(TITLE_WORDS), count)
+    nouns = rng.integers(0, len(TITLE_NOUNS), count)
+    authors = _fan_out(rng, count, config.authors_per_book, config.authors)
+    genres = _fan_out(rng, count, config.genres_per_book, config.genres)
+    publishers = _fan_out(rng, count, config.publishers_per_book,
+                          config.publishers)
+
+    # Активные аренды: ожидаемое число пропорционально популярности, не
+    # больше экземпляров
+    probabilities, _ = _popularity(config.books, config.book_zipf)
+    active = numpy.minimum(quantities, rng.poisson(
+        config.active_rentals * probabilities[start:stop]))
+    # Один пользователь не может одновременно арендовать два экземпляра книги
+    renters = [
+        list(dict.fromkeys(group.tolist()))
+        for group in numpy.split(
+            rng.integers(0, max(config.users, 1), int(active.sum())),
+            numpy.cumsum(active)[:-1])
     ]
-    request_objects = [Request.objects.create(**request) for request in requests]
+    borrowed_days_ago = rng.integers(0, ACTIVE_WINDOW_DAYS + 1,
+                                     int(active.sum())).tolist()
 
-    print("Тестовые данные успешно добавлены.")
+    books, requests = [], []
+    links = {
+        Book.authors.through: [],
+        Book.genres.through: [],
+        Book.publishers.through: [],
+    }
+    for offset in range(count):
+        key = bases[Book] + 1 + start + offset
+        name = (f"{TITLE_WORDS[words[offset]]} {TITLE_NOUNS[nouns[offset]]} "
+                f"{key}")
+        author_names = [' '.join(_author_name(index, config.seed))
+                        for index in authors[offset]]
+        genre_names = [f"Genre {letters(bases[Genre] + 1 + index)}"
+                       for index in genres[offset]]
+        users = renters[offset]
+        books.append(Book(
+            id=key, name=name, publication_year=int(years[offset]),
+            language_id=bases[Language] + 1 + int(languages[offset]),
+            cover_url=COVER_URL.format(key),
+            quantity=int(quantities[offset]),
+            available=int(quantities[offset]) - len(users),
+            # Как search.build_search_document, но без запросов к базе
+            search_document=' '.join([name, *author_names, *genre_names]),
+        ))
+        links[Book.authors.through].extend(
+            Book.authors.through(book_id=key,
+                                 author_id=bases[Author] + 1 + index)
+            for index in authors[offset])
+        links[Book.genres.through].extend(
+            Book.genres.through(book_id=key,
+                                genre_id=bases[Genre] + 1 + index)
+            for index in genres[offset])
+        links[Book.publishers.through].extend(
+            Book.publishers.through(book_id=key,
+                                    publisher_id=bases[Publisher] + 1 + index)
+            for index in publishers[offset])
+        for user in users:
+            borrow_date = config.today - timedelta(
+                days=borrowed_days_ago.pop())
+            return_date = borrow_date + timedelta(days=LOAN_DAYS)
+            status = (Request.RequestStatus.EXPIRED
+                      if return_date < config.today
+                      else Request.RequestStatus.RENTED)
+            requests.append(Request(user_id=bases[User] + 1 + user,
+                                    book_id=key, borrow_date=borrow_date,
+                                    return_date=return_date, status=status))
+
+    Book.objects.bulk_create(books)
+    for through, rows in links.items():
+        through.objects.bulk_create(rows)
+    Request.objects.bulk_create(requests)
+    return {Book: count, Request: len(requests),
+            **{through: len(rows) for through, rows in links.items()}}
+
+
+def _history(config, bases, start, stop):
+    rng = _rng(config, 'history', start)
+    count = stop - start
+    _, cumulative = _popularity(config.books, config.book_zipf)
+    books = numpy.minimum(numpy.searchsorted(cumulative, rng.random(count),
+                                             side='right'), config.books - 1)
+    users = rng.integers(0, config.users, count)
+    today = numpy.datetime64(config.today, 'D')
+    borrow = today - rng.integers(
+        ACTIVE_WINDOW_DAYS + 1,
+        max(config.history_days, ACTIVE_WINDOW_DAYS + 1) + 1,
+        count).astype('timedelta64[D]')
+    due = borrow + numpy.timedelta64(LOAN_DAYS, 'D')
+    returned = borrow + rng.integers(1, ACTIVE_WINDOW_DAYS + 1,
+                                     count).astype('timedelta64[D]')
+    Request.objects.bulk_create([
+        Request(user_id=bases[User] + 1 + user,
+                book_id=bases[Book] + 1 + book, borrow_date=borrow_date,
+                return_date=return_date, returned_at=returned_at,
+                status=Request.RequestStatus.RETURNED)
+        for user, book, borrow_date, return_date, returned_at in zip(
+            users.tolist(), books.tolist(), borrow.tolist(), due.tolist(),
+            returned.tolist())
+    ])
+    return {Request: count}
+
+
+# Этапы в порядке зависимостей: задачи этапа независимы друг от друга
+PHASES = ['languages', 'publishers', 'genres', 'authors', 'users', 'books',
+          'history']
+TASKS = {
+    'languages': _languages, 'publishers': _publishers, 'genres': _genres,
+    'authors': _authors, 'users': _users, 'books': _books,
+    'history': _history,
+}
 
 
-# Запуск функции заполнения
-populate_data()
\ No newline at end of file
+def _phase_size(config, phase, generated):
+    if phase == 'history':
+        # Активные аренды уже созданы вместе с книгами
+        return max(
+            config.rentals - generated.get(Request._meta.label_lower, 0), 0)
+    return getattr(config, phase)
+
+
+def _run_task(config, bases, phase, start, stop):
+    with transaction.atomic():
+        counts = TASKS[phase](config, bases, start, stop)
+    return {model._meta.label_lower: rows for model, rows in counts.items()}
+
+
+def _init_worker():
+    django.setup()
+
+
+def _validate(config, bases):
+    if config.books and not config.languages:
+        raise ValueError("Для книг нужен хотя бы один язык.")
+    if config.rentals and not (config.books and config.users):
+        raise ValueError("Для аренд нужны книги и пользователи.")
+    if (config.languages
+            and len(letters(bases[Language] + config.languages)) > 4):
+        raise ValueError(
+            "Слишком много языков: код языка - не больше 5 символов.")
+
+
+def generate(config, workers=1, progress=None):
+    """
+    Сгенерировать данные по ``config`` в ``workers`` процессах.
+
+    ``progress(phase, rows, seconds)`` вызывается после каждого этапа.
+    Возвращает {label модели: число строк}.
+    """
+    bases = {model: model._base_manager.order_by('-pk')
+             .values_list('pk', flat=True).first() or 0
+             for model in KEYED_MODELS}
+    _validate(config, bases)
+    if connections['default'].vendor == 'sqlite':
+        # SQLite не допускает параллельной записи
+        workers = 1
+    generated = {}
+    executor = None
+    if workers > 1:
+        # Дочерние процессы открывают свои соединения
+        connections.close_all()
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=_init_worker)
+    try:
+        for phase in PHASES:
+            started = time.perf_counter()
+            total = _phase_size(config, phase, generated)
+            ranges = [(start, min(start + config.batch_size, total))
+                      for start in range(0, total, config.batch_size)]
+            if executor is None:
+                results = (_run_task(config, bases, phase, start, stop)
+                           for start, stop in ranges)
+            else:
+                futures = [executor.submit(_run_task, config, bases, phase,
+                                           start, stop)
+                           for start, stop in ranges]
+                results = (future.result() for future in futures)
+            rows = 0
+            for counts in results:
+                for label, count in counts.items():
+                    generated[label] = generated.get(label, 0) + count
+                rows += sum(counts.values())
+            if progress is not None:
+                progress(phase, rows, time.perf_counter() - started)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    reset_sequences(KEYED_MODELS)
+    if generated.get(Request._meta.label_lower):
+        # Аренды вставлены в обход rentals.rent_book - дневные сводки
+        # пересобираются целиком
+        started = time.perf_counter()
+        rebuilt = rollups.rebuild(workers=workers)
+        generated[RentalRollup._meta.label_lower] = rebuilt.rows
+        if progress is not None:
+            progress('rollups', rebuilt.rows, time.perf_counter() - started)
+    return generated
+
+
+def populate_data():
+    """Небольшой набор тестовых данных: по 5 записей каждой модели."""
+    generate(GeneratorConfig(users=5, books=5, authors=5, genres=5,
+                             publishers=5, languages=5, rentals=5))
+    print("Тестовые данные успешно добавлены.")
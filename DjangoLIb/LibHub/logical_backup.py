@@ -0,0 +1,537 @@
+"""
+Логическая резервная копия моделей LibHub средствами Django.
+
+Не требует клиентских утилит СУБД и работает на любом backend'е (PostgreSQL,
+SQLite в CI и на стенде). Копия - каталог:
+
+* ``manifest.json`` - версия формата, время создания, для каждой таблицы
+  список колонок, файлов и число строк;
+* ``<app>.<model>.<n>.ndjson.gz`` - порции строк: одна JSON-строка (список
+  значений колонок) на запись.
+
+Таблицы выгружаются параллельно в потоках, каждая через
+``iterator(chunk_size=...)``; на PostgreSQL все потоки читают один
+экспортированный снимок (``pg_export_snapshot``), поэтому копия согласована.
+Восстановление идёт по таблицам в порядке зависимостей многострочными
+INSERT пачками (как ``bulk_create``, но без ``pre_save``) в одной транзакции
+с отложенной проверкой внешних ключей (как ``loaddata``). Память ограничена
+размером пачки на обоих этапах. Сводки аренд (``RentalRollup``) в копию не
+входят: восстановление пересобирает их по арендам в той же транзакции.
+
+Инкрементальная копия (``dump(..., base=...)``) содержит только строки с
+``updated_at`` не раньше границы базовой копии (``horizon`` в манифесте),
+связи изменённых книг и записи ``Tombstone`` об удалениях. Восстановление
+применяет базовую (полную) копию, затем цепочку инкрементальных: изменённые
+строки вставляются с заменой по первичному ключу, связи книг заменяются
+целиком, удалённые строки удаляются.
+
+Граница копии - момент, после которого могут появиться строки, не попавшие
+в снимок. ``updated_at`` ставится до фиксации транзакции, поэтому на
+PostgreSQL это начало самой старой транзакции, выполнявшейся при снятии
+снимка (``pg_stat_activity.xact_start``), а не время копии; на других
+backend'ах - время копии минус ``DELTA_OVERLAP``. После полной копии записи
+``Tombstone`` старше её границы удаляются: они больше не нужны ни одной
+инкрементальной копии, построенной на ней или на более новых. Инкрементальная
+копия от более старой базы после этого невозможна - ``dump`` отказывает.
+"""
+import datetime
+import decimal
+import gzip
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from . import rollups
+from .cache import bump_model_version
+from .models import (Author, Book, Checkpoint, Genre, Language, Publisher,
+                     RentalRollup, Request, Tombstone, User)
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+CHUNK_SIZE = 5000
+ROWS_PER_FILE = 100_000
+BATCH_SIZE = 2000
+# Граница копии вне PostgreSQL (и у копий без horizon в манифесте): updated_at
+# ставится до фиксации транзакции, а строка становится видна только после неё
+DELTA_OVERLAP = datetime.timedelta(minutes=5)
+# Граница, до которой журнал удалений очищен (см. prune_tombstones)
+TOMBSTONE_CHECKPOINT = 'logical-backup-tombstones'
+
+# Модели в порядке зависимостей; промежуточные таблицы M2M идут после обеих
+# сторон. Связи User с группами и правами не копируются: они ссылаются на
+# таблицы auth, идентификаторы которых различаются между базами.
+BACKUP_MODELS = [Language, Publisher, Genre, Author, User, Book, Request]
+
+
+class LogicalBackupError(Exception):
+    pass
+
+
+def backup_models():
+    models = list(BACKUP_MODELS)
+    for field in Book._meta.many_to_many:
+        models.append(field.remote_field.through)
+    return models
+
+
+def _columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def _json_default(value):
+    # В отличие от DjangoJSONEncoder время сохраняется с микросекундами
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"Значение {type(value).__name__} не сериализуется в JSON")
+
+
+def _file_name(model, index):
+    return f"{model._meta.label_lower}.{index:05d}.ndjson.gz"
+
+
+def _export_snapshot(alias):
+    """
+    На PostgreSQL - открыть транзакцию снимка и вернуть его идентификатор.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("SELECT pg_export_snapshot()")
+        return cursor.fetchone()[0]
+
+
+def _horizon(alias, created_at):
+    """
+    Граница копии: строки, зафиксированные после снимка, имеют ``updated_at``
+    не раньше неё. Вызывается в транзакции снимка.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return created_at - DELTA_OVERLAP
+    # Транзакции других сеансов, начатые до снимка, могут зафиксироваться
+    # после него; LEAST пропускает NULL (других транзакций нет)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT LEAST(now(), min(xact_start)) FROM pg_stat_activity "
+            "WHERE pid <> pg_backend_pid() AND datname = current_database()"
+        )
+        return cursor.fetchone()[0]
+
+
+def _base_horizon(manifest):
+    if 'horizon' in manifest:
+        return datetime.datetime.fromisoformat(manifest['horizon'])
+    return (datetime.datetime.fromisoformat(manifest['created_at'])
+            - DELTA_OVERLAP)
+
+
+def pruned_before(alias=DEFAULT_DB_ALIAS):
+    """Время, до которого журнал удалений очищен, или None."""
+    value = (Checkpoint.objects.using(alias).filter(name=TOMBSTONE_CHECKPOINT)
+             .values_list('value', flat=True).first())
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value['pruned_before'])
+
+
+def prune_tombstones(horizon, alias=DEFAULT_DB_ALIAS):
+    """
+    Удалить записи журнала удалений старше ``horizon``. Возвращает их число.
+    """
+    pruned = pruned_before(alias)
+    if pruned is not None and horizon <= pruned:
+        # Граница не сдвигается назад: удалённые записи уже не вернуть
+        return 0
+    with transaction.atomic(using=alias):
+        deleted, _ = Tombstone.objects.using(alias).filter(
+            deleted_at__lt=horizon).delete()
+        Checkpoint.objects.using(alias).update_or_create(
+            name=TOMBSTONE_CHECKPOINT,
+            defaults={'value': {'pruned_before': horizon.isoformat()}})
+    return deleted
+
+
+def _use_snapshot(alias, snapshot):
+    if snapshot is None:
+        return
+    with connections[alias].cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("SET TRANSACTION SNAPSHOT %s", [snapshot])
+
+
+def dump_model(model, directory, queryset=None, snapshot=None,
+               alias=DEFAULT_DB_ALIAS, chunk_size=CHUNK_SIZE,
+               rows_per_file=ROWS_PER_FILE):
+    """Выгрузить таблицу модели порциями. Возвращает описание для манифеста."""
+    columns = _columns(model)
+    if queryset is None:
+        queryset = model._base_manager.using(alias).all()
+    files = []
+    rows = 0
+    output = None
+    try:
+        with transaction.atomic(using=alias):
+            _use_snapshot(alias, snapshot)
+            for row in queryset.order_by('pk').values_list(
+                    *columns).iterator(chunk_size=chunk_size):
+                if rows % rows_per_file == 0:
+                    if output is not None:
+                        output.close()
+                    files.append(_file_name(model, len(files)))
+                    output = gzip.open(os.path.join(directory, files[-1]),
+                                       'wt', encoding='utf-8',
+                                       compresslevel=6)
+                output.write(json.dumps(row, default=_json_default,
+                                        ensure_ascii=False,
+                                        separators=(',', ':')))
+                output.write('\n')
+                rows += 1
+    finally:
+        if output is not None:
+            output.close()
+        connections[alias].close()
+    return {'columns': columns, 'files': files, 'rows': rows}
+
+
+def delta_querysets(since, alias=DEFAULT_DB_ALIAS):
+    """
+    {модель: QuerySet} строк, изменённых или удалённых начиная с ``since``.
+    """
+    querysets = {
+        model: model._base_manager.using(alias).filter(updated_at__gte=since)
+        for model in BACKUP_MODELS
+    }
+    for field in Book._meta.many_to_many:
+        # Изменение связей отмечает книгу изменённой
+        # (signals.bump_cache_version_on_m2m)
+        querysets[field.remote_field.through] = (
+            field.remote_field.through._base_manager.using(alias).filter(
+                book__updated_at__gte=since
+            ))
+    querysets[Tombstone] = Tombstone.objects.using(alias).filter(
+        deleted_at__gte=since)
+    return querysets
+
+
+def dump(directory, workers=4, alias=DEFAULT_DB_ALIAS, chunk_size=CHUNK_SIZE,
+         rows_per_file=ROWS_PER_FILE, querysets=None, extra=None, base=None):
+    """
+    Выгрузить модели LibHub в ``directory`` в ``workers`` потоков.
+
+    ``base`` - каталог предыдущей копии (полной или инкрементальной): тогда
+    выгружаются только изменения после неё. ``querysets`` - необязательный
+    {модель: QuerySet} для выборочной выгрузки, ``extra`` - дополнительные
+    поля манифеста. Полная копия всех строк очищает журнал удалений до своей
+    границы. Возвращает манифест.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        raise LogicalBackupError(
+            f"Каталог {directory} уже содержит резервную копию.")
+    models = backup_models()
+    querysets = querysets or {}
+    created_at = timezone.now()
+    extra = {'id': uuid.uuid4().hex, 'kind': 'full', **(extra or {})}
+    if base is not None:
+        base_manifest = read_manifest(base)
+        if 'id' not in base_manifest:
+            raise LogicalBackupError(
+                f"Копия в {base} создана без идентификатора и не может быть "
+                f"базой.")
+        since = _base_horizon(base_manifest)
+        pruned = pruned_before(alias)
+        if pruned is not None and since < pruned:
+            raise LogicalBackupError(
+                f"Журнал удалений очищен до {pruned.isoformat()} более новой "
+                f"полной копией; создайте инкрементальную копию от неё.")
+        querysets = {**delta_querysets(since, alias), **querysets}
+        models.append(Tombstone)
+        extra.update(kind='delta', base=base_manifest['id'],
+                     since=since.isoformat())
+    full = base is None and not querysets
+    connection = connections[alias]
+    with transaction.atomic(using=alias):
+        # Снимок живёт, пока открыта экспортировавшая его транзакция
+        snapshot = _export_snapshot(alias)
+        horizon = _horizon(alias, created_at)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                model: executor.submit(dump_model, model, directory,
+                                       querysets.get(model), snapshot, alias,
+                                       chunk_size, rows_per_file)
+                for model in models
+            }
+            tables = {model._meta.label_lower: futures[model].result()
+                      for model in models}
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'vendor': connection.vendor,
+        'created_at': created_at.isoformat(),
+        'horizon': horizon.isoformat(),
+        'tables': tables,
+        **extra,
+    }
+    with open(os.path.join(directory, MANIFEST), 'w',
+              encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    if full:
+        # Журнал очищается только после записи манифеста: копия готова
+        prune_tombstones(horizon, alias)
+    return manifest
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        raise LogicalBackupError(f"В каталоге {directory} нет {MANIFEST}.")
+    if manifest.get('format') != FORMAT_VERSION:
+        raise LogicalBackupError(
+            f"Неподдерживаемая версия формата: {manifest.get('format')}")
+    return manifest
+
+
+def iter_rows(directory, table):
+    for name in table['files']:
+        with gzip.open(os.path.join(directory, name), 'rt',
+                       encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
+
+
+def load_model(model, directory, table, alias=DEFAULT_DB_ALIAS,
+               batch_size=BATCH_SIZE, upsert=False):
+    """
+    Загрузить таблицу из копии пачками. Возвращает число строк.
+
+    Строки вставляются как ``bulk_create``, но в "сыром" режиме (как
+    ``loaddata``): ``auto_now`` и другие ``pre_save`` не перезаписывают
+    сохранённые значения. ``upsert`` - заменять существующие строки с тем же
+    первичным ключом (инкрементальная копия).
+    """
+    columns = table['columns']
+    fields_by_column = {field.attname: field
+                        for field in model._meta.concrete_fields}
+    missing = [column for column in columns if column not in fields_by_column]
+    if missing:
+        raise LogicalBackupError(
+            f"{model._meta.label}: неизвестные колонки {', '.join(missing)}")
+    fields = [fields_by_column[column] for column in columns]
+    queryset = model._base_manager.using(alias)
+    conflict = {}
+    if upsert:
+        pk = model._meta.pk
+        conflict = {
+            'on_conflict': OnConflict.UPDATE,
+            'update_fields': [field for field in fields if field is not pk],
+            'unique_fields': [pk],
+        }
+    batch_size = min(batch_size, connections[alias].ops.bulk_batch_size(
+        fields, [None] * batch_size) or batch_size)
+    batch = []
+    loaded = 0
+    for values in iter_rows(directory, table):
+        batch.append(model(**{
+            field.attname: None if value is None else field.to_python(value)
+            for field, value in zip(fields, values)
+        }))
+        if len(batch) >= batch_size:
+            queryset._insert(batch, fields=fields, raw=True, using=alias,
+                             **conflict)
+            loaded += len(batch)
+            batch = []
+    if batch:
+        queryset._insert(batch, fields=fields, raw=True, using=alias,
+                         **conflict)
+        loaded += len(batch)
+    return loaded
+
+
+def _batched(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _delete_rows(model, ids, alias, batch_size):
+    for batch in _batched(ids, batch_size):
+        queryset = model._base_manager.using(alias).filter(pk__in=batch)
+        if model is User:
+            # Как в clear(): у пользователя есть связи вне копии
+            queryset.delete()
+        else:
+            queryset._raw_delete(alias)
+
+
+def apply_delta(directory, manifest, alias=DEFAULT_DB_ALIAS,
+                batch_size=BATCH_SIZE, progress=None):
+    """
+    Применить инкрементальную копию к базе (внутри транзакции restore).
+
+    Изменённые строки заменяются по первичному ключу, связи изменённых книг -
+    целиком, затем удаляются строки из журнала удалений. Возвращает
+    {label: строк}.
+    """
+    tables = manifest['tables']
+    counts = {}
+    book_table = tables.get(Book._meta.label_lower)
+    changed_books = []
+    if book_table is not None:
+        pk_index = book_table['columns'].index(Book._meta.pk.attname)
+        changed_books = [values[pk_index]
+                         for values in iter_rows(directory, book_table)]
+
+    deleted = {}
+    tombstones = tables.get(Tombstone._meta.label_lower)
+    if tombstones is not None:
+        columns = tombstones['columns']
+        model_index, id_index = (columns.index('model'),
+                                 columns.index('object_id'))
+        for values in iter_rows(directory, tombstones):
+            deleted.setdefault(values[model_index], set()).add(
+                values[id_index])
+
+    for model in backup_models():
+        label = model._meta.label_lower
+        table = tables.get(label)
+        through = model not in BACKUP_MODELS
+        if through:
+            # Связи изменённых книг заменяются набором из копии
+            for batch in _batched(changed_books, batch_size):
+                model._base_manager.using(alias).filter(
+                    book_id__in=batch)._raw_delete(alias)
+        if table is None:
+            continue
+        counts[label] = load_model(model, directory, table, alias, batch_size,
+                                   upsert=not through)
+        if progress is not None:
+            progress(label, counts[label])
+
+    throughs = backup_models()[len(BACKUP_MODELS):]
+    for model in reversed(BACKUP_MODELS):
+        ids = sorted(deleted.get(model._meta.label_lower, ()))
+        if ids:
+            # Связи удаляются каскадом без сигналов - журнала для них нет
+            for through in throughs:
+                for field in through._meta.concrete_fields:
+                    if field.is_relation and field.related_model is model:
+                        for batch in _batched(ids, batch_size):
+                            through._base_manager.using(alias).filter(
+                                **{f'{field.name}__in': batch}
+                            )._raw_delete(alias)
+            _delete_rows(model, ids, alias, batch_size)
+            if progress is not None:
+                progress(f"{model._meta.label_lower} (удалено)", len(ids))
+    return counts
+
+
+def clear(alias=DEFAULT_DB_ALIAS):
+    """Удалить строки копируемых таблиц (в обратном порядке зависимостей)."""
+    for model in reversed(backup_models()):
+        if model is User:
+            # На пользователей ссылаются таблицы вне копии (токены, журнал
+            # админки) - удаляем через ORM с каскадом
+            model._base_manager.using(alias).all().delete()
+        else:
+            model._base_manager.using(alias).all()._raw_delete(alias)
+
+
+def _delta_chain(manifest, deltas):
+    """
+    Прочитать манифесты инкрементальных копий и проверить, что они образуют
+    цепочку.
+    """
+    chain = []
+    previous = manifest
+    for directory in deltas:
+        delta = read_manifest(directory)
+        if delta.get('kind') != 'delta':
+            raise LogicalBackupError(
+                f"{directory} - не инкрементальная копия.")
+        if delta['base'] != previous.get('id'):
+            raise LogicalBackupError(
+                f"{directory} построена не на предыдущей копии цепочки "
+                f"(база {delta['base']})."
+            )
+        chain.append((directory, delta))
+        previous = delta
+    return chain
+
+
+def restore(directory, alias=DEFAULT_DB_ALIAS, batch_size=BATCH_SIZE,
+            replace=False, progress=None, deltas=()):
+    """
+    Восстановить копию из ``directory`` в одной транзакции.
+
+    ``deltas`` - каталоги инкрементальных копий, применяемых по порядку после
+    базовой. ``replace`` - предварительно очистить таблицы; иначе таблицы
+    должны быть пустыми. ``progress(label, rows)`` вызывается после каждой
+    таблицы. Возвращает {label: число строк}.
+    """
+    manifest = read_manifest(directory)
+    if manifest.get('kind') == 'delta':
+        raise LogicalBackupError(
+            f"{directory} - инкрементальная копия; укажите полную копию, на "
+            f"которой она построена.")
+    chain = _delta_chain(manifest, deltas)
+    models = backup_models()
+    counts = {}
+    connection = connections[alias]
+    with transaction.atomic(using=alias):
+        with connection.constraint_checks_disabled():
+            if replace:
+                clear(alias)
+            else:
+                occupied = [model._meta.label for model in models
+                            if model._base_manager.using(alias).exists()]
+                if occupied:
+                    raise LogicalBackupError(
+                        f"Таблицы не пусты: {', '.join(occupied)}. "
+                        f"Используйте replace (--replace)."
+                    )
+            for model in models:
+                table = manifest['tables'].get(model._meta.label_lower)
+                if table is None:
+                    continue
+                counts[model._meta.label_lower] = load_model(
+                    model, directory, table, alias, batch_size)
+                if progress is not None:
+                    progress(model._meta.label_lower,
+                             counts[model._meta.label_lower])
+            for delta_directory, delta in chain:
+                for label, rows in apply_delta(delta_directory, delta, alias,
+                                               batch_size, progress).items():
+                    counts[label] = counts.get(label, 0) + rows
+        # Внешние ключи проверяются один раз, после загрузки всех таблиц
+        connection.check_constraints(
+            table_names=[model._meta.db_table for model in models])
+        reset_sequences(models, alias)
+        # Сводки аренд не копируются - пересобираются по восстановленным
+        # арендам в той же транзакции
+        rebuilt = rollups.rebuild_all(alias)
+        if progress is not None:
+            progress(f"{RentalRollup._meta.label_lower} (пересобрано)",
+                     rebuilt)
+        for model in BACKUP_MODELS:
+            bump_model_version(model)
+    return counts
+
+
+def reset_sequences(models, alias=DEFAULT_DB_ALIAS):
+    connection = connections[alias]
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LibHub import backups
+from LibHub.models import BackupArchive
+
+
+class Command(BaseCommand):
+    help = ("Параллельная резервная копия PostgreSQL (pg_dump -Fd -j N), "
+            "упакованная в tar. Без --output архив сохраняется в хранилище "
+            "артефактов и появляется в админке")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=4,
+                            help="Число параллельных потоков pg_dump")
+        parser.add_argument('--output', help="Путь к tar-файлу")
+
+    def handle(self, *args, **options):
+        if options['output']:
+            started = time.perf_counter()
+            try:
+                size = backups.dump_directory_archive(options['output'],
+                                                      options['jobs'])
+            except backups.BackupError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f"Архив {options['output']}: {size / 2 ** 20:.1f} МБ "
+                f"за {time.perf_counter() - started:.1f} с"
+            ))
+            return
+
+        archive = BackupArchive.objects.create(jobs=options['jobs'])
+        backups.run_backup_archive(archive.pk)
+        archive.refresh_from_db()
+        if archive.status != BackupArchive.Status.DONE:
+            raise CommandError(archive.error)
+        self.stdout.write(self.style.SUCCESS(
+            f"Архив #{archive.pk} {archive.artifact.name} "
+            f"(sha256 {archive.artifact.blob.sha256}): "
+            f"{archive.size / 2 ** 20:.1f} МБ за {archive.duration:.1f} с"
+        ))
@@ -0,0 +1,92 @@
+import datetime
+import json
+import resource
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from LibHub import analytics
+from LibHub.library_data_populator import GeneratorConfig, generate
+from LibHub.models import Request
+
+
+class Command(BaseCommand):
+    help = ("Замер аналитики аренд (LibHub/analytics.py) на отдельной "
+            "тестовой базе, по умолчанию 10 млн аренд: время расчёта, строк "
+            "в секунду, размер JSON и рост памяти для каждого периода "
+            "агрегации с разбивкой по жанрам и без")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rentals', type=int, default=10_000_000)
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--books', type=int, default=200_000)
+        parser.add_argument('--history-days', type=int, default=730)
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Процессы генератора данных (на SQLite "
+                                 "всегда 1)")
+        parser.add_argument('--iterations', type=int, default=3)
+        parser.add_argument('--chunk-size', type=int,
+                            default=analytics.CHUNK_SIZE)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Не удалять тестовую базу: повторный запуск "
+                                 "не генерирует данные заново")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False,
+            keepdb=options['keepdb'])
+        try:
+            missing = options['rentals'] - Request.objects.count()
+            if missing > 0:
+                self.stdout.write(f"Генерация {missing} аренд...")
+                started = time.perf_counter()
+                generate(GeneratorConfig(users=options['users'],
+                                         books=options['books'],
+                                         authors=options['books'] // 10,
+                                         rentals=missing,
+                                         history_days=options['history_days'],
+                                         seed=options['seed']),
+                         workers=options['workers'])
+                self.stdout.write(f"Данные созданы за "
+                                  f"{time.perf_counter() - started:.1f} с")
+            rows = Request.objects.count()
+            # Вся история: для дневных рядов с жанрами - последние 365 дней
+            # (предел числа точек)
+            end = Request.objects.latest('borrow_date').borrow_date
+            first = Request.objects.earliest('borrow_date').borrow_date
+            self.stdout.write(
+                f"Аренд в базе: {rows}, выдачи с {first} по {end}")
+            for bucket in analytics.BUCKETS:
+                for group in (None, 'genre'):
+                    start = first
+                    if bucket == 'day' and group:
+                        start = max(first,
+                                    end - datetime.timedelta(days=364))
+                    self._measure(bucket, group, start, end,
+                                  options['iterations'], options['chunk_size'])
+        finally:
+            if not options['keepdb']:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _measure(self, bucket, group, start, end, iterations, chunk_size):
+        timings = []
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for _ in range(iterations):
+            started = time.perf_counter()
+            result = analytics.rental_series(start, end, bucket, group,
+                                             chunk_size=chunk_size)
+            timings.append(time.perf_counter() - started)
+        size = len(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+        median = statistics.median(timings)
+        # ru_maxrss - в КБ (Linux)
+        memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                  - rss_before) / 1024
+        self.stdout.write(
+            f"{bucket:<6} {group or '-':<6} {median:7.2f} с  "
+            f"{result['rows_scanned'] / median:>11.0f} строк/с  "
+            f"точек {len(result['columns']['period']):>6}  "
+            f"JSON {size / 1024:8.1f} КБ  рост пика RSS {memory:6.1f} МБ"
+        )
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from LibHub import backups
+
+
+class Command(BaseCommand):
+    help = ("Сравнение времени параллельного резервного копирования "
+            "(pg_dump -Fd -j N) и, с --restore, восстановления "
+            "(pg_restore -j N) для разного числа потоков")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 8])
+        parser.add_argument('--restore', action='store_true',
+                            help="Также замерить восстановление "
+                                 "(пересоздаёт объекты текущей базы!)")
+
+    def handle(self, *args, **options):
+        os.makedirs(settings.BACKUP_ROOT, exist_ok=True)
+        baseline = None
+        for jobs in options['jobs']:
+            with tempfile.NamedTemporaryFile(dir=settings.BACKUP_ROOT,
+                                             suffix='.tar') as file:
+                try:
+                    started = time.perf_counter()
+                    size = backups.dump_directory_archive(file.name, jobs)
+                    dump_seconds = time.perf_counter() - started
+                    line = (f"-j {jobs:<3} дамп {dump_seconds:7.2f} с "
+                            f"({size / 2 ** 20:.1f} МБ)")
+                    if options['restore']:
+                        started = time.perf_counter()
+                        backups.restore_archive(file.name, jobs)
+                        line += (f"  восстановление "
+                                 f"{time.perf_counter() - started:7.2f} с")
+                except backups.BackupError as e:
+                    raise CommandError(str(e))
+            baseline = baseline or dump_seconds
+            self.stdout.write(
+                f"{line}  ускорение дампа x{baseline / dump_seconds:.2f}")
@@ -0,0 +1,80 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from LibHub import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Замер задержки, числа SQL-запросов и пика памяти представлений "
+            "на синтетических данных нескольких масштабов со сравнением с "
+            "базовой линией")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append',
+                            choices=list(benchmarks.SCALES),
+                            help="Масштаб данных (можно несколько раз); "
+                                 "по умолчанию small и medium")
+        parser.add_argument('--endpoint', action='append',
+                            help="Замерять только указанные представления")
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Куда записать результаты (JSON)")
+        parser.add_argument('--baseline', default=settings.BENCHMARK_BASELINE,
+                            help="Файл базовой линии (JSON)")
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="Допустимый рост задержки и памяти (доля, "
+                                 "по умолчанию 0.25)")
+        parser.add_argument('--update-baseline', action='store_true',
+                            help="Записать результаты как новую базовую "
+                                 "линию вместо сравнения")
+
+    def handle(self, *args, **options):
+        scales = options['scale'] or ['small', 'medium']
+        baseline = Path(options['baseline'])
+        # Без базовой линии проверка молча проходила бы - сравнивать не с чем
+        if not options['update_baseline'] and not baseline.exists():
+            raise CommandError(f"Базовая линия {baseline} не найдена; "
+                               f"создайте её запуском с --update-baseline.")
+        setup_test_environment()
+        try:
+            results = benchmarks.run(scales, options['iterations'],
+                                     options['seed'], only=options['endpoint'],
+                                     progress=self._report)
+        except benchmarks.BenchmarkError as exc:
+            raise CommandError(str(exc))
+        finally:
+            teardown_test_environment()
+
+        if options['output']:
+            self._write(options['output'], results)
+        if options['update_baseline']:
+            self._write(baseline, results)
+            self.stdout.write(self.style.SUCCESS(
+                f"Базовая линия обновлена: {baseline}"))
+            return
+        regressions = benchmarks.compare(
+            results, json.loads(baseline.read_text()), options['threshold'])
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(
+                f"Регрессий производительности: {len(regressions)}")
+        self.stdout.write(self.style.SUCCESS(
+            "Регрессий относительно базовой линии нет."))
+
+    def _report(self, scale, name, result):
+        self.stdout.write(
+            f"{scale:<7} {name:<28} p50={result['p50_ms']:9.2f} мс  "
+            f"p95={result['p95_ms']:9.2f} мс  "
+            f"SQL={result['queries']:4d}  память={result['peak_kib']:7d} КиБ"
+        )
+
+    def _write(self, path, results):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps(results, ensure_ascii=False, indent=2) + '\n')
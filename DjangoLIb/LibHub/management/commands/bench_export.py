@@ -0,0 +1,126 @@
+import random
+import resource
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from LibHub import exports
+from LibHub.models import Author, Book, Genre, Language
+from LibHub.query_budget import QueryCounter
+
+BENCH_COVER_URL = 'http://bench.local/export.jpg'
+
+
+class Command(BaseCommand):
+    help = ("Замер потоковой выгрузки каталога (по умолчанию 500 тыс. книг): "
+            "время, размер файла и рост памяти процесса")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=500_000)
+        parser.add_argument('--format', dest='formats', action='append',
+                            choices=list(exports.EXPORT_FORMATS),
+                            help="Формат выгрузки (можно указать несколько "
+                                 "раз; по умолчанию все доступные)")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--chunk-size', type=int,
+                            default=exports.EXPORT_CHUNK_SIZE)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true',
+                            help="Не удалять синтетические книги после "
+                                 "замера")
+        parser.add_argument('--tracemalloc', action='store_true',
+                            help="Измерять пик памяти Python через "
+                                 "tracemalloc (точнее, но в разы медленнее)")
+
+    def handle(self, *args, **options):
+        formats = options['formats'] or exports.available_formats()
+        unavailable = set(formats) - set(exports.available_formats())
+        if unavailable:
+            raise CommandError(
+                f"Недоступные форматы: {', '.join(sorted(unavailable))}")
+
+        random.seed(options['seed'])
+        self._seed_books(options['books'], options['batch_size'])
+        queryset = exports.export_queryset().filter(cover_url=BENCH_COVER_URL)
+        try:
+            for export_format in formats:
+                self._measure(export_format, queryset, options['chunk_size'],
+                              options['tracemalloc'])
+        finally:
+            if not options['keep']:
+                self._cleanup(options['batch_size'])
+
+    def _measure(self, export_format, queryset, chunk_size, trace):
+        counter = QueryCounter()
+        if trace:
+            tracemalloc.start()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        size = 0
+        with counter.track():
+            content, _ = exports.export_books(
+                export_format, exports.export_rows(queryset, chunk_size))
+            for block in content:
+                size += len(block)
+        elapsed = time.perf_counter() - started
+        # ru_maxrss - в КБ (Linux); рост пика RSS за время выгрузки
+        memory = "рост пика RSS {:6.1f} МБ".format(
+            (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before)
+            / 1024)
+        if trace:
+            memory += (f", пик tracemalloc "
+                       f"{tracemalloc.get_traced_memory()[1] / 2 ** 20:6.1f} "
+                       f"МБ")
+            tracemalloc.stop()
+        self.stdout.write(
+            f"{export_format:<8} {elapsed:7.1f} с  {size / 2 ** 20:8.1f} МБ  "
+            f"SQL-запросов {counter.count}, {memory}"
+        )
+
+    def _seed_books(self, total, batch_size):
+        existing = Book.objects.filter(cover_url=BENCH_COVER_URL).count()
+        if existing >= total:
+            return
+        language, _ = Language.objects.get_or_create(
+            name='Benchmark', defaults={'chars_code': 'BENCH'})
+        authors = list(Author.objects.all()[:50]) or [
+            Author.objects.create(first_name='Bench', last_name='Author')]
+        genres = list(Genre.objects.all()[:20]) or [
+            Genre.objects.create(name='Benchmark')]
+        self.stdout.write(f"Создание {total - existing} синтетических книг...")
+        started = time.perf_counter()
+        for offset in range(existing, total, batch_size):
+            with transaction.atomic():
+                books = Book.objects.bulk_create([
+                    Book(name=f"Export benchmark {offset + i}",
+                         publication_year=random.randint(1800, 2024),
+                         language=language, cover_url=BENCH_COVER_URL)
+                    for i in range(min(batch_size, total - offset))
+                ])
+                if connection.features.can_return_rows_from_bulk_insert:
+                    Book.authors.through.objects.bulk_create([
+                        Book.authors.through(book_id=book.pk,
+                                             author_id=author.pk)
+                        for book in books
+                        for author in random.sample(
+                            authors, k=min(2, len(authors)))
+                    ])
+                    Book.genres.through.objects.bulk_create([
+                        Book.genres.through(book_id=book.pk,
+                                            genre_id=random.choice(genres).pk)
+                        for book in books
+                    ])
+        self.stdout.write(f"Каталог заполнен за "
+                          f"{time.perf_counter() - started:.1f} с")
+
+    def _cleanup(self, batch_size):
+        # Пачками: удаление полумиллиона книг одним delete() собирает их
+        # все в памяти
+        queryset = Book.objects.filter(cover_url=BENCH_COVER_URL)
+        while True:
+            ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            Book.objects.filter(pk__in=ids).delete()
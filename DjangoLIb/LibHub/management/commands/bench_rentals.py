@@ -0,0 +1,135 @@
+import random
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.db.models import Count, Q
+
+from LibHub import rentals
+from LibHub.models import Book, Language, Request, User
+
+BENCH_COVER_URL = 'http://bench.local/rental.jpg'
+BENCH_EMAIL = 'bench-rental-{}@example.com'
+
+
+class Command(BaseCommand):
+    help = ("Нагрузочный тест аренды: параллельные rent/return из нескольких "
+            "потоков и проверка, что экземпляров не выдано больше, чем есть")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--operations', type=int, default=200,
+                            help="Операций на поток")
+        parser.add_argument('--books', type=int, default=5)
+        parser.add_argument('--copies', type=int, default=3)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true',
+                            help="Не удалять тестовые данные")
+
+    def handle(self, *args, **options):
+        users, book_ids = self._seed(options)
+        barrier = threading.Barrier(options['threads'])
+        totals = Counter()
+        lock = threading.Lock()
+
+        def worker(index):
+            rng = random.Random(options['seed'] + index)
+            counts = Counter()
+            try:
+                barrier.wait()
+                for _ in range(options['operations']):
+                    user = rng.choice(users)
+                    book_id = rng.choice(book_ids)
+                    try:
+                        if rng.random() < 0.6:
+                            rentals.rent_book(user, book_id)
+                            counts['rented'] += 1
+                        else:
+                            request_id = Request.objects.filter(
+                                user=user, book_id=book_id,
+                                status__in=Request.ACTIVE_STATUSES
+                            ).values_list('id', flat=True).first()
+                            if request_id is None:
+                                counts['idle'] += 1
+                                continue
+                            rentals.return_book(user, request_id)
+                            counts['returned'] += 1
+                    except (rentals.RentalError, Request.DoesNotExist):
+                        counts['rejected'] += 1
+                    except OperationalError:
+                        # SQLite: база занята другим потоком
+                        counts['busy'] += 1
+            finally:
+                connections.close_all()
+                with lock:
+                    totals.update(counts)
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        operations = options['threads'] * options['operations']
+        self.stdout.write(
+            f"Операций: {operations} за {elapsed:.2f} с "
+            f"({operations / elapsed:.0f} оп/с); "
+            f"выдано {totals['rented']}, возвращено {totals['returned']}, "
+            f"отклонено {totals['rejected']}, занято {totals['busy']}"
+        )
+
+        try:
+            self._verify(book_ids)
+        finally:
+            if not options['keep']:
+                Book.objects.filter(cover_url=BENCH_COVER_URL).delete()
+                User.objects.filter(email__startswith='bench-rental-').delete()
+
+    def _seed(self, options):
+        language, _ = Language.objects.get_or_create(
+            name='Benchmark', defaults={'chars_code': 'BENCH'})
+        password = make_password(None)
+        User.objects.bulk_create(
+            [User(email=BENCH_EMAIL.format(i), password=password)
+             for i in range(options['users'])],
+            ignore_conflicts=True,
+        )
+        users = list(User.objects.filter(email__startswith='bench-rental-'))
+        books = Book.objects.bulk_create([
+            Book(name=f"Rental benchmark {i}", publication_year=2000,
+                 language=language, cover_url=BENCH_COVER_URL,
+                 quantity=options['copies'], available=options['copies'])
+            for i in range(options['books'])
+        ])
+        return users, [book.pk for book in books]
+
+    def _verify(self, book_ids):
+        books = Book.objects.filter(pk__in=book_ids).annotate(
+            active=Count('request', filter=Q(
+                request__status__in=Request.ACTIVE_STATUSES))
+        )
+        errors = [
+            f"{book.name}: доступно {book.available}, "
+            f"всего {book.quantity}, на руках {book.active}"
+            for book in books
+            if book.available < 0
+            or book.available + book.active != book.quantity
+        ]
+        duplicates = Request.objects.filter(
+            book_id__in=book_ids, status__in=Request.ACTIVE_STATUSES
+        ).values('user_id', 'book_id').annotate(
+            total=Count('id')).filter(total__gt=1)
+        if duplicates.exists():
+            errors.append(f"Повторных активных аренд: {duplicates.count()}")
+        if errors:
+            raise CommandError("Нарушен учёт экземпляров:\n"
+                               + "\n".join(errors))
+        self.stdout.write(self.style.SUCCESS(
+            "Перевыдач и повторных аренд не обнаружено."))
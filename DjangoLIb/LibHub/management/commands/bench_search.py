@@ -0,0 +1,114 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from LibHub.models import Book, Language
+from LibHub.search import search_books
+
+BENCH_COVER_URL = 'http://bench.local/cover.jpg'
+
+WORDS = [
+    'war', 'peace', 'night', 'river', 'garden', 'shadow', 'winter', 'summer',
+    'empire', 'secret', 'island', 'mountain', 'silver', 'golden', 'forest',
+    'ocean', 'letters', 'journey', 'kingdom', 'storm', 'city', 'dream',
+    'stone', 'fire', 'glass', 'queen', 'hunter', 'machine', 'stars', 'crown',
+]
+NAMES = ['Leo', 'Anna', 'Fyodor', 'Jane', 'Mark', 'Olga', 'Ivan', 'Mary',
+         'Boris', 'Ursula']
+SURNAMES = ['Tolstoy', 'Austen', 'Twain', 'Orwell', 'Bulgakov', 'Woolf',
+            'Chekhov', 'Pushkin', 'Gaiman']
+GENRES = ['Novel', 'Fantasy', 'Drama', 'Poetry', 'Detective', 'Horror',
+          'Science']
+
+
+def _typo(word):
+    # Одна перестановка соседних букв - типичная опечатка
+    if len(word) < 4:
+        return word
+    i = random.randrange(1, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ("Замер задержки поиска книг на синтетическом каталоге "
+            "(по умолчанию 1 млн книг)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true',
+                            help="Не удалять синтетические книги после "
+                                 "замера")
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self._seed_books(options['books'], options['batch_size'])
+
+        books = Book.objects.filter(is_deleted=False)
+        queries = [' '.join(random.sample(WORDS, k=2))
+                   for _ in range(options['queries'])]
+        typo_queries = [_typo(random.choice(SURNAMES))
+                        for _ in range(options['queries'])]
+
+        results = {
+            'icontains': self._measure(
+                lambda q: list(books.filter(name__icontains=q)[:20]),
+                queries),
+            'search': self._measure(
+                lambda q: list(search_books(books, q)[:20]), queries),
+            'search (опечатки)': self._measure(
+                lambda q: list(search_books(books, q)[:20]), typo_queries),
+        }
+        for name, timings in results.items():
+            self.stdout.write(
+                f"{name:<20} p50={_percentile(timings, 0.5):8.2f} мс  "
+                f"p95={_percentile(timings, 0.95):8.2f} мс  "
+                f"среднее={statistics.mean(timings):8.2f} мс"
+            )
+
+        if not options['keep']:
+            Book.objects.filter(cover_url=BENCH_COVER_URL).delete()
+
+    def _measure(self, run, queries):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            run(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def _seed_books(self, total, batch_size):
+        existing = Book.objects.filter(cover_url=BENCH_COVER_URL).count()
+        if existing >= total:
+            return
+        language, _ = Language.objects.get_or_create(
+            name='Benchmark', defaults={'chars_code': 'BENCH'})
+        self.stdout.write(f"Создание {total - existing} синтетических книг...")
+        started = time.perf_counter()
+        for offset in range(existing, total, batch_size):
+            batch = []
+            for _ in range(min(batch_size, total - offset)):
+                name = ' '.join(random.sample(WORDS, k=3)).capitalize()
+                author = f"{random.choice(NAMES)} {random.choice(SURNAMES)}"
+                genre = random.choice(GENRES)
+                batch.append(Book(
+                    name=name,
+                    publication_year=random.randint(1800, 2024),
+                    language=language,
+                    cover_url=BENCH_COVER_URL,
+                    search_document=f"{name} {author} {genre}",
+                ))
+            with transaction.atomic():
+                Book.objects.bulk_create(batch)
+        self.stdout.write(f"Каталог заполнен за "
+                          f"{time.perf_counter() - started:.1f} с")
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LibHub import logical_backup
+
+
+class Command(BaseCommand):
+    help = ("Логическая резервная копия моделей LibHub (NDJSON + gzip) без "
+            "утилит СУБД; работает на любом backend'е")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Каталог копии (будет создан)")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Число потоков выгрузки таблиц")
+        parser.add_argument('--chunk-size', type=int,
+                            default=logical_backup.CHUNK_SIZE)
+        parser.add_argument('--rows-per-file', type=int,
+                            default=logical_backup.ROWS_PER_FILE)
+        parser.add_argument('--base',
+                            help="Каталог предыдущей копии: выгрузить только "
+                                 "изменения после неё (инкрементальная "
+                                 "копия)")
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            manifest = logical_backup.dump(
+                options['directory'], workers=options['workers'],
+                alias=options['database'], chunk_size=options['chunk_size'],
+                rows_per_file=options['rows_per_file'], base=options['base'],
+            )
+        except logical_backup.LogicalBackupError as e:
+            raise CommandError(str(e))
+        for label, table in manifest['tables'].items():
+            self.stdout.write(f"{label:<28} {table['rows']:>10} строк, "
+                              f"файлов: {len(table['files'])}")
+        rows = sum(table['rows'] for table in manifest['tables'].values())
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Копия {manifest['id']} ({manifest['kind']})")
+        self.stdout.write(self.style.SUCCESS(
+            f"Выгружено {rows} строк за {elapsed:.1f} с "
+            f"({rows / elapsed:.0f} строк/с)"))
@@ -0,0 +1,44 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from LibHub.rentals import expire_overdue_rentals
+
+
+class Command(BaseCommand):
+    help = ("Переводит просроченные аренды в статус EXPIRED порциями. "
+            "Воркер очереди (manage.py run_jobs) запускает проход сам раз в "
+            "час; команда - для ручного запуска: "
+            "manage.py expire_rentals --max-chunks 100")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--max-chunks', type=int, default=None,
+                            help="Ограничить число порций за запуск; "
+                                 "следующий запуск продолжит с контрольной "
+                                 "точки")
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help="Дата, на которую проверяется просрочка "
+                                 "(по умолчанию - сегодня)")
+        parser.add_argument('--restart', action='store_true',
+                            help="Начать проход заново, игнорируя "
+                                 "контрольную точку")
+
+    def handle(self, *args, **options):
+        def progress(result):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Порция {result.chunks}: всего "
+                                  f"{result.expired} строк, "
+                                  f"{result.rows_per_second:.0f} строк/с")
+
+        result = expire_overdue_rentals(
+            today=options['date'],
+            chunk_size=options['chunk_size'],
+            max_chunks=options['max_chunks'],
+            restart=options['restart'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Просрочено аренд: {result.expired} за {result.seconds:.2f} с "
+            f"({result.chunks} порций, {result.rows_per_second:.0f} строк/с)"
+        ))
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from LibHub import artifacts
+
+
+class Command(BaseCommand):
+    help = ("Применяет политики хранения артефактов (ARTIFACT_RETENTION) и "
+            "удаляет содержимое и фрагменты, на которые больше нет ссылок. "
+            "Предназначена для запуска планировщиком, например раз в сутки")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Только показать, сколько артефактов будет "
+                                 "удалено")
+
+    def handle(self, *args, **options):
+        removed = artifacts.apply_retention(dry_run=options['dry_run'])
+        for kind, count in removed.items():
+            policy = ', '.join(
+                f"{key}={value}"
+                for key, value in settings.ARTIFACT_RETENTION[kind].items())
+            self.stdout.write(
+                f"{kind:<8} ({policy}): "
+                f"{'к удалению' if options['dry_run'] else 'удалено'} {count}")
+        if options['dry_run']:
+            return
+        blobs, chunks, freed = artifacts.collect_garbage()
+        self.stdout.write(self.style.SUCCESS(
+            f"Удалено содержимого: {blobs}, фрагментов: {chunks}, "
+            f"освобождено {freed / 2 ** 20:.1f} МБ"
+        ))
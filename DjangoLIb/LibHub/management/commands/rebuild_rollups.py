@@ -0,0 +1,43 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LibHub.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = ("Пересобирает дневные сводки аренд (LibHub/rollups.py) из таблицы "
+            "аренд порциями дней в нескольких потоках. Запускается после "
+            "массовой загрузки данных или восстановления копии")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                            default=None,
+                            help="Первый день (по умолчанию - первая аренда)")
+        parser.add_argument('--to', dest='end', type=date.fromisoformat,
+                            default=None,
+                            help="Последний день включительно (по умолчанию "
+                                 "- сегодня)")
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help="Дней в одной порции (транзакции)")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Число потоков (на SQLite всегда 1)")
+
+    def handle(self, *args, **options):
+        if options['chunk_days'] < 1 or options['workers'] < 1:
+            raise CommandError(
+                "--chunk-days и --workers должны быть не меньше 1")
+
+        def progress(result):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Порция {result.chunks}: {result.days} "
+                                  f"дней, {result.rows} строк сводок")
+
+        result = rebuild(options['start'], options['end'],
+                         chunk_days=options['chunk_days'],
+                         workers=options['workers'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Пересобрано сводок: {result.rows} строк за {result.days} дней "
+            f"за {result.seconds:.2f} с "
+            f"({result.chunks} порций)"
+        ))
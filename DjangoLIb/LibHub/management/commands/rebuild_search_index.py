@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from LibHub import search
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает поисковые документы книг и перестраивает "
+            "поисковые индексы")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = search.refresh_search_documents(
+            batch_size=options['batch_size'])
+        search.install_search_structures(connection, rebuild=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Обновлено поисковых документов: {updated}"))
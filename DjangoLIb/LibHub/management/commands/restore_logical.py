@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LibHub import logical_backup
+
+
+class Command(BaseCommand):
+    help = ("Восстановление логической резервной копии, созданной "
+            "dump_logical: полная копия и цепочка инкрементальных (--delta в "
+            "порядке создания)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Каталог полной копии")
+        parser.add_argument('--delta', dest='deltas', action='append',
+                            default=[],
+                            help="Каталог инкрементальной копии (можно "
+                                 "указать несколько раз)")
+        parser.add_argument('--batch-size', type=int,
+                            default=logical_backup.BATCH_SIZE)
+        parser.add_argument('--replace', action='store_true',
+                            help="Удалить текущие строки таблиц LibHub перед "
+                                 "загрузкой")
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        def progress(label, rows):
+            self.stdout.write(f"{label:<28} {rows:>10} строк")
+
+        started = time.perf_counter()
+        try:
+            counts = logical_backup.restore(
+                options['directory'], alias=options['database'],
+                batch_size=options['batch_size'], replace=options['replace'],
+                progress=progress, deltas=options['deltas'],
+            )
+        except logical_backup.LogicalBackupError as e:
+            raise CommandError(str(e))
+        rows = sum(counts.values())
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено {rows} строк за {elapsed:.1f} с "
+            f"({rows / elapsed:.0f} строк/с)"))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LibHub import artifacts, backups
+from LibHub.models import BackupArchive
+
+
+class Command(BaseCommand):
+    help = ("Восстановление из tar-архива pg_dump -Fd через pg_restore -j N. "
+            "Объекты базы пересоздаются (--clean --if-exists)")
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('path', nargs='?', help="Путь к tar-архиву")
+        source.add_argument('--archive', type=int, help="id BackupArchive")
+        parser.add_argument('--jobs', type=int, default=4,
+                            help="Число параллельных потоков pg_restore")
+
+    def handle(self, *args, **options):
+        if not options['archive']:
+            return self._restore(options['path'], options['jobs'])
+        archive = BackupArchive.objects.filter(
+            pk=options['archive'], status=BackupArchive.Status.DONE).first()
+        if archive is None:
+            raise CommandError(
+                f"Готовый архив #{options['archive']} не найден.")
+        with backups.open_backup_archive(archive) as file:
+            self._restore(file, options['jobs'])
+
+    def _restore(self, source, jobs):
+        started = time.perf_counter()
+        try:
+            size, entries = backups.restore_archive(source, jobs)
+        except (backups.BackupError, artifacts.ArtifactError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Восстановлено {entries} объектов из {size / 2 ** 20:.1f} МБ "
+            f"за {time.perf_counter() - started:.1f} с"
+        ))
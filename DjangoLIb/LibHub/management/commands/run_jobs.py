@@ -0,0 +1,101 @@
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from LibHub import charts, jobs
+from LibHub.models import Job
+
+
+class Command(BaseCommand):
+    help = ("Воркер очереди фоновых задач (LibHub/jobs.py): отчёты, выгрузки, "
+            "резервные копии и восстановление. Запускается как постоянный "
+            "сервис; можно запускать несколько воркеров. Периодические "
+            "задачи (просрочка аренд) воркер ставит в очередь сам")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Сколько задач выполнять одновременно "
+                                 "(пределы по видам задач действуют поверх)")
+        parser.add_argument('--kind', action='append', choices=Job.Kind.values,
+                            help="Выполнять только задачи этих видов")
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help="Пауза между проверками очереди, секунд")
+        parser.add_argument('--once', action='store_true',
+                            help="Выполнить готовые к запуску задачи и "
+                                 "завершиться")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency должен быть не меньше 1")
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        config = jobs.get_config()
+        stopping = threading.Event()
+        running = {}
+
+        def stop(signum, frame):
+            self.stdout.write("Остановка: новые задачи не берутся, "
+                              "ожидание выполняющихся...")
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f"Воркер {worker}: до {options['concurrency']} "
+                          f"задач одновременно")
+
+        last_heartbeat = last_stale_check = last_schedule = 0.0
+        with ThreadPoolExecutor(max_workers=options['concurrency'],
+                                thread_name_prefix='job') as pool:
+            while not stopping.is_set():
+                for job_id, future in list(running.items()):
+                    if future.done():
+                        del running[job_id]
+                        self._report(job_id)
+                now = time.monotonic()
+                if now - last_heartbeat >= config['HEARTBEAT_INTERVAL']:
+                    jobs.heartbeat(list(running))
+                    last_heartbeat = now
+                if now - last_stale_check >= config['STALE_TIMEOUT'] / 2:
+                    retried, failed = jobs.requeue_stale()
+                    if retried or failed:
+                        self.stderr.write(f"Брошенные задачи: возвращено в "
+                                          f"очередь {retried}, "
+                                          f"завершено {failed}")
+                    last_stale_check = now
+                if now - last_schedule >= jobs.SCHEDULE_CHECK_INTERVAL:
+                    for job in jobs.enqueue_periodic():
+                        self.stdout.write(
+                            f"Периодическая задача #{job.pk} {job.kind}")
+                    last_schedule = now
+
+                claimed = None
+                if len(running) < options['concurrency']:
+                    claimed = jobs.claim(worker, options['kind'])
+                if claimed is not None:
+                    self.stdout.write(f"Задача #{claimed.pk} {claimed.kind}, "
+                                      f"попытка {claimed.attempts}")
+                    running[claimed.pk] = pool.submit(jobs.execute, claimed)
+                    continue
+                if options['once'] and not running:
+                    break
+                # Соединение главного потока не держится открытым между
+                # проверками
+                connections.close_all()
+                stopping.wait(options['poll'])
+        for job_id in running:
+            self._report(job_id)
+        charts.shutdown()
+
+    def _report(self, job_id):
+        job = Job.objects.get(pk=job_id)
+        if job.status == Job.Status.DONE:
+            self.stdout.write(self.style.SUCCESS(
+                f"Задача #{job.pk} {job.kind} выполнена"))
+        else:
+            self.stderr.write(f"Задача #{job.pk} {job.kind}: {job.status} - "
+                              f"{job.error}")
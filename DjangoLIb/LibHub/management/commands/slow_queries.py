@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from LibHub.models import SlowQuery
+
+
+class Command(BaseCommand):
+    help = ("Самые дорогие формы SQL-запросов из журнала медленных запросов "
+            "(LibHub/slow_queries.py)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--order', choices=['total', 'max', 'calls'],
+                            default='total',
+                            help="Сортировка: суммарное время, максимальное "
+                                 "время или число вызовов")
+        parser.add_argument('--plans', action='store_true',
+                            help="Показать сохранённые планы EXPLAIN")
+        parser.add_argument('--reset', action='store_true',
+                            help="Очистить журнал")
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted = SlowQuery.objects.all().delete()[0]
+            self.stdout.write(self.style.SUCCESS(
+                f"Журнал очищен, удалено записей: {deleted}"))
+            return
+        order = {'total': '-total_ms', 'max': '-max_ms',
+                 'calls': '-calls'}[options['order']]
+        for entry in SlowQuery.objects.order_by(order)[:options['top']]:
+            average = entry.total_ms / entry.calls if entry.calls else 0
+            self.stdout.write(self.style.WARNING(
+                f"{entry.fingerprint[:12]}  всего {entry.total_ms:10.1f} мс  "
+                f"вызовов {entry.calls:6d}  "
+                f"среднее {average:8.1f} мс  максимум {entry.max_ms:8.1f} мс"
+            ))
+            self.stdout.write(f"  {entry.view} - {entry.location}")
+            self.stdout.write(f"  {entry.normalized[:500]}")
+            if options['plans'] and entry.plan:
+                self.stdout.write('  ' + entry.plan.replace('\n', '\n  '))
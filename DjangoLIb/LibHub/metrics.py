@@ -0,0 +1,440 @@
+"""
+Метрики приложения в формате Prometheus без внешних зависимостей.
+
+Счётчики (``Counter``), гистограммы (``Histogram``) и значения (``Gauge``)
+хранятся в памяти процесса; обновление - одна операция со словарём под
+коротким локом. ``metrics_view`` отдаёт их по ``/metrics`` в текстовом
+формате Prometheus.
+
+Несколько процессов (gunicorn с воркерами): в ``METRICS['MULTIPROCESS_DIR']``
+каждый процесс не чаще раза в ``FLUSH_INTERVAL`` секунд сохраняет снимок
+своих значений в ``<pid>-<метка>.json``; при чтении снимки складываются.
+Значения ``Gauge`` берутся только от живых процессов. Каталог следует
+очищать при перезапуске сервиса, иначе счётчики продолжат расти от старых
+значений (Prometheus это переносит, но графики станут менее наглядными).
+
+Помимо метрик процесса при чтении опрашиваются сборщики
+(``register_collector``): статистика кэша ответов, которая и так общая для
+всех воркеров, и число подключений к PostgreSQL по состояниям.
+"""
+import atexit
+import bisect
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections, transaction
+
+from .cache import cache_stats
+
+logger = logging.getLogger('LibHub.metrics')
+
+DEFAULTS = {
+    # None - включены, если задан TOKEN
+    'ENABLED': None,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 1.0,
+    'TOKEN': None,
+}
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+    if config['ENABLED'] is None:
+        config['ENABLED'] = bool(config['TOKEN'])
+    return config
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        # Метка процесса в имени файла снимка: pid может быть переиспользован
+        self._token = uuid.uuid4().hex[:8]
+        self._flushed_at = 0.0
+        self._flush_lock = threading.Lock()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована.")
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        return {name: {'kind': metric.kind, 'values': metric.export()}
+                for name, metric in self.metrics.items()}
+
+    # Многопроцессный режим
+
+    def _path(self, directory):
+        return os.path.join(directory, f"{os.getpid()}-{self._token}.json")
+
+    def flush(self, force=False):
+        """
+        Сохранить снимок процесса в MULTIPROCESS_DIR (не чаще
+        FLUSH_INTERVAL).
+        """
+        config = get_config()
+        directory = config['MULTIPROCESS_DIR']
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < config['FLUSH_INTERVAL']:
+            return
+        if not self._flush_lock.acquire(blocking=force):
+            return
+        try:
+            self._flushed_at = now
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp',
+                                             delete=False) as file:
+                json.dump(self.snapshot(), file)
+            os.replace(file.name, self._path(directory))
+        finally:
+            self._flush_lock.release()
+
+    def _other_snapshots(self, directory):
+        own = os.path.basename(self._path(directory))
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.json') or entry.name == own:
+                continue
+            try:
+                with open(entry.path) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                # Файл удалён или ещё записывается - пропускаем до
+                # следующего чтения
+                continue
+            yield _pid_alive(int(entry.name.split('-', 1)[0])), snapshot
+
+    def collect(self):
+        """Значения всех метрик: {имя: (метрика, {метки: значение})}."""
+        merged = {name: (metric, {tuple(labels): value
+                                  for labels, value in metric.export()})
+                  for name, metric in self.metrics.items()}
+        directory = get_config()['MULTIPROCESS_DIR']
+        if directory and os.path.isdir(directory):
+            for alive, snapshot in self._other_snapshots(directory):
+                for name, data in snapshot.items():
+                    if name not in merged or (data['kind'] == 'gauge'
+                                              and not alive):
+                        continue
+                    metric, values = merged[name]
+                    for labels, value in data['values']:
+                        labels = tuple(labels)
+                        values[labels] = metric.merge(values.get(labels),
+                                                      value)
+        return merged
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: нужны метки {self.labelnames}, "
+                             f"переданы {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def export(self):
+        with self._lock:
+            return [[list(key), self._copy(value)]
+                    for key, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+    def merge(self, current, other):
+        return other if current is None else current + other
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield self.name, key, value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield self.name, key, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Значение: [число наблюдений по корзинам (последняя - +Inf), сумма]
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1),
+                                             0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _copy(self, value):
+        return [list(value[0]), value[1]]
+
+    def merge(self, current, other):
+        if current is None:
+            return other
+        return [[a + b for a, b in zip(current[0], other[0])],
+                current[1] + other[1]]
+
+    def samples(self, values):
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       key + (('le', _format_value(bound)),), cumulative)
+            yield self.name + '_sum', key, total
+            yield self.name + '_count', key, cumulative
+
+
+def register_collector(collector):
+    """
+    Функция, вызываемая при каждом чтении метрик; возвращает список
+    ``(имя, тип, описание, [({метка: значение}, число), ...])``.
+    """
+    REGISTRY.collectors.append(collector)
+    return collector
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + '}'
+
+
+def _header(name, kind, documentation):
+    return [f"# HELP {name} {_escape(documentation)}", f"# TYPE {name} {kind}"]
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric, values in REGISTRY.collect().values():
+        lines += _header(metric.name, metric.kind, metric.documentation)
+        for name, key, value in metric.samples(values):
+            # Метки гистограммы: значения меток метрики и затем пара
+            # ('le', граница)
+            plain = key[:len(metric.labelnames)]
+            pairs = (list(zip(metric.labelnames, plain))
+                     + [pair for pair in key[len(metric.labelnames):]])
+            lines.append(
+                f"{name}{_format_labels(pairs)} {_format_value(value)}")
+    for collector in REGISTRY.collectors:
+        try:
+            families = collector()
+        except DatabaseError:
+            logger.exception("Сборщик метрик %s завершился ошибкой",
+                             collector.__name__)
+            continue
+        for name, kind, documentation, samples in families:
+            lines += _header(name, kind, documentation)
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.items())} "
+                             f"{_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+HTTP_DURATION = Histogram(
+    'libhub_http_request_duration_seconds', "Время обработки запроса",
+    ('view', 'action', 'method', 'status'),
+)
+RENTALS = Counter('libhub_rentals_total', "События аренды", ('event',))
+DB_QUERIES = Counter(
+    'libhub_db_queries_total', "SQL-запросы при обработке HTTP-запросов",
+    ('alias',),
+)
+DB_QUERY_SECONDS = Counter(
+    'libhub_db_query_seconds_total',
+    "Время SQL-запросов при обработке HTTP-запросов", ('alias',),
+)
+DB_CONNECTIONS_OPENED = Counter(
+    'libhub_db_connections_opened_total', "Открытые подключения к базе",
+    ('alias',),
+)
+CHART_RENDER_SECONDS = Histogram(
+    'libhub_chart_render_seconds', "Время построения диаграммы",
+    ('format',),
+)
+
+
+def record_connection_opened(sender, connection, **kwargs):
+    DB_CONNECTIONS_OPENED.inc(alias=connection.alias)
+
+
+def rental_event(event, amount=1):
+    """
+    Учесть событие аренды после фиксации транзакции (при откате не
+    считается).
+    """
+    transaction.on_commit(lambda: RENTALS.inc(amount, event=event))
+
+
+@register_collector
+def _cache_families():
+    stats = cache_stats()
+    requests = []
+    ratios = []
+    for namespace, values in stats.items():
+        requests.append(({'namespace': namespace, 'result': 'hit'},
+                         values['hits']))
+        requests.append(({'namespace': namespace, 'result': 'miss'},
+                         values['misses']))
+        if values['hit_ratio'] is not None:
+            ratios.append(({'namespace': namespace}, values['hit_ratio']))
+    return [
+        ('libhub_cache_requests_total', 'counter',
+         "Обращения к кэшу ответов", requests),
+        ('libhub_cache_hit_ratio', 'gauge',
+         "Доля попаданий в кэш ответов", ratios),
+    ]
+
+
+@register_collector
+def _database_families():
+    families = []
+    for connection in connections.all():
+        if connection.vendor != 'postgresql':
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT coalesce(state, 'unknown'), count(*) "
+                "FROM pg_stat_activity "
+                "WHERE datname = current_database() GROUP BY 1"
+            )
+            rows = cursor.fetchall()
+        families.append((
+            'libhub_db_backends', 'gauge',
+            "Подключения к базе (все процессы) по состояниям",
+            [({'alias': connection.alias, 'state': state}, count)
+             for state, count in rows],
+        ))
+    return families
+
+
+class _QueryMeter:
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            DB_QUERIES.inc(alias=self.alias)
+            DB_QUERY_SECONDS.inc(time.perf_counter() - started,
+                                 alias=self.alias)
+
+
+class MetricsMiddleware:
+    """Время обработки запросов по имени URL и действию DRF, SQL-запросы."""
+
+    def __init__(self, get_response):
+        if not get_config()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(
+                    _QueryMeter(connection.alias)))
+            response = self.get_response(request)
+        match = request.resolver_match
+        HTTP_DURATION.observe(
+            time.perf_counter() - started,
+            view=match.view_name if match else '<unmatched>',
+            action=getattr(request, '_metrics_action', ''),
+            method=request.method,
+            status=f"{response.status_code // 100}xx",
+        )
+        REGISTRY.flush()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Для ViewSet маршрутизатор DRF сохраняет соответствие
+        # метод -> действие
+        actions = getattr(view_func, 'actions', None)
+        if actions:
+            request._metrics_action = actions.get(request.method.lower(), '')
+        return None
+
+
+def _flush_at_exit():
+    try:
+        REGISTRY.flush(force=True)
+    except OSError:
+        logger.exception("Не удалось сохранить снимок метрик")
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,166 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:44
+
+import LibHub.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_search_documents(apps, schema_editor):
+    Book = apps.get_model('LibHub', 'Book')
+    books = Book.objects.using(
+        schema_editor.connection.alias).prefetch_related('authors', 'genres')
+    changed = []
+    for book in books.iterator(chunk_size=1000):
+        parts = [book.name]
+        parts.extend(f"{author.first_name} {author.last_name}"
+                     for author in book.authors.all())
+        parts.extend(genre.name for genre in book.genres.all())
+        book.search_document = ' '.join(part for part in parts if part)
+        changed.append(book)
+        if len(changed) >= 1000:
+            Book.objects.using(schema_editor.connection.alias).bulk_update(
+                changed, ['search_document'])
+            changed = []
+    if changed:
+        Book.objects.using(schema_editor.connection.alias).bulk_update(
+            changed, ['search_document'])
+
+
+# SQL поисковых структур на момент миграции (текущая версия - LibHub/search.py)
+POSTGRES_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    'CREATE INDEX IF NOT EXISTS "LibHub_book_search_gin" ON "LibHub_book" '
+    "USING GIN (to_tsvector('simple', search_document))",
+    'CREATE INDEX IF NOT EXISTS "LibHub_book_search_trgm" ON "LibHub_book" '
+    "USING GIN (search_document gin_trgm_ops)",
+]
+POSTGRES_DROP_STATEMENTS = [
+    'DROP INDEX IF EXISTS "LibHub_book_search_gin"',
+    'DROP INDEX IF EXISTS "LibHub_book_search_trgm"',
+]
+SQLITE_FTS_TABLES = {
+    # Таблица: токенизатор
+    'LibHub_book_fts': 'unicode61 remove_diacritics 2',
+    'LibHub_book_trigram': 'trigram',
+}
+
+
+def sqlite_fts_statements(table, tokenize):
+    return [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{table}" USING fts5('
+        f"search_document, content='LibHub_book', content_rowid='id', "
+        f"tokenize='{tokenize}')",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_ai" AFTER INSERT ON '
+        f'"LibHub_book" BEGIN INSERT INTO "{table}"(rowid, search_document) '
+        f"VALUES (new.id, new.search_document); END",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_ad" AFTER DELETE ON '
+        f'"LibHub_book" BEGIN INSERT INTO "{table}"("{table}", rowid, '
+        f"search_document) VALUES ('delete', old.id, old.search_document); "
+        f"END",
+        f'CREATE TRIGGER IF NOT EXISTS "{table}_au" AFTER UPDATE OF '
+        f'search_document ON "LibHub_book" BEGIN INSERT INTO "{table}"('
+        f'"{table}", rowid, search_document) VALUES '
+        f"('delete', old.id, old.search_document); "
+        f'INSERT INTO "{table}"(rowid, search_document) '
+        f"VALUES (new.id, new.search_document); END",
+        f'INSERT INTO "{table}"("{table}") VALUES (\'rebuild\')',
+    ]
+
+
+def install_search_structures(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for statement in POSTGRES_STATEMENTS:
+                cursor.execute(statement)
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                return
+            for table, tokenize in SQLITE_FTS_TABLES.items():
+                # Триграммный токенизатор есть начиная с SQLite 3.34
+                if (tokenize == 'trigram'
+                        and connection.Database.sqlite_version_info
+                        < (3, 34, 0)):
+                    continue
+                for statement in sqlite_fts_statements(table, tokenize):
+                    cursor.execute(statement)
+
+
+def uninstall_search_structures(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for statement in POSTGRES_DROP_STATEMENTS:
+                cursor.execute(statement)
+        elif connection.vendor == 'sqlite':
+            for table in SQLITE_FTS_TABLES:
+                for suffix in ('_ai', '_ad', '_au'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS "{table}{suffix}"')
+                cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            'LibHub',
+            '0004_alter_author_first_name_alter_author_last_name_and_more',
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(
+            install_search_structures, uninstall_search_structures
+        ),
+        migrations.CreateModel(
+            name='BookSearchIndex',
+            fields=[
+                (
+                    'book',
+                    models.OneToOneField(
+                        db_column='rowid',
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name='search_index',
+                        serialize=False,
+                        to='LibHub.book',
+                    ),
+                ),
+                ('search_document', LibHub.models.FullTextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'LibHub_book_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='BookTrigramIndex',
+            fields=[
+                (
+                    'book',
+                    models.OneToOneField(
+                        db_column='rowid',
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name='trigram_index',
+                        serialize=False,
+                        to='LibHub.book',
+                    ),
+                ),
+                ('search_document', LibHub.models.FullTextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'LibHub_book_trigram',
+                'managed': False,
+            },
+        ),
+    ]
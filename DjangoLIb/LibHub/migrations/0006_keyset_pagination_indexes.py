@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LibHub', '0005_book_search_document'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(
+                fields=['borrow_date', 'id'], name='request_borrow_date_id_idx'
+            ),
+        ),
+    ]
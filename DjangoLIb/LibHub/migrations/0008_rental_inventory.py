@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:52
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def reconcile_inventory(apps, schema_editor):
+    Book = apps.get_model('LibHub', 'Book')
+    Request = apps.get_model('LibHub', 'Request')
+    db = schema_editor.connection.alias
+    active = Request.objects.using(db).filter(status__in=['RENTED', 'EXPIRED'])
+
+    # Повторные активные аренды одной книги одним пользователем закрываем,
+    # оставляя самую свежую - иначе не создать уникальное ограничение
+    duplicates = (active.values('user_id', 'book_id')
+                  .annotate(total=Count('id'), last_id=Max('id'))
+                  .filter(total__gt=1))
+    for row in duplicates.iterator():
+        active.filter(user_id=row['user_id'], book_id=row['book_id']).exclude(
+            id=row['last_id']).update(status='RETURNED')
+
+    # Экземпляров не меньше, чем сейчас на руках
+    for row in active.values('book_id').annotate(total=Count('id')).iterator():
+        Book.objects.using(db).filter(id=row['book_id']).update(
+            quantity=max(1, row['total']),
+            available=max(1, row['total']) - row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LibHub', '0007_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(reconcile_inventory, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(
+                condition=models.Q(('available__lte', models.F('quantity'))),
+                name='book_available_lte_quantity',
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='request',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('status__in', ['RENTED', 'EXPIRED'])),
+                fields=('user', 'book'),
+                name='unique_active_rental',
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+from LibHub.db_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY на PostgreSQL не выполняется в транзакции
+    atomic = False
+
+    dependencies = [
+        ('LibHub', '0009_overdue_sweeper'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='book',
+            index=models.Index(
+                condition=models.Q(('is_deleted', False)),
+                fields=['name', 'id'],
+                name='book_active_name_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='request',
+            index=models.Index(
+                fields=['user', 'status'], name='request_user_status_idx'
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='request',
+            index=models.Index(
+                fields=['book', 'status'], name='request_book_status_idx'
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='request',
+            index=models.Index(
+                condition=models.Q(('status', 'RENTED')),
+                fields=['return_date', 'id'],
+                name='request_rented_return_idx',
+            ),
+        ),
+    ]
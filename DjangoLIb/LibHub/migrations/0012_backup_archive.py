@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:11
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LibHub', '0011_restore_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackupArchive',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'file',
+                    models.CharField(
+                        blank=True, editable=False, max_length=500
+                    ),
+                ),
+                (
+                    'jobs',
+                    models.PositiveSmallIntegerField(
+                        default=4,
+                        validators=[
+                            django.core.validators.MinValueValidator(1),
+                            django.core.validators.MaxValueValidator(32),
+                        ],
+                    ),
+                ),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('PENDING', 'Pending'),
+                            ('RUNNING', 'Running'),
+                            ('DONE', 'Done'),
+                            ('FAILED', 'Failed'),
+                        ],
+                        default='PENDING',
+                        editable=False,
+                        max_length=10,
+                    ),
+                ),
+                ('size', models.BigIntegerField(default=0, editable=False)),
+                (
+                    'duration',
+                    models.FloatField(blank=True, editable=False, null=True),
+                ),
+                ('error', models.TextField(blank=True, editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='restorejob',
+            name='archive_format',
+            field=models.CharField(
+                choices=[('PLAIN', 'Plain'), ('DIRECTORY', 'Directory')],
+                default='PLAIN',
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name='restorejob',
+            name='jobs',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,148 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LibHub', '0013_change_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artifact',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('name', models.CharField(max_length=255)),
+                (
+                    'kind',
+                    models.CharField(
+                        choices=[('UPLOAD', 'Upload'), ('BACKUP', 'Backup')],
+                        max_length=10,
+                    ),
+                ),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                (
+                    'digest',
+                    models.CharField(
+                        max_length=64, primary_key=True, serialize=False
+                    ),
+                ),
+                ('size', models.PositiveIntegerField()),
+                (
+                    'used_at',
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='backuparchive',
+            name='artifact',
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='LibHub.artifact',
+            ),
+        ),
+        migrations.AddField(
+            model_name='restorejob',
+            name='artifact',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='LibHub.artifact',
+            ),
+        ),
+        migrations.AddField(
+            model_name='artifact',
+            name='blob',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name='artifacts',
+                to='LibHub.blob',
+            ),
+        ),
+        migrations.CreateModel(
+            name='BlobChunk',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('position', models.PositiveIntegerField()),
+                (
+                    'blob',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='parts',
+                        to='LibHub.blob',
+                    ),
+                ),
+                (
+                    'chunk',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name='parts',
+                        to='LibHub.chunk',
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='artifact',
+            index=models.Index(
+                fields=['kind', 'created_at'], name='artifact_kind_created_idx'
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name='blobchunk',
+            constraint=models.UniqueConstraint(
+                fields=('blob', 'position'), name='unique_blob_chunk_position'
+            ),
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LibHub', '0015_slow_query_log'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='artifact',
+            name='kind',
+            field=models.CharField(
+                choices=[
+                    ('UPLOAD', 'Upload'),
+                    ('BACKUP', 'Backup'),
+                    ('REPORT', 'Report'),
+                ],
+                max_length=10,
+            ),
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'kind',
+                    models.CharField(
+                        choices=[
+                            ('STATISTICS_REPORT', 'Statistics Report'),
+                            ('BOOK_EXPORT', 'Book Export'),
+                            ('BACKUP', 'Backup'),
+                            ('BACKUP_ARCHIVE', 'Backup Archive'),
+                            ('RESTORE', 'Restore'),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    'status',
+                    models.CharField(
+                        choices=[
+                            ('PENDING', 'Pending'),
+                            ('RUNNING', 'Running'),
+                            ('DONE', 'Done'),
+                            ('FAILED', 'Failed'),
+                        ],
+                        default='PENDING',
+                        max_length=10,
+                    ),
+                ),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('result', models.JSONField(blank=True, default=dict)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3)),
+                (
+                    'run_after',
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('progress_done', models.BigIntegerField(default=0)),
+                ('progress_total', models.BigIntegerField(default=0)),
+                (
+                    'progress_message',
+                    models.CharField(blank=True, max_length=200),
+                ),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                (
+                    'artifact',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name='+',
+                        to='LibHub.artifact',
+                    ),
+                ),
+                (
+                    'requested_by',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name='+',
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                'indexes': [
+                    models.Index(
+                        fields=['status', 'run_after'], name='job_claim_idx'
+                    )
+                ],
+            },
+        ),
+    ]
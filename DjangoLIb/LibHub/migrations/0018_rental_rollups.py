@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LibHub', '0017_job_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RentalRollup',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'dimension',
+                    models.CharField(
+                        choices=[
+                            ('book', 'Book'),
+                            ('genre', 'Genre'),
+                            ('author', 'Author'),
+                            ('user', 'User'),
+                        ],
+                        max_length=6,
+                    ),
+                ),
+                ('object_id', models.BigIntegerField()),
+                ('day', models.DateField()),
+                ('rented', models.PositiveIntegerField(default=0)),
+                ('returned', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(
+                        fields=('dimension', 'day', 'object_id'),
+                        name='unique_rental_rollup',
+                    )
+                ],
+            },
+        ),
+    ]
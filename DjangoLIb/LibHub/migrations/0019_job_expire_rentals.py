@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LibHub', '0018_rental_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(
+                choices=[
+                    ('STATISTICS_REPORT', 'Statistics Report'),
+                    ('BOOK_EXPORT', 'Book Export'),
+                    ('BACKUP', 'Backup'),
+                    ('BACKUP_ARCHIVE', 'Backup Archive'),
+                    ('RESTORE', 'Restore'),
+                    ('EXPIRE_RENTALS', 'Expire Rentals'),
+                ],
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:33
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def fill_returned_at(apps, schema_editor):
+    Request = apps.get_model('LibHub', 'Request')
+    db = schema_editor.connection.alias
+    # Точнее дня последнего изменения возвращённой аренды ничего не известно
+    Request.objects.using(db).filter(status='RETURNED').update(
+        returned_at=TruncDate('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LibHub', '0019_job_expire_rentals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='returned_at',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_returned_at, migrations.RunPython.noop),
+    ]
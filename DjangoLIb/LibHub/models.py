@@ -1,11 +1,61 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, Group, Permission
 from django.core.exceptions import ValidationError
-from django.core.validators import MinLengthValidator, MaxLengthValidator, RegexValidator
+from django.core.validators import (MinLengthValidator, MaxLengthValidator,
+                                    MinValueValidator, MaxValueValidator,
+                                    RegexValidator)
 from django.contrib.auth.password_validation import validate_password
 from django.db import models
+from django.utils import timezone
+
+from .cache import bump_model_version
+
+
+class VersionedQuerySet(models.QuerySet):
+    """
+    QuerySet, увеличивающий версию модели в кэше ответов при массовых
+    операциях, которые не отправляют сигналы (update, bulk_create,
+    bulk_update). Заодно проставляет ``updated_at``, который auto_now при
+    таких операциях не обновляет.
+    """
+
+    def _tracks_updates(self):
+        return any(field.name == 'updated_at'
+                   for field in self.model._meta.concrete_fields)
+
+    def update(self, **kwargs):
+        if self._tracks_updates():
+            kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        if rows:
+            bump_model_version(self.model)
+        return rows
+
+    def touch(self):
+        """
+        Отметить строки как изменённые (например, при изменении M2M-связей).
+        """
+        return self.update()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        if created:
+            bump_model_version(self.model)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if self._tracks_updates() and 'updated_at' not in fields:
+            now = timezone.now()
+            for obj in objs:
+                obj.updated_at = now
+            fields = [*fields, 'updated_at']
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if rows:
+            bump_model_version(self.model)
+        return rows
+
 
 # Менеджер пользователя
-class UserManager(BaseUserManager):
+class UserManager(BaseUserManager.from_queryset(VersionedQuerySet)):
     use_in_migrations = True
 
     def _create_user(self, email, password, **extra_fields):
@@ -54,6 +104,7 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     groups = models.ManyToManyField(Group, related_name='custom_user_set', blank=True)
     user_permissions = models.ManyToManyField(Permission, related_name='custom_user_set_permissions', blank=True)
@@ -61,6 +112,14 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     objects = UserManager()
 
+    def save(self, *args, **kwargs):
+        # Частичное сохранение (например, last_login при входе) тоже отмечает
+        # пользователя изменённым для инкрементальной резервной копии
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'updated_at' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'updated_at']
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.email
 
@@ -81,6 +140,9 @@ class Language(models.Model):
             raise ValidationError("Код языка не может быть пустым или содержать только пробелы.")
 
     is_deleted = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -102,6 +164,9 @@ class Publisher(models.Model):
             raise ValidationError("Адрес издательства не может быть пустым или содержать только пробелы.")
 
     is_deleted = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -113,6 +178,9 @@ class Genre(models.Model):
                             validators=[MinLengthValidator(2), MaxLengthValidator(30),
                                         RegexValidator(regex=r'^[a-zA-Zа-яА-Я\s]*$', message="Название жанра может содержать только буквы.")])
     is_deleted = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -139,11 +207,18 @@ class Author(models.Model):
             raise ValidationError("Отчество автора не может содержать только пробелы.")
 
     is_deleted = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = VersionedQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
 
+def rented_copies_message(rented):
+    return f"Выдано экземпляров: {rented}; количество не может быть меньше."
+
+
 # Модель книги
 class Book(models.Model):
     name = models.CharField(max_length=255,
@@ -160,16 +235,107 @@ class Book(models.Model):
             raise ValidationError("Год публикации должен быть положительным числом.")
         if not self.cover_url.strip():
             raise ValidationError("URL обложки книги не может быть пустым или содержать только пробелы.")
+        # Экземпляры на руках не исчезают: счётчик available ушёл бы ниже нуля
+        stored = Book.objects.filter(pk=self.pk).values_list(
+            'quantity', 'available').first()
+        if stored is not None and self.quantity < stored[0] - stored[1]:
+            raise ValidationError(
+                {'quantity': rented_copies_message(stored[0] - stored[1])})
 
     is_deleted = models.BooleanField(default=False)
     publishers = models.ManyToManyField(Publisher, blank=True)
     genres = models.ManyToManyField(Genre, blank=True)
     authors = models.ManyToManyField(Author, blank=True)
+    # Поисковый документ: название, авторы и жанры (поддерживается
+    # LibHub/search.py)
+    search_document = models.TextField(blank=True, default='', editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Всего экземпляров и экземпляров на полке (меняется только
+    # LibHub/rentals.py)
+    quantity = models.PositiveIntegerField(default=1)
+    available = models.PositiveIntegerField(default=1)
+
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset-пагинация каталога по (name, id); каталог всегда
+            # отфильтрован по is_deleted = false, поэтому индекс частичный
+            models.Index(fields=['name', 'id'], name='book_active_name_idx',
+                         condition=models.Q(is_deleted=False)),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(available__lte=models.F('quantity')),
+                name='book_available_lte_quantity'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            # Новая книга целиком на полке
+            self.available = self.quantity
+            return super().save(*args, **kwargs)
+        if kwargs.get('update_fields') is not None:
+            return super().save(*args, **kwargs)
+
+        # Счётчик available меняется только атомарными UPDATE
+        # (LibHub/rentals.py): обычное сохранение его не перезаписывает, а
+        # изменение quantity сдвигает его на ту же величину
+        previous = Book.objects.filter(pk=self.pk).values_list(
+            'quantity', flat=True).first()
+        kwargs['update_fields'] = [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name != 'available']
+        super().save(*args, **kwargs)
+        if previous is not None and previous != self.quantity:
+            Book.objects.filter(pk=self.pk).update(
+                available=models.F('available') + (self.quantity - previous))
+            self.refresh_from_db(fields=['available'])
 
     def __str__(self):
         return self.name
 
 
+# Поле теневой FTS5-таблицы, поддерживает lookup __match
+class FullTextField(models.TextField):
+    pass
+
+
+@FullTextField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+# Теневые FTS5-таблицы поиска книг в SQLite (создаются LibHub/search.py)
+class BookSearchIndex(models.Model):
+    book = models.OneToOneField(Book, primary_key=True, db_column='rowid',
+                                on_delete=models.DO_NOTHING,
+                                related_name='search_index')
+    search_document = FullTextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'LibHub_book_fts'
+
+
+class BookTrigramIndex(models.Model):
+    book = models.OneToOneField(Book, primary_key=True, db_column='rowid',
+                                on_delete=models.DO_NOTHING,
+                                related_name='trigram_index')
+    search_document = FullTextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'LibHub_book_trigram'
+
+
 # Модель запроса
 class Request(models.Model):
     class RequestStatus(models.TextChoices):
@@ -177,12 +343,45 @@ class Request(models.Model):
         EXPIRED = 'EXPIRED'
         RETURNED = 'RETURNED'
 
+    # Статусы, при которых экземпляр книги находится у читателя
+    ACTIVE_STATUSES = (RequestStatus.RENTED, RequestStatus.EXPIRED)
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     borrow_date = models.DateField()
     return_date = models.DateField()
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     status = models.CharField(max_length=8, choices=RequestStatus.choices,
                               validators=[MinLengthValidator(3), MaxLengthValidator(8)])
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # День фактического возврата; ставится при возврате (LibHub/rentals.py)
+    returned_at = models.DateField(null=True, blank=True, db_index=True)
+
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset-пагинация запросов по (borrow_date, id)
+            models.Index(fields=['borrow_date', 'id'],
+                         name='request_borrow_date_id_idx'),
+            # Аренды пользователя (профиль, выдача и возврат)
+            models.Index(fields=['user', 'status'],
+                         name='request_user_status_idx'),
+            # Аренды книги по статусу (учёт экземпляров, статистика)
+            models.Index(fields=['book', 'status'],
+                         name='request_book_status_idx'),
+            # Поиск просроченных аренд: status = 'RENTED' AND
+            # return_date < сегодня
+            models.Index(fields=['return_date', 'id'],
+                         name='request_rented_return_idx',
+                         condition=models.Q(status='RENTED')),
+        ]
+        constraints = [
+            # Не больше одной активной аренды книги у пользователя
+            models.UniqueConstraint(
+                fields=['user', 'book'],
+                condition=models.Q(status__in=['RENTED', 'EXPIRED']),
+                name='unique_active_rental'),
+        ]
 
     def clean(self):
         if self.return_date and self.return_date < self.borrow_date:
@@ -190,3 +389,259 @@ class Request(models.Model):
 
     def __str__(self):
         return f"Request #{self.id} - {self.user} - {self.book} - {self.status}"
+
+
+# Выдачи и возвраты за день по книге, жанру, автору или читателю
+# (см. LibHub/rollups.py)
+class RentalRollup(models.Model):
+    class Dimension(models.TextChoices):
+        BOOK = 'book'
+        GENRE = 'genre'
+        AUTHOR = 'author'
+        USER = 'user'
+
+    dimension = models.CharField(max_length=6, choices=Dimension.choices)
+    object_id = models.BigIntegerField()
+    day = models.DateField()
+    rented = models.PositiveIntegerField(default=0)
+    returned = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Он же индекс выборки за период:
+            # dimension = ... AND day BETWEEN ...
+            models.UniqueConstraint(fields=['dimension', 'day', 'object_id'],
+                                    name='unique_rental_rollup'),
+        ]
+
+    def __str__(self):
+        return (f"{self.dimension} #{self.object_id} {self.day}: "
+                f"+{self.rented} -{self.returned}")
+
+
+# Позиция долгих пакетных операций для продолжения после остановки
+class Checkpoint(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    value = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+# Запись об удалении строки отслеживаемой модели (для инкрементальной
+# резервной копии, см. LibHub/logical_backup.py); создаётся сигналом
+# post_delete
+class Tombstone(models.Model):
+    model = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.model} #{self.object_id}"
+
+
+# Хранилище артефактов с адресацией по содержимому (см. LibHub/artifacts.py):
+# файл (Blob) - последовательность фрагментов (Chunk), одинаковые фрагменты
+# хранятся один раз
+class Chunk(models.Model):
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveIntegerField()
+    # Последнее использование при записи: сборщик не трогает недавно
+    # использованные фрагменты
+    used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.digest
+
+
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
+class BlobChunk(models.Model):
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE,
+                             related_name='parts')
+    position = models.PositiveIntegerField()
+    chunk = models.ForeignKey(Chunk, on_delete=models.PROTECT,
+                              related_name='parts')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'position'],
+                                    name='unique_blob_chunk_position'),
+        ]
+
+
+# Именованный артефакт (загруженный файл или резервная копия); несколько
+# артефактов с одинаковым содержимым ссылаются на один Blob
+class Artifact(models.Model):
+    class Kind(models.TextChoices):
+        UPLOAD = 'UPLOAD'
+        BACKUP = 'BACKUP'
+        # Результаты фоновых задач: отчёты и выгрузки (см. LibHub/tasks.py)
+        REPORT = 'REPORT'
+
+    name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT,
+                             related_name='artifacts')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Политики хранения: артефакты вида по времени создания
+            models.Index(fields=['kind', 'created_at'],
+                         name='artifact_kind_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+# Фоновое восстановление базы из резервной копии (см. LibHub/backups.py)
+class RestoreJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'PENDING'
+        RUNNING = 'RUNNING'
+        DONE = 'DONE'
+        FAILED = 'FAILED'
+
+    class Format(models.TextChoices):
+        PLAIN = 'PLAIN'
+        DIRECTORY = 'DIRECTORY'
+
+    file = models.CharField(max_length=500)
+    # Новые копии хранятся в хранилище артефактов; file - путь для старых копий
+    artifact = models.ForeignKey(Artifact, null=True, blank=True,
+                                 on_delete=models.SET_NULL, related_name='+')
+    status = models.CharField(max_length=10, choices=Status.choices,
+                              default=Status.PENDING)
+    # PLAIN - SQL-дамп для psql, DIRECTORY - tar-архив pg_dump -Fd для
+    # pg_restore -j
+    archive_format = models.CharField(max_length=10, choices=Format.choices,
+                                      default=Format.PLAIN)
+    jobs = models.PositiveSmallIntegerField(default=1)
+    compression = models.CharField(max_length=10, blank=True)
+    bytes_total = models.BigIntegerField(default=0)
+    bytes_processed = models.BigIntegerField(default=0)
+    statements = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Restore #{self.pk} - {self.status}"
+
+
+# Параллельная резервная копия pg_dump -Fd -j N, упакованная в tar
+# (см. LibHub/backups.py)
+class BackupArchive(models.Model):
+    Status = RestoreJob.Status
+
+    file = models.CharField(max_length=500, blank=True, editable=False)
+    artifact = models.ForeignKey(Artifact, null=True, blank=True,
+                                 editable=False, on_delete=models.SET_NULL,
+                                 related_name='+')
+    jobs = models.PositiveSmallIntegerField(
+        default=4, validators=[MinValueValidator(1), MaxValueValidator(32)])
+    status = models.CharField(max_length=10, choices=Status.choices,
+                              default=Status.PENDING, editable=False)
+    size = models.BigIntegerField(default=0, editable=False)
+    duration = models.FloatField(null=True, blank=True, editable=False)
+    error = models.TextField(blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Backup #{self.pk} ({self.jobs} jobs) - {self.status}"
+
+
+# Фоновая задача в очереди в базе данных (см. LibHub/jobs.py, LibHub/tasks.py)
+class Job(models.Model):
+    class Kind(models.TextChoices):
+        STATISTICS_REPORT = 'STATISTICS_REPORT'
+        BOOK_EXPORT = 'BOOK_EXPORT'
+        BACKUP = 'BACKUP'
+        BACKUP_ARCHIVE = 'BACKUP_ARCHIVE'
+        RESTORE = 'RESTORE'
+        EXPIRE_RENTALS = 'EXPIRE_RENTALS'
+
+    Status = RestoreJob.Status
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    status = models.CharField(max_length=10, choices=Status.choices,
+                              default=Status.PENDING)
+    params = models.JSONField(default=dict, blank=True)
+    # Ключ результата: задачи с одинаковым ключом дают одинаковый результат
+    # (см. jobs.enqueue)
+    key = models.CharField(max_length=200, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    artifact = models.ForeignKey(Artifact, null=True, blank=True,
+                                 on_delete=models.SET_NULL, related_name='+')
+    requested_by = models.ForeignKey(User, null=True, blank=True,
+                                     on_delete=models.SET_NULL,
+                                     related_name='+')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    # Не запускать раньше (отложенный повтор после ошибки)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    progress_done = models.BigIntegerField(default=0)
+    progress_total = models.BigIntegerField(default=0)
+    progress_message = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Воркер периодически отмечается; задачи без отметки считаются брошенными
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Выбор следующей задачи: ожидающие по времени запуска
+            models.Index(fields=['status', 'run_after'], name='job_claim_idx'),
+            # Поиск готового результата по ключу
+            models.Index(fields=['kind', 'key'], name='job_key_idx'),
+        ]
+
+    @property
+    def percent(self):
+        if not self.progress_total:
+            return None
+        return round(100 * self.progress_done / self.progress_total, 1)
+
+    def __str__(self):
+        return f"Job #{self.pk} {self.kind} - {self.status}"
+
+
+# Журнал медленных SQL-запросов, сгруппированных по отпечатку
+# (см. LibHub/slow_queries.py)
+class SlowQuery(models.Model):
+    fingerprint = models.CharField(max_length=40, unique=True)
+    # Нормализованный текст: литералы и списки значений заменены на ?
+    normalized = models.TextField()
+    # Пример исходного запроса последнего попадания в журнал
+    sample_sql = models.TextField()
+    view = models.CharField(max_length=200, blank=True)
+    location = models.CharField(max_length=500, blank=True)
+    calls = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    plan = models.TextField(blank=True)
+    plan_at = models.DateTimeField(null=True, blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-total_ms'], name='slowquery_total_idx'),
+        ]
+
+    def __str__(self):
+        return (f"{self.fingerprint[:12]}: {self.calls} x, "
+                f"{self.total_ms:.0f} мс")
@@ -0,0 +1,283 @@
+"""
+Пагинация каталога.
+
+Основной режим - keyset (курсорная) пагинация по кортежу ``(sort_key, id)``:
+следующая страница выбирается условием
+``WHERE (sort_key, id) > (последнее значение)`` по индексу, без ``COUNT(*)``
+и ``OFFSET``, поэтому страница 10 000 стоит столько же, сколько первая.
+Постраничная пагинация (``?page=N``) оставлена для совместимости.
+"""
+import base64
+import binascii
+import json
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, reverse=False):
+    payload = json.dumps({'v': values, 'r': reverse}, cls=DjangoJSONEncoder,
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(
+        payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(
+            padded.encode('ascii')).decode('utf-8'))
+        return list(payload['v']), bool(payload.get('r', False))
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise InvalidCursor("Некорректный курсор пагинации.")
+
+
+def _split(ordering):
+    return [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+
+def _field(queryset, name):
+    """Поле модели или аннотации, по которому идёт упорядочивание."""
+    annotation = queryset.query.annotations.get(name)
+    if annotation is not None:
+        return annotation.output_field
+    return queryset.model._meta.get_field(name)
+
+
+def _after(ordering, values):
+    """
+    Условие "строго после курсора" для упорядочивания ``ordering``.
+
+    Для (a, id) получается ``a >= v AND (a > v OR id > i)`` - первая часть
+    даёт индексу диапазон, вторая отсекает уже показанные строки.
+    """
+    (name, descending), value = ordering[0], values[0]
+    strict = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+    if len(ordering) == 1:
+        return strict
+    bound = Q(**{f"{name}__{'lte' if descending else 'gte'}": value})
+    return bound & (strict | (Q(**{name: value})
+                              & _after(ordering[1:], values[1:])))
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    next_cursor: str = None
+    previous_cursor: str = None
+    ordering: tuple = field(default=())
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Keyset-пагинатор для QuerySet.
+
+    ``ordering`` - кортеж полей, последним должен идти уникальный ключ
+    (обычно ``id``), значения полей не должны быть NULL.
+    """
+
+    def __init__(self, queryset, ordering=('id',), page_size=20):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+
+    def _values(self, obj):
+        return [getattr(obj, name) for name, _ in _split(self.ordering)]
+
+    def _parse(self, values):
+        """
+        Привести значения курсора к типам полей: курсор приходит от клиента,
+        и в запрос не должно попасть значение, которое ORM не примет.
+        """
+        parsed = []
+        for (name, _), value in zip(_split(self.ordering), values):
+            try:
+                if value is None:
+                    raise ValueError(name)
+                parsed.append(_field(self.queryset, name).to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise InvalidCursor("Некорректное значение в курсоре.")
+        return parsed
+
+    def page(self, cursor=None):
+        ordering = _split(self.ordering)
+        values, reverse = decode_cursor(cursor) if cursor else (None, False)
+        if values is not None and len(values) != len(ordering):
+            raise InvalidCursor("Курсор не соответствует упорядочиванию.")
+        if values is not None:
+            values = self._parse(values)
+
+        if reverse:
+            # Предыдущая страница: идём от курсора в обратном порядке
+            ordering = [(name, not descending)
+                        for name, descending in ordering]
+        queryset = self.queryset.order_by(
+            *[f"{'-' if desc else ''}{name}" for name, desc in ordering])
+        if values is not None:
+            queryset = queryset.filter(_after(ordering, values))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        page = KeysetPage(rows, ordering=self.ordering)
+        if not rows:
+            return page
+        # При движении назад за последней строкой точно есть курсорная строка,
+        # при движении вперёд перед первой - строка предыдущей страницы
+        if has_more or reverse:
+            page.next_cursor = encode_cursor(self._values(rows[-1]))
+        if (has_more if reverse else values is not None):
+            page.previous_cursor = encode_cursor(self._values(rows[0]),
+                                                 reverse=True)
+        return page
+
+
+class CustomPagination(PageNumberPagination):
+    page_size = 20  # Количество объектов на странице
+    page_size_query_param = 'page_size'
+    max_page_size = 1000  # Максимальное количество объектов на странице
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная пагинация для DRF.
+
+    Упорядочивание берётся из атрибута представления ``keyset_ordering``.
+    Если клиент передаёт ``?page=N``, используется постраничная пагинация
+    ``CustomPagination`` - режим совместимости для старых клиентов.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('id',)
+    compatibility_class = CustomPagination
+
+    def __init__(self):
+        self.compatibility = None
+        self.page = None
+        self.request = None
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param,
+                                                self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        if self.compatibility_class.page_query_param in request.query_params:
+            self.compatibility = self.compatibility_class()
+            return self.compatibility.paginate_queryset(
+                queryset.order_by(*ordering), request, view)
+
+        self.request = request
+        paginator = KeysetPaginator(queryset, ordering,
+                                    self.get_page_size(request))
+        try:
+            self.page = paginator.page(
+                request.query_params.get(self.cursor_query_param))
+        except InvalidCursor as e:
+            raise NotFound(str(e))
+        return self.page.object_list
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        if self.compatibility is not None:
+            return self.compatibility.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True,
+                             'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор страницы (из ссылок next/previous).',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Количество объектов на странице.',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.compatibility_class.page_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Номер страницы (режим совместимости, '
+                               'использует OFFSET).',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+def page_links(request, page, cursor_param='cursor'):
+    """Ссылки на соседние страницы для HTML-шаблонов с сохранением фильтров."""
+    url = remove_query_param(request.get_full_path(), 'page')
+    return {
+        'next_page_url': (replace_query_param(url, cursor_param,
+                                              page.next_cursor)
+                          if page.has_next else None),
+        'previous_page_url': (replace_query_param(url, cursor_param,
+                                                  page.previous_cursor)
+                              if page.has_previous else None),
+    }
@@ -0,0 +1,313 @@
+"""
+Профилирование запросов в production.
+
+``ProfilingMiddleware`` (включается настройкой ``PROFILING['ENABLED']``) для
+каждого запроса измеряет полное время, время и число SQL-запросов и время
+отрисовки шаблонов и отдаёт их в заголовке ``Server-Timing`` (видно в
+инструментах разработчика браузера) и в лог ``LibHub.profiling``.
+
+Доля запросов ``PROFILING['SAMPLE_RATE']`` (и запросы персонала с
+заголовком ``X-Profile: 1``) дополнительно профилируется:
+
+* ``MODE = 'cprofile'`` - cProfile, результат скачивается как файл pstats
+  (``python -m pstats``, snakeviz) или текстовая сводка;
+* ``MODE = 'sampling'`` - выборка стека потока запроса раз в
+  ``SAMPLE_INTERVAL`` секунд, результат - свёрнутые стеки
+  (flamegraph.pl, speedscope).
+
+Профили хранятся в кольцевом буфере на ``BUFFER_SIZE`` записей в кэше Django:
+при Redis буфер общий для всех воркеров, перезапуск не нужен. Просмотр -
+``profiles_view``/``profile_download_view`` (только для персонала).
+"""
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.backends.django import Template
+from django.utils import timezone
+
+from .query_budget import QueryCounter
+
+logger = logging.getLogger('LibHub.profiling')
+
+KEY_PREFIX = 'libhub:profiling'
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,
+    'MODE': 'cprofile',
+    'SAMPLE_INTERVAL': 0.005,
+    'BUFFER_SIZE': 50,
+    'TIMEOUT': 24 * 60 * 60,
+    'CACHE_ALIAS': 'default',
+}
+MODES = ('cprofile', 'sampling')
+
+# Метрики текущего запроса: отрисовка шаблонов добавляет сюда своё время
+_current = ContextVar('libhub_profiling', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def _cache():
+    return caches[get_config()['CACHE_ALIAS']]
+
+
+class RequestMetrics(QueryCounter):
+    """Счётчик SQL-запросов, дополнительно суммирующий их время."""
+
+    def __init__(self):
+        super().__init__()
+        self.sql_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return super().__call__(execute, sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+
+
+_original_render = Template.render
+
+
+def _timed_render(self, context=None, request=None):
+    metrics = _current.get()
+    if metrics is None:
+        return _original_render(self, context, request)
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context, request)
+    finally:
+        metrics.template_time += time.perf_counter() - started
+
+
+def _install_template_timer():
+    # Подменяется отрисовка шаблона верхнего уровня (render/TemplateResponse):
+    # вложенные {% include %} входят в её время и не считаются дважды
+    if Template.render is not _timed_render:
+        Template.render = _timed_render
+
+
+class StackSampler:
+    """
+    Выборка стека одного потока в фоновом потоке; результат - свёрнутые
+    стеки.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} "
+                             f"({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            # Выборка во время stop() показала бы ожидание самого
+            # профилировщика
+            if names and not self._stop.is_set():
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class Profiler:
+    def __init__(self, mode, interval):
+        self.mode = mode
+        if mode == 'cprofile':
+            self._profile = cProfile.Profile()
+        else:
+            self._profile = StackSampler(threading.get_ident(), interval)
+
+    def start(self):
+        if self.mode == 'cprofile':
+            # Python 3.12+: ValueError, если cProfile уже включён в другом
+            # потоке - запрос тогда не профилируется
+            self._profile.enable()
+        else:
+            self._profile.start()
+
+    def stop(self):
+        """
+        Остановить и вернуть данные: marshal-дамп pstats или {стек: число
+        выборок}.
+        """
+        if self.mode == 'cprofile':
+            self._profile.disable()
+            self._profile.create_stats()
+            return marshal.dumps(self._profile.stats)
+        self._profile.stop()
+        return dict(self._profile.stacks)
+
+
+def _entry_key(slot):
+    return f"{KEY_PREFIX}:entry:{slot}"
+
+
+def save_profile(entry):
+    """Записать профиль в кольцевой буфер; возвращает его номер."""
+    config = get_config()
+    cache = _cache()
+    key = f"{KEY_PREFIX}:seq"
+    try:
+        number = cache.incr(key)
+    except ValueError:
+        number = 1 if cache.add(key, 1, timeout=None) else cache.incr(key)
+    entry['id'] = number
+    cache.set(_entry_key(number % config['BUFFER_SIZE']), entry,
+              timeout=config['TIMEOUT'])
+    return number
+
+
+def list_profiles():
+    """Профили из буфера (без данных), новые первыми."""
+    size = get_config()['BUFFER_SIZE']
+    entries = _cache().get_many(
+        [_entry_key(slot) for slot in range(size)]).values()
+    return sorted(({k: v for k, v in entry.items() if k != 'data'}
+                   for entry in entries),
+                  key=lambda entry: entry['id'], reverse=True)
+
+
+def get_profile(number):
+    entry = _cache().get(_entry_key(number % get_config()['BUFFER_SIZE']))
+    # Слот мог быть перезаписан более новым профилем
+    if entry is None or entry['id'] != number:
+        return None
+    return entry
+
+
+class _StatsSource:
+    # pstats.Stats принимает объект с create_stats()/stats, как у
+    # cProfile.Profile
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def render_text(entry, limit=40):
+    output = io.StringIO()
+    if entry['mode'] == 'cprofile':
+        stats = pstats.Stats(_StatsSource(marshal.loads(entry['data'])),
+                             stream=output)
+        stats.sort_stats('cumulative').print_stats(limit)
+    else:
+        # Собственное время: выборки по верхнему кадру стека
+        leaves = Counter()
+        for stack, count in entry['data'].items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        for frame, count in leaves.most_common(limit):
+            output.write(f"{count:6d}  {frame}\n")
+    return output.getvalue()
+
+
+def render_collapsed(entry):
+    """
+    Свёрнутые стеки (``кадр;кадр;кадр число``) для flamegraph.pl и
+    speedscope.
+    """
+    return ''.join(f"{stack} {count}\n"
+                   for stack, count in sorted(entry['data'].items()))
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else ''
+
+
+def _wants_profile(request, config):
+    if request.headers.get('X-Profile') == '1':
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+    return random.random() < config['SAMPLE_RATE']
+
+
+class ProfilingMiddleware:
+    """Замер времени запроса, SQL и шаблонов; выборочное профилирование."""
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        if config['MODE'] not in MODES:
+            raise ValueError(f"PROFILING['MODE'] должен быть одним из {MODES}")
+        _install_template_timer()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_config()
+        metrics = RequestMetrics()
+        profiler = None
+        if _wants_profile(request, config):
+            profiler = Profiler(config['MODE'], config['SAMPLE_INTERVAL'])
+        token = _current.set(metrics)
+        started_at = timezone.now()
+        started = time.perf_counter()
+        try:
+            with metrics.track():
+                if profiler is not None:
+                    try:
+                        profiler.start()
+                    except ValueError:
+                        profiler = None
+                try:
+                    response = self.get_response(request)
+                finally:
+                    data = profiler.stop() if profiler is not None else None
+        finally:
+            _current.reset(token)
+        wall = time.perf_counter() - started
+
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={wall * 1000:.1f}',
+            f'sql;dur={metrics.sql_time * 1000:.1f};'
+            f'desc="{metrics.count} queries"',
+            f'tpl;dur={metrics.template_time * 1000:.1f}',
+        ])
+        summary = {
+            'method': request.method,
+            'path': request.path,
+            'view': _view_name(request),
+            'status': response.status_code,
+            'started_at': started_at.isoformat(),
+            'wall_ms': round(wall * 1000, 1),
+            'sql_ms': round(metrics.sql_time * 1000, 1),
+            'queries': metrics.count,
+            'template_ms': round(metrics.template_time * 1000, 1),
+        }
+        logger.info("%(method)s %(path)s %(status)s: %(wall_ms)s мс, "
+                    "SQL %(sql_ms)s мс (%(queries)s), "
+                    "шаблоны %(template_ms)s мс", summary)
+        if profiler is not None:
+            number = save_profile({**summary, 'mode': profiler.mode,
+                                   'data': data})
+            response['X-Profile-Id'] = str(number)
+        return response
@@ -0,0 +1,124 @@
+"""
+Бюджет SQL-запросов на представление.
+
+Представление объявляет максимальное число запросов:
+
+* функции - декоратором ``@query_budget(8)``;
+* классы (ListView, ViewSet и т.п.) - атрибутом ``query_budget = 8``.
+
+``QueryBudgetMiddleware`` считает запросы ко всем базам за время обработки
+запроса (включая отрисовку шаблона). При превышении бюджета в строгом режиме
+выбрасывается ``QueryBudgetExceeded`` - тесты падают, иначе пишется
+предупреждение в лог ``LibHub.query_budget``.
+
+Бюджет проверяется только для чтения (GET, HEAD): проверка идёт после
+обработки, и ошибка после зафиксированной записи (POST, DELETE...) вернула
+бы клиенту 500 на успешно выполненное действие.
+
+Настройки:
+
+* ``QUERY_BUDGET_STRICT`` - строгий режим; по умолчанию включён при DEBUG
+  и в тестовом окружении;
+* ``QUERY_BUDGET_DEFAULT`` - бюджет для представлений без явного объявления
+  (``None`` - не проверять).
+"""
+import logging
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.core import mail
+from django.db import connections
+
+logger = logging.getLogger('LibHub.query_budget')
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries):
+    """Объявить бюджет SQL-запросов для функции-представления."""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            return view_func(*args, **kwargs)
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+
+def get_view_budget(view_func):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        # Django CBV хранит класс в view_class, DRF ViewSet - в cls
+        view_class = (getattr(view_func, 'view_class', None)
+                      or getattr(view_func, 'cls', None))
+        budget = getattr(view_class, 'query_budget', None)
+    if budget is None:
+        budget = getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+    return budget
+
+
+def is_strict():
+    strict = getattr(settings, 'QUERY_BUDGET_STRICT', None)
+    if strict is None:
+        # setup_test_environment() подменяет почтовый backend и создаёт
+        # mail.outbox
+        return settings.DEBUG or hasattr(mail, 'outbox')
+    return strict
+
+
+class QueryCounter:
+    """
+    Обёртка выполнения запросов (connection.execute_wrapper), считающая
+    запросы.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if len(self.statements) < 100:
+            self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+    def track(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with counter.track():
+            response = self.get_response(request)
+
+        budget = getattr(request, '_query_budget', None)
+        if budget is not None and counter.count > budget:
+            message = (f"{request.method} {request.path}: "
+                       f"{counter.count} SQL-запросов "
+                       f"при бюджете {budget} ({request._query_budget_view})")
+            if is_strict():
+                raise QueryBudgetExceeded(
+                    message + "\n" + "\n".join(counter.statements))
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS:
+            return None
+        request._query_budget = get_view_budget(view_func)
+        view = (getattr(view_func, 'view_class', None)
+                or getattr(view_func, 'cls', None) or view_func)
+        request._query_budget_view = getattr(view, '__qualname__', repr(view))
+        return None
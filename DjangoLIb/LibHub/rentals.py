@@ -0,0 +1,304 @@
+"""
+Выдача, возврат и просрочка аренд с учётом экземпляров.
+
+Счётчик ``Book.available`` уменьшается одним условным запросом
+``UPDATE ... SET available = available - 1 WHERE available > 0``, поэтому
+одновременные запросы не могут выдать больше экземпляров, чем есть.
+Повторную активную аренду той же книги отсекает уникальное ограничение
+``unique_active_rental``; в этом случае транзакция откатывается вместе
+с уменьшением счётчика.
+
+Выдача и возврат в той же транзакции обновляют дневные сводки
+(LibHub/rollups.py).
+
+Аренды, которые создают, правят и удаляют мимо выдачи и возврата (API,
+формы, админка), проходят через ``save_rental`` и ``delete_rental``: они
+занимают и освобождают экземпляры так же, как выдача и возврат. Экземпляр
+освобождается условием ``available < quantity``, поэтому счётчик не
+превышает число экземпляров.
+
+``expire_overdue_rentals`` переводит просроченные аренды RENTED -> EXPIRED
+порциями по частичному индексу ``(return_date, id) WHERE status = 'RENTED'``:
+одна транзакция на порцию, позиция сохраняется в ``Checkpoint``, поэтому
+прерванный проход продолжается с места остановки, а блокировки держатся
+недолго.
+"""
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import rollups
+from .metrics import rental_event
+from .models import Book, Checkpoint, Request
+
+RENTAL_PERIOD = timedelta(days=14)
+
+
+class RentalError(Exception):
+    pass
+
+
+class AlreadyRented(RentalError):
+    pass
+
+
+class NoCopiesAvailable(RentalError):
+    pass
+
+
+def _take_copy(book_id):
+    taken = Book.objects.filter(
+        pk=book_id, is_deleted=False, available__gt=0,
+    ).update(available=F('available') - 1)
+    if not taken:
+        if not Book.objects.filter(pk=book_id, is_deleted=False).exists():
+            raise Book.DoesNotExist("Книга не найдена.")
+        raise NoCopiesAvailable("Все экземпляры книги уже выданы.")
+
+
+def _release_copy(book_id):
+    Book.objects.filter(pk=book_id, available__lt=F('quantity')).update(
+        available=F('available') + 1
+    )
+
+
+def rent_book(user, book_id, today=None):
+    """
+    Выдать пользователю экземпляр книги. Возвращает созданный ``Request``.
+    """
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        _take_copy(book_id)
+        try:
+            with transaction.atomic():
+                rental = Request.objects.create(
+                    user=user,
+                    book_id=book_id,
+                    borrow_date=today,
+                    return_date=today + RENTAL_PERIOD,
+                    status=Request.RequestStatus.RENTED,
+                )
+        except IntegrityError:
+            # Исключение откатывает и уменьшение счётчика во внешней транзакции
+            raise AlreadyRented("Вы уже арендовали эту книгу.")
+        rollups.record(book_id, user.pk, today, 'rented')
+        rental_event('created')
+    return rental
+
+
+def return_book(user, request_id):
+    """Вернуть книгу по активной аренде пользователя. Возвращает id книги."""
+    with transaction.atomic():
+        rental = Request.objects.filter(pk=request_id, user=user,
+                                        status__in=Request.ACTIVE_STATUSES)
+        book_id = rental.values_list('book_id', flat=True).first()
+        today = timezone.localdate()
+        # Условный UPDATE: из двух одновременных возвратов пройдёт только один
+        if book_id is None or not rental.update(
+                status=Request.RequestStatus.RETURNED, returned_at=today):
+            raise Request.DoesNotExist("Активная аренда не найдена.")
+        _release_copy(book_id)
+        rollups.record(book_id, user.pk, today, 'returned')
+        rental_event('returned')
+    return book_id
+
+
+def _holds_copy(status):
+    return status in Request.ACTIVE_STATUSES
+
+
+def check_rental(rental):
+    """
+    Проверка аренды для форм, без блокировок: хватит ли экземпляров и нет ли
+    у читателя другой активной аренды книги. Окончательно решает
+    ``save_rental``.
+    """
+    if not _holds_copy(rental.status):
+        return
+    active = Request.objects.filter(status__in=Request.ACTIVE_STATUSES)
+    if active.filter(user_id=rental.user_id, book_id=rental.book_id).exclude(
+            pk=rental.pk).exists():
+        raise AlreadyRented("У читателя уже есть активная аренда этой книги.")
+    held = active.filter(pk=rental.pk).values_list('book_id', flat=True)
+    if rental.pk is not None and held.first() == rental.book_id:
+        return
+    if not Book.objects.filter(pk=rental.book_id, is_deleted=False,
+                               available__gt=0).exists():
+        raise NoCopiesAvailable("Все экземпляры книги уже выданы.")
+
+
+def save_rental(rental):
+    """
+    Сохранить аренду, созданную или изменённую вне выдачи и возврата.
+
+    Аренда, ставшая активной (или перенесённая на другую книгу), занимает
+    экземпляр книги, завершённая - освобождает. Возвращённой аренде
+    ставится день возврата ``returned_at``, при смене статуса он снимается;
+    сводки переносятся вслед за книгой, читателем и днями выдачи и
+    возврата. Ошибки - ``NoCopiesAvailable`` и ``AlreadyRented``, как у
+    выдачи.
+    """
+    returned = Request.RequestStatus.RETURNED
+    with transaction.atomic():
+        previous = None
+        if rental.pk is not None:
+            previous = (Request.objects.select_for_update()
+                        .filter(pk=rental.pk)
+                        .values('book_id', 'user_id', 'borrow_date', 'status',
+                                'returned_at')
+                        .first())
+        held = (previous['book_id']
+                if previous and _holds_copy(previous['status']) else None)
+        holds = rental.book_id if _holds_copy(rental.status) else None
+        if held != holds:
+            if holds is not None:
+                try:
+                    _take_copy(holds)
+                except Book.DoesNotExist:
+                    raise NoCopiesAvailable("Книга удалена из каталога.")
+            if held is not None:
+                _release_copy(held)
+        was_returned = previous is not None and previous['status'] == returned
+        if rental.status != returned:
+            rental.returned_at = None
+        elif was_returned:
+            rental.returned_at = previous['returned_at']
+        else:
+            rental.returned_at = timezone.localdate()
+        try:
+            with transaction.atomic():
+                rental.save()
+        except IntegrityError:
+            raise AlreadyRented(
+                "У читателя уже есть активная аренда этой книги.")
+
+        rented = (rental.book_id, rental.user_id, rental.borrow_date)
+        returned_on = (rental.book_id, rental.user_id, rental.returned_at)
+        was_rented = was_returned_on = None
+        if previous is None:
+            rental_event('created')
+        else:
+            was_rented = (previous['book_id'], previous['user_id'],
+                          previous['borrow_date'])
+            was_returned_on = (previous['book_id'], previous['user_id'],
+                               previous['returned_at'])
+            if not was_returned and rental.status == returned:
+                rental_event('returned')
+        for measure, before, after in (('rented', was_rented, rented),
+                                       ('returned', was_returned_on,
+                                        returned_on)):
+            if before == after:
+                continue
+            # Без дня (аренда не возвращена) событие в сводках не учтено
+            if before is not None and before[2] is not None:
+                rollups.record(*before, measure, -1)
+            if after[2] is not None:
+                rollups.record(*after, measure)
+    return rental
+
+
+def delete_rental(rental):
+    """Удалить аренду; экземпляр активной аренды возвращается на полку."""
+    with transaction.atomic():
+        # Учёт снимает forget_rental из сигнала pre_delete
+        rental.delete()
+
+
+def forget_rental(rental):
+    """
+    Снять учёт аренды перед удалением её строки: экземпляр активной аренды
+    возвращается на полку, выдача и возврат уходят из сводок. Вызывается для
+    любого удаления - и прямого, и каскадного вместе с читателем или книгой.
+    """
+    with transaction.atomic():
+        current = (Request.objects.select_for_update().filter(pk=rental.pk)
+                   .values('book_id', 'user_id', 'borrow_date', 'status',
+                           'returned_at')
+                   .first())
+        if current is None:
+            return
+        if _holds_copy(current['status']):
+            _release_copy(current['book_id'])
+        rollups.record(current['book_id'], current['user_id'],
+                       current['borrow_date'], 'rented', -1)
+        if current['returned_at'] is not None:
+            rollups.record(current['book_id'], current['user_id'],
+                           current['returned_at'], 'returned', -1)
+
+
+EXPIRY_CHECKPOINT = 'expire_overdue_rentals'
+
+
+def overdue_requests(today):
+    """Аренды RENTED с истёкшим сроком возврата."""
+    return Request.objects.filter(status=Request.RequestStatus.RENTED,
+                                  return_date__lt=today)
+
+
+@dataclass
+class SweepResult:
+    expired: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.expired / self.seconds if self.seconds else 0.0
+
+
+def expire_overdue_rentals(today=None, chunk_size=1000, max_chunks=None,
+                           restart=False, progress=None):
+    """
+    Перевести аренды с истёкшим ``return_date`` в статус EXPIRED.
+
+    ``max_chunks`` ограничивает работу одного запуска (удобно для
+    планировщика), ``progress`` - функция, вызываемая с ``SweepResult``
+    после каждой порции.
+    Сегодня - по часовому поясу проекта (``TIME_ZONE``), как и даты аренд.
+    """
+    today = today or timezone.localdate()
+    checkpoint, _ = Checkpoint.objects.get_or_create(name=EXPIRY_CHECKPOINT)
+    position = checkpoint.value
+    if restart or position.get('cutoff') != today.isoformat():
+        position = {'cutoff': today.isoformat()}
+
+    overdue = overdue_requests(today)
+    result = SweepResult()
+    started = time.perf_counter()
+    while max_chunks is None or result.chunks < max_chunks:
+        chunk = overdue
+        if 'id' in position:
+            # Продолжаем строго после последней обработанной строки
+            # (return_date, id)
+            last_date = date.fromisoformat(position['return_date'])
+            chunk = chunk.filter(
+                Q(return_date__gt=last_date)
+                | Q(return_date=last_date, id__gt=position['id']))
+        rows = list(chunk.order_by('return_date', 'id')
+                    .values_list('id', 'return_date')[:chunk_size])
+        if not rows:
+            break
+
+        last_id, last_date = rows[-1]
+        position = {'cutoff': today.isoformat(),
+                    'return_date': last_date.isoformat(), 'id': last_id}
+        with transaction.atomic():
+            # Повторная проверка статуса: аренду могли вернуть после выборки
+            expired = Request.objects.filter(
+                id__in=[row[0] for row in rows],
+                status=Request.RequestStatus.RENTED,
+            ).update(status=Request.RequestStatus.EXPIRED)
+            rental_event('expired', expired)
+            result.expired += expired
+            Checkpoint.objects.filter(pk=checkpoint.pk).update(value=position)
+        result.chunks += 1
+        result.seconds = time.perf_counter() - started
+        if progress is not None:
+            progress(result)
+
+    result.seconds = time.perf_counter() - started
+    return result
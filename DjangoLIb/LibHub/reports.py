@@ -0,0 +1,144 @@
+"""
+Отчёты, формируемые в очереди задач (LibHub/tasks.py).
+
+Статистика аренд не пересчитывается по всей таблице ``Request``: счётчики по
+книгам хранятся в ``Checkpoint`` и дополняются только новыми арендами. Если
+учтённую аренду удалили или изменили (её могли перенести на другую книгу),
+счётчики строятся заново. Готовый отчёт переиспользуется, пока не изменится
+``data_version()``.
+"""
+from collections import Counter
+from datetime import datetime
+from io import BytesIO
+
+from django.db.models import Count, Max, Q
+from docx import Document
+from docx.shared import Inches
+
+from . import charts, rollups
+from .models import Book, Checkpoint, RentalRollup, Request, Tombstone
+
+DOCX_CONTENT_TYPE = ('application/vnd.openxmlformats-officedocument.'
+                     'wordprocessingml.document')
+STATISTICS_CHECKPOINT = 'rental-statistics'
+# Аренды с id в пределах SETTLED_LAG от последнего пересчитываются при каждом
+# обновлении: транзакция, получившая id раньше, может зафиксироваться позже
+# соседних
+SETTLED_LAG = 1000
+
+
+def _last_request_id():
+    return (Request.objects.order_by('-pk').values_list('pk', flat=True)
+            .first() or 0)
+
+
+def _last_request_deletion():
+    return (Tombstone.objects.filter(model=Request._meta.label_lower)
+            .order_by('-pk').values_list('pk', flat=True).first() or 0)
+
+
+def _last_request_change():
+    return Request.objects.aggregate(changed=Max('updated_at'))['changed']
+
+
+def _timestamp(value):
+    return int(value.timestamp() * 1_000_000) if value else 0
+
+
+def data_version():
+    """
+    Версия данных отчёта: меняется при новых, изменённых и удалённых арендах
+    и при изменении книг (названия). Четыре запроса по индексам, без чтения
+    таблицы аренд.
+    """
+    books_changed = Book.objects.aggregate(
+        changed=Max('updated_at'))['changed']
+    return (f"{_last_request_id()}.{_last_request_deletion()}."
+            f"{_timestamp(books_changed)}."
+            f"{_timestamp(_last_request_change())}")
+
+
+def _named(counts):
+    names = dict(Book._base_manager.filter(pk__in=list(counts))
+                 .values_list('pk', 'name'))
+    return sorted((names[book_id], count) for book_id, count in counts.items()
+                  if count and book_id in names)
+
+
+def rental_counts(start=None, end=None):
+    """
+    (название книги, число аренд) для всех когда-либо арендованных книг или,
+    если задан период, для выданных с ``start`` по ``end`` (по дневным
+    сводкам, LibHub/rollups.py).
+    """
+    if start is not None or end is not None:
+        return _named(rollups.totals(RentalRollup.Dimension.BOOK, start, end))
+    checkpoint, _ = Checkpoint.objects.get_or_create(
+        name=STATISTICS_CHECKPOINT)
+    state = checkpoint.value
+    last_deletion = _last_request_deletion()
+    last_change = _last_request_change()
+    changed = state.get('changed')
+    if (state.get('deletion') != last_deletion or changed is None
+            or Request.objects.filter(
+                pk__lte=state['settled'],
+                updated_at__gt=datetime.fromisoformat(changed)).exists()):
+        # Прежняя книга удалённой или изменённой аренды неизвестна - счётчики
+        # строятся заново
+        state = {'deletion': last_deletion, 'settled': 0, 'counts': {}}
+
+    counts = Counter({int(book_id): count
+                      for book_id, count in state['counts'].items()})
+    settled = max(state['settled'], _last_request_id() - SETTLED_LAG)
+    tail = (Request.objects.filter(pk__gt=state['settled']).order_by()
+            .values_list('book_id')
+            .annotate(settling=Count('id', filter=Q(pk__lte=settled)),
+                      total=Count('id')))
+    recent = Counter()
+    for book_id, settling, total in tail:
+        counts[book_id] += settling
+        recent[book_id] += total - settling
+    Checkpoint.objects.filter(pk=checkpoint.pk).update(value={
+        'deletion': last_deletion,
+        'changed': last_change and last_change.isoformat(),
+        'settled': settled,
+        'counts': {str(book_id): count
+                   for book_id, count in counts.items() if count},
+    })
+
+    counts.update(recent)
+    return _named(counts)
+
+
+def render_chart(counts, image_format='png'):
+    """Круговая диаграмма аренд по книгам (LibHub/charts.py)."""
+    return charts.render_pie(counts, 'Статистика аренды книг', image_format)
+
+
+def write_rental_statistics(output, counts=None, chart=None, start=None,
+                            end=None):
+    """
+    Записать в ``output`` документ Word с диаграммой и списком аренд по
+    книгам.
+    """
+    counts = rental_counts(start, end) if counts is None else counts
+    chart = render_chart(counts) if chart is None else chart
+
+    document = Document()
+    if start is None and end is None:
+        document.add_heading('Статистика когда-либо арендованных книг',
+                             level=1)
+    else:
+        period = ' '.join(part for part in (start and f'с {start:%d.%m.%Y}',
+                                            end and f'по {end:%d.%m.%Y}')
+                          if part)
+        document.add_heading(f'Статистика аренд книг {period}', level=1)
+    document.add_paragraph('Диаграмма ниже отображает статистику по книгам, '
+                           'которые когда-либо были арендованны:')
+    document.add_picture(BytesIO(chart), width=Inches(5))
+
+    # Добавляем текстовый список после диаграммы
+    document.add_paragraph('Список статистики по книгам:')
+    for name, count in counts:
+        document.add_paragraph(f"- {name}: {count} раз(а)")
+    document.save(output)
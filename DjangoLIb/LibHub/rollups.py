@@ -0,0 +1,212 @@
+"""
+Дневные сводки аренд (``RentalRollup``).
+
+Для каждого дня хранится число выдач и возвратов по книге, жанру, автору и
+читателю. Сводки обновляются в транзакциях выдачи и возврата
+(LibHub/rentals.py), поэтому отчёт за любой период читает дни x объекты, а
+не всю историю ``Request``.
+
+``manage.py rebuild_rollups`` пересобирает сводки из ``Request`` порциями
+дней в нескольких потоках - после массовой загрузки данных
+(``generate_library_data``) или восстановления физической копии; логическое
+восстановление пересобирает их само (``rebuild_all``). Выдачи считаются по
+``borrow_date``, возвраты - по дню возврата ``returned_at``.
+"""
+import datetime
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import reduce
+from operator import or_
+
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.utils import timezone
+
+from .models import Book, RentalRollup, Request
+
+Dimension = RentalRollup.Dimension
+# Поле аренды, по которому строится сводка измерения
+DIMENSION_FIELDS = {
+    Dimension.BOOK: 'book_id',
+    Dimension.USER: 'user_id',
+    Dimension.GENRE: 'book__genres',
+    Dimension.AUTHOR: 'book__authors',
+}
+
+
+def _keys(book_id, user_id):
+    """
+    (измерение, id) всех сводок, которые затрагивает аренда книги
+    читателем.
+    """
+    keys = [(Dimension.BOOK, book_id), (Dimension.USER, user_id)]
+    keys += [(Dimension.GENRE, genre_id) for genre_id in
+             Book.genres.through.objects.filter(book_id=book_id)
+             .values_list('genre_id', flat=True)]
+    keys += [(Dimension.AUTHOR, author_id) for author_id in
+             Book.authors.through.objects.filter(book_id=book_id)
+             .values_list('author_id', flat=True)]
+    return keys
+
+
+def record(book_id, user_id, day, measure, delta=1):
+    """
+    Учесть выдачу (``measure='rented'``) или возврат (``'returned'``) в
+    сводках дня ``day``; ``delta=-1`` снимает учтённое ранее событие
+    (аренду удалили или исправили).
+    """
+    # Вставка и блокировки идут в одном порядке ключей: одновременные
+    # аренды ждут друг друга, но не взаимоблокируются
+    keys = sorted(_keys(book_id, user_id))
+    if delta > 0:
+        RentalRollup.objects.bulk_create(
+            [RentalRollup(dimension=dimension, object_id=object_id, day=day)
+             for dimension, object_id in keys],
+            ignore_conflicts=True,
+        )
+    rows = RentalRollup.objects.filter(
+        reduce(or_, (Q(dimension=dimension, object_id=object_id)
+                     for dimension, object_id in keys)),
+        day=day)
+    if delta < 0:
+        # Сводки могли не пересобрать после загрузки данных - ниже нуля нельзя
+        rows = rows.filter(**{f'{measure}__gte': -delta})
+    locked = list(rows.select_for_update().order_by('dimension', 'object_id')
+                  .values_list('pk', flat=True))
+    RentalRollup.objects.filter(pk__in=locked).update(
+        **{measure: F(measure) + delta})
+
+
+def _period(rows, start, end):
+    if start is not None:
+        rows = rows.filter(day__gte=start)
+    if end is not None:
+        rows = rows.filter(day__lte=end)
+    return rows
+
+
+def totals(dimension, start=None, end=None, measure='rented'):
+    """
+    {id объекта: сумма ``measure``} за дни с ``start`` по ``end``
+    включительно.
+    """
+    rows = _period(RentalRollup.objects.filter(dimension=dimension),
+                   start, end)
+    return dict(rows.order_by().values_list('object_id')
+                .annotate(total=Sum(measure)).filter(total__gt=0))
+
+
+def series(dimension, start=None, end=None, object_ids=None):
+    """Строки (день, id объекта, выдачи, возвраты) за период, по дням."""
+    rows = _period(RentalRollup.objects.filter(dimension=dimension),
+                   start, end)
+    if object_ids is not None:
+        rows = rows.filter(object_id__in=object_ids)
+    return rows.order_by('day', 'object_id').values_list(
+        'day', 'object_id', 'rented', 'returned')
+
+
+def rebuild_days(start, end, using=DEFAULT_DB_ALIAS):
+    """
+    Пересобрать сводки за дни [start, end) из ``Request``. Возвращает число
+    строк сводок.
+    """
+    counts = defaultdict(lambda: [0, 0])
+    requests = Request.objects.using(using)
+    rented = requests.filter(borrow_date__gte=start,
+                             borrow_date__lt=end).order_by()
+    returned = requests.filter(returned_at__gte=start,
+                               returned_at__lt=end).order_by()
+    for index, (rentals, day_field) in enumerate(
+            ((rented, 'borrow_date'), (returned, 'returned_at'))):
+        for dimension, field in DIMENSION_FIELDS.items():
+            grouped = (rentals.filter(**{f'{field}__isnull': False})
+                       .values_list(day_field, field)
+                       .annotate(count=Count('id')))
+            for day, object_id, count in grouped:
+                counts[dimension, object_id, day][index] += count
+    rollups = RentalRollup.objects.using(using)
+    with transaction.atomic(using=using):
+        rollups.filter(day__gte=start, day__lt=end).delete()
+        rollups.bulk_create([
+            RentalRollup(dimension=dimension, object_id=object_id, day=day,
+                         rented=values[0], returned=values[1])
+            for (dimension, object_id, day), values in counts.items()
+        ], batch_size=1000)
+    return len(counts)
+
+
+def _rebuild_chunk(chunk):
+    try:
+        return rebuild_days(*chunk)
+    finally:
+        # У каждого потока пула своё подключение
+        connection.close()
+
+
+@dataclass
+class RebuildResult:
+    days: int = 0
+    rows: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+
+
+def history_bounds(using=DEFAULT_DB_ALIAS):
+    """Первый и последний день, за которые могут быть сводки."""
+    bounds = Request.objects.using(using).aggregate(first=Min('borrow_date'),
+                                                    last=Max('borrow_date'))
+    if bounds['first'] is None:
+        return None, None
+    return bounds['first'], max(bounds['last'], timezone.localdate())
+
+
+def rebuild_all(using=DEFAULT_DB_ALIAS):
+    """
+    Пересобрать все сводки одной порцией в текущей транзакции (после
+    загрузки копии, пока её данные не зафиксированы). Возвращает число
+    строк сводок.
+    """
+    RentalRollup.objects.using(using).all().delete()
+    first, last = history_bounds(using)
+    if first is None:
+        return 0
+    return rebuild_days(first, last + datetime.timedelta(days=1), using)
+
+
+def rebuild(start=None, end=None, chunk_days=31, workers=4, progress=None):
+    """
+    Пересобрать сводки за дни с ``start`` по ``end`` включительно (по
+    умолчанию - всю историю) порциями по ``chunk_days`` дней в ``workers``
+    потоках; каждая порция - отдельная транзакция. ``progress`` вызывается
+    с ``RebuildResult`` после каждой порции.
+
+    Выдачи и возвраты во время пересборки порции с сегодняшним днём могут не
+    попасть в сводку - такую порцию стоит пересобрать в спокойное время.
+    """
+    first, last = history_bounds()
+    start, end = start or first, end or last
+    result = RebuildResult()
+    if start is None or end is None or end < start:
+        return result
+    chunks = []
+    day = start
+    while day <= end:
+        chunks.append((day, min(day + datetime.timedelta(days=chunk_days),
+                                end + datetime.timedelta(days=1))))
+        day = chunks[-1][1]
+    started = time.perf_counter()
+    # SQLite не допускает параллельной записи
+    workers = workers if connection.vendor == 'postgresql' else 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (chunk_start, chunk_end), rows in zip(
+                chunks, pool.map(_rebuild_chunk, chunks)):
+            result.days += (chunk_end - chunk_start).days
+            result.rows += rows
+            result.chunks += 1
+            result.seconds = time.perf_counter() - started
+            if progress is not None:
+                progress(result)
+    return result
@@ -0,0 +1,309 @@
+"""
+Полнотекстовый поиск по каталогу книг.
+
+Для каждой книги поддерживается поле ``search_document`` - название книги,
+имена авторов и названия жанров одной строкой. Поверх него:
+
+* PostgreSQL - GIN-индекс по ``to_tsvector('simple', search_document)``
+  и триграммный GIN-индекс (pg_trgm) для нечёткого поиска с опечатками;
+* SQLite - теневые FTS5-таблицы (словарная и триграммная), которые
+  поддерживаются триггерами на ``LibHub_book``;
+* остальные СУБД - ``icontains`` по ``search_document``.
+
+Результаты поиска ранжируются: аннотация ``search_rank``, больше - лучше.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import BooleanField, F, FloatField, Prefetch, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Author, Book, BookSearchIndex, BookTrigramIndex, Genre
+
+SEARCH_CONFIG = 'simple'
+FTS_TABLE = BookSearchIndex._meta.db_table
+TRIGRAM_TABLE = BookTrigramIndex._meta.db_table
+
+# Порог word_similarity для нечёткого поиска в PostgreSQL
+TRIGRAM_THRESHOLD = getattr(settings, 'LIBHUB_SEARCH_TRIGRAM_THRESHOLD', 0.3)
+# Сколько лучших книг нечёткого поиска выдаётся
+FUZZY_CANDIDATES = 1000
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_search_document(book):
+    """
+    Собрать поисковый документ книги (авторы и жанры должны быть загружены).
+    """
+    parts = [book.name]
+    parts.extend(f"{author.first_name} {author.last_name}"
+                 for author in book.authors.all())
+    parts.extend(genre.name for genre in book.genres.all())
+    return ' '.join(part for part in parts if part)
+
+
+def refresh_search_documents(book_ids=None, batch_size=1000):
+    """
+    Пересчитать ``search_document`` для указанных книг (или для всех).
+
+    Книги обрабатываются пачками, авторы и жанры подгружаются одним запросом
+    на пачку. Возвращает количество изменённых строк.
+    """
+    queryset = Book.objects.order_by('id').prefetch_related(
+        Prefetch('authors', queryset=Author.objects.only('id', 'first_name',
+                                                         'last_name')),
+        Prefetch('genres', queryset=Genre.objects.only('id', 'name')),
+    ).only('id', 'name', 'search_document')
+    if book_ids is not None:
+        book_ids = list(book_ids)
+        if not book_ids:
+            return 0
+        queryset = queryset.filter(id__in=book_ids)
+
+    updated = 0
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return updated
+        changed = []
+        for book in batch:
+            document = build_search_document(book)
+            if document != book.search_document:
+                book.search_document = document
+                changed.append(book)
+        if changed:
+            Book.objects.bulk_update(changed, ['search_document'])
+            updated += len(changed)
+        last_id = batch[-1].id
+
+
+def _words(query):
+    return _WORD_RE.findall(query.lower())
+
+
+def _fts5_query(words):
+    # Каждое слово - префиксная фраза, слова объединяются через AND
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _fts5_trigram_query(words):
+    trigrams = []
+    for word in words:
+        for i in range(len(word) - 2):
+            trigram = word[i:i + 3]
+            if trigram not in trigrams:
+                trigrams.append(trigram)
+    return ' OR '.join(f'"{trigram}"' for trigram in trigrams)
+
+
+def _tsquery(words):
+    return ' & '.join(f"{word}:*" for word in words)
+
+
+def _column(connection, name):
+    qn = connection.ops.quote_name
+    return f"{qn(Book._meta.db_table)}.{qn(name)}"
+
+
+def _postgres_search(queryset, connection, query, words):
+    document = _column(connection, 'search_document')
+    vector = f"to_tsvector('{SEARCH_CONFIG}', {document})"
+    tsquery = f"to_tsquery('{SEARCH_CONFIG}', %s)"
+    params = [_tsquery(words)]
+
+    matched = queryset.filter(
+        RawSQL(f"{vector} @@ {tsquery}", params, output_field=BooleanField())
+    ).annotate(search_rank=RawSQL(f"ts_rank({vector}, {tsquery})", params,
+                                  output_field=FloatField()))
+    if matched.exists():
+        return matched.order_by('-search_rank', 'id')
+
+    # Ничего не нашлось - пробуем триграммное сходство (опечатки).
+    # Оператор <% использует триграммный GIN-индекс и порог из настройки,
+    # заданной только для транзакции (is_local): в пуле соединений она не
+    # переходит к другим запросам. Поэтому кандидаты выбираются внутри
+    # транзакции, а ранжирование - по их id без зависимости от настройки.
+    similarity = RawSQL(f"word_similarity(%s, {document})", [query],
+                        output_field=FloatField())
+    with transaction.atomic(using=queryset.db):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config("
+                "'pg_trgm.word_similarity_threshold', %s, true)",
+                [str(TRIGRAM_THRESHOLD)])
+        fuzzy = queryset.filter(RawSQL(f"%s <%% {document}", [query],
+                                       output_field=BooleanField()))
+        candidates = list(
+            fuzzy.annotate(search_rank=similarity)
+            .order_by('-search_rank', 'id')
+            .values_list('id', flat=True)[:FUZZY_CANDIDATES])
+    return queryset.filter(id__in=candidates).annotate(
+        search_rank=similarity).order_by('-search_rank', 'id')
+
+
+def _sqlite_search(queryset, connection, words):
+    # Соединение с FTS5-таблицей по rowid, rank - встроенный bm25 (меньше -
+    # лучше)
+    matched = queryset.filter(
+        search_index__search_document__match=_fts5_query(words)
+    ).annotate(
+        search_rank=-F('search_index__rank')
+    ).order_by('-search_rank', 'id')
+    if matched.exists():
+        return matched
+
+    trigram_query = _fts5_trigram_query(words)
+    if trigram_query and sqlite_trigram_available(connection):
+        return queryset.filter(
+            trigram_index__search_document__match=trigram_query
+        ).annotate(
+            search_rank=-F('trigram_index__rank')
+        ).order_by('-search_rank', 'id')
+    return matched
+
+
+def search_books(queryset, query):
+    """
+    Отфильтровать и отранжировать книги по поисковой строке.
+
+    Сначала ищем по словам (с префиксным совпадением), если ничего не нашлось -
+    нечёткий поиск по триграммам.
+    """
+    words = _words(query)
+    if not words:
+        return queryset
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        return _postgres_search(queryset, connection, query, words)
+    if connection.vendor == 'sqlite' and sqlite_fts_available(connection):
+        return _sqlite_search(queryset, connection, words)
+
+    condition = Q()
+    for word in words:
+        condition &= Q(search_document__icontains=word)
+    return queryset.filter(condition).annotate(
+        search_rank=RawSQL('0', [], output_field=FloatField())
+    ).order_by('name', 'id')
+
+
+# Обслуживание поисковых структур в базе данных
+
+def _sqlite_table_exists(connection, name):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [name])
+        return cursor.fetchone() is not None
+
+
+def sqlite_fts_available(connection):
+    return _sqlite_table_exists(connection, FTS_TABLE)
+
+
+def sqlite_trigram_available(connection):
+    return _sqlite_table_exists(connection, TRIGRAM_TABLE)
+
+
+def _sqlite_fts_statements(connection, table, tokenize=None):
+    qn = connection.ops.quote_name
+    book_table = qn(Book._meta.db_table)
+    options = f", tokenize='{tokenize}'" if tokenize else ''
+    fts = qn(table)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"search_document, content='{Book._meta.db_table}', "
+        f"content_rowid='id'{options})",
+        f"CREATE TRIGGER IF NOT EXISTS {qn(table + '_ai')} "
+        f"AFTER INSERT ON {book_table} BEGIN "
+        f"INSERT INTO {fts}(rowid, search_document) "
+        f"VALUES (new.id, new.search_document); END",
+        f"CREATE TRIGGER IF NOT EXISTS {qn(table + '_ad')} "
+        f"AFTER DELETE ON {book_table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_document) "
+        f"VALUES ('delete', old.id, old.search_document); END",
+        f"CREATE TRIGGER IF NOT EXISTS {qn(table + '_au')} "
+        f"AFTER UPDATE OF search_document ON {book_table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_document) "
+        f"VALUES ('delete', old.id, old.search_document); "
+        f"INSERT INTO {fts}(rowid, search_document) "
+        f"VALUES (new.id, new.search_document); END",
+    ]
+
+
+def _postgres_statements(connection):
+    qn = connection.ops.quote_name
+    book_table = qn(Book._meta.db_table)
+    return [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"CREATE INDEX IF NOT EXISTS {qn('LibHub_book_search_gin')} "
+        f"ON {book_table} "
+        f"USING GIN (to_tsvector('{SEARCH_CONFIG}', search_document))",
+        f"CREATE INDEX IF NOT EXISTS {qn('LibHub_book_search_trgm')} "
+        f"ON {book_table} USING GIN (search_document gin_trgm_ops)",
+    ]
+
+
+def install_search_structures(connection, rebuild=False):
+    """
+    Создать поисковые индексы/таблицы, если их ещё нет.
+
+    Вызывается из миграции и после каждой миграции: SQLite пересоздаёт таблицу
+    при изменении схемы и теряет триггеры.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for statement in _postgres_statements(connection):
+                cursor.execute(statement)
+        return
+
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        statements = _sqlite_fts_statements(
+            connection, FTS_TABLE, tokenize='unicode61 remove_diacritics 2')
+        # Триграммный токенизатор есть начиная с SQLite 3.34
+        if connection.Database.sqlite_version_info >= (3, 34, 0):
+            statements += _sqlite_fts_statements(
+                connection, TRIGRAM_TABLE, tokenize='trigram')
+        for statement in statements:
+            cursor.execute(statement)
+
+    if rebuild:
+        rebuild_search_index(connection)
+
+
+def rebuild_search_index(connection):
+    """
+    Перестроить FTS5-таблицы SQLite по текущему содержимому
+    ``search_document``.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for table in (FTS_TABLE, TRIGRAM_TABLE):
+            if _sqlite_table_exists(connection, table):
+                cursor.execute(f"INSERT INTO {qn(table)}({qn(table)}) "
+                               f"VALUES ('rebuild')")
+
+
+def uninstall_search_structures(connection):
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"DROP INDEX IF EXISTS {qn('LibHub_book_search_gin')}")
+            cursor.execute(
+                f"DROP INDEX IF EXISTS {qn('LibHub_book_search_trgm')}")
+        elif connection.vendor == 'sqlite':
+            for table in (FTS_TABLE, TRIGRAM_TABLE):
+                for suffix in ('_ai', '_ad', '_au'):
+                    cursor.execute(
+                        f"DROP TRIGGER IF EXISTS {qn(table + suffix)}")
+                cursor.execute(f"DROP TABLE IF EXISTS {qn(table)}")
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
-from .models import  User, Language, Publisher, Genre, Author, Book, Request
+from . import rentals
+from .models import (User, Language, Publisher, Genre, Author, Book, Request,
+                     rented_copies_message)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -36,13 +38,40 @@ class AuthorSerializer(serializers.ModelSerializer):
 class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
-        fields = '__all__'
+        exclude = ['search_document']
+        read_only_fields = ['available']
+
+    def validate_quantity(self, value):
+        # Экземпляры на руках не исчезают: счётчик available ушёл бы ниже нуля
+        if self.instance is not None:
+            rented = self.instance.quantity - self.instance.available
+            if value < rented:
+                raise serializers.ValidationError(
+                    rented_copies_message(rented))
+        return value
 
 
 class RequestSerializer(serializers.ModelSerializer):
     class Meta:
         model = Request
         fields = '__all__'
+        # День возврата ставит LibHub/rentals.py
+        read_only_fields = ['returned_at']
+
+    # Экземпляры книги занимаются и освобождаются в LibHub/rentals.py
+    def create(self, validated_data):
+        return self._save(Request(**validated_data))
+
+    def update(self, instance, validated_data):
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        return self._save(instance)
+
+    def _save(self, rental):
+        try:
+            return rentals.save_rental(rental)
+        except rentals.RentalError as e:
+            raise serializers.ValidationError({'non_field_errors': [str(e)]})
 
 
 # class CommentSerializer(serializers.ModelSerializer):
@@ -0,0 +1,148 @@
+from django.db import connections
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from . import rentals, search
+from .cache import bump_model_version
+from .models import (Author, Book, Genre, Language, Publisher, Request,
+                     Tombstone, User)
+
+# Модели каталога, версии которых учитываются кэшем ответов
+CACHED_MODELS = (Book, Author, Genre, Language, Publisher)
+# Модели, удаления которых записываются для инкрементальной резервной копии
+TRACKED_MODELS = (Language, Publisher, Genre, Author, User, Book, Request)
+
+
+# Поддержка поискового документа книг в актуальном состоянии
+
+@receiver(post_save, sender=Book)
+def refresh_book_search_document(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.refresh_search_documents([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def refresh_search_on_m2m_change(sender, instance, action, reverse, pk_set,
+                                 **kwargs):
+    if reverse and action == 'pre_clear':
+        # При очистке со стороны автора/жанра pk_set не передаётся -
+        # запоминаем книги заранее
+        instance._search_cleared_book_ids = list(
+            instance.book_set.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        search.refresh_search_documents([instance.pk])
+    elif action == 'post_clear':
+        search.refresh_search_documents(
+            instance.__dict__.pop('_search_cleared_book_ids', []))
+    else:
+        search.refresh_search_documents(pk_set)
+
+
+@receiver(post_save, sender=Author)
+def refresh_search_on_author_change(sender, instance, created, raw=False,
+                                    **kwargs):
+    if raw or created:
+        return
+    search.refresh_search_documents(
+        instance.book_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+def refresh_search_on_genre_change(sender, instance, created, raw=False,
+                                   **kwargs):
+    if raw or created:
+        return
+    search.refresh_search_documents(
+        instance.book_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def remember_books_before_delete(sender, instance, **kwargs):
+    # Связи удаляются каскадом без m2m_changed - книги запоминаются до удаления
+    instance._deleted_book_ids = list(
+        instance.book_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def refresh_search_on_delete(sender, instance, **kwargs):
+    book_ids = instance.__dict__.pop('_deleted_book_ids', [])
+    if not book_ids:
+        return
+    search.refresh_search_documents(book_ids)
+    # Связи книги входят в её представление в API
+    Book.objects.filter(pk__in=book_ids).touch()
+
+
+# Учёт аренд: удаление строки Request (в том числе каскадом вместе с
+# читателем или книгой) возвращает экземпляр и снимает аренду со сводок
+
+@receiver(pre_delete, sender=Request)
+def forget_deleted_rental(sender, instance, **kwargs):
+    rentals.forget_rental(instance)
+
+
+# Инвалидация кэша ответов: любое изменение модели каталога увеличивает её
+# версию
+
+def bump_cache_version(sender, **kwargs):
+    if kwargs.get('raw'):
+        return
+    bump_model_version(sender)
+
+
+def bump_cache_version_on_m2m(sender, action, model, instance, reverse, pk_set,
+                              **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._touch_cleared_book_ids = list(
+            instance.book_set.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # Связи книги входят в её представление в API - отмечаем книги изменёнными
+    if not reverse:
+        Book.objects.filter(pk=instance.pk).touch()
+    elif action == 'post_clear':
+        Book.objects.filter(pk__in=instance.__dict__.pop(
+            '_touch_cleared_book_ids', [])).touch()
+    elif pk_set:
+        Book.objects.filter(pk__in=pk_set).touch()
+    # Меняется связь - сбрасываем обе стороны
+    bump_model_version(type(instance))
+    bump_model_version(model)
+
+
+for cached_model in CACHED_MODELS:
+    post_save.connect(bump_cache_version, sender=cached_model,
+                      dispatch_uid=f'cache_save_{cached_model.__name__}')
+    post_delete.connect(bump_cache_version, sender=cached_model,
+                        dispatch_uid=f'cache_delete_{cached_model.__name__}')
+
+for through in (Book.authors.through, Book.genres.through,
+                Book.publishers.through):
+    m2m_changed.connect(bump_cache_version_on_m2m, sender=through,
+                        dispatch_uid=f'cache_m2m_{through.__name__}')
+
+
+# Журнал удалений: инкрементальная копия переносит удаление строки по её записи
+
+def record_tombstone(sender, instance, using, origin=None, **kwargs):
+    Tombstone.objects.using(using).create(model=sender._meta.label_lower,
+                                          object_id=instance.pk)
+
+
+for tracked_model in TRACKED_MODELS:
+    post_delete.connect(record_tombstone, sender=tracked_model,
+                        dispatch_uid=f'tombstone_{tracked_model.__name__}')
+
+
+def install_search_structures(sender, using, **kwargs):
+    # SQLite теряет триггеры FTS5 при пересоздании таблицы в миграциях
+    search.install_search_structures(connections[using])
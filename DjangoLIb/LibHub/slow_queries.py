@@ -0,0 +1,278 @@
+"""
+Журнал медленных SQL-запросов.
+
+Обёртка выполнения запросов (``connection.execute_wrapper``) засекает время
+каждого запроса; запросы дольше ``SLOW_QUERY_LOG['THRESHOLD_MS']`` ставятся в
+очередь фонового потока вместе с представлением, в котором они выполнены, и
+строкой кода проекта, из которой вызван ORM. Сама обёртка не пишет в базу и
+не блокирует запрос: при переполнении очереди события отбрасываются.
+
+Фоновый поток группирует запросы по отпечатку - нормализованному тексту, в
+котором литералы, параметры и списки ``IN (...)``/``VALUES`` заменены на ``?``,
+- и накапливает число вызовов, суммарное и максимальное время в ``SlowQuery``
+(самые дорогие формы запросов - ``manage.py slow_queries`` и админка). Для
+нового отпечатка и для доли ``EXPLAIN_SAMPLE_RATE`` повторных попаданий
+выполняется ``EXPLAIN`` (только для SELECT); ``EXPLAIN_ANALYZE`` на PostgreSQL
+выполняет запрос повторно, поэтому по умолчанию выключен.
+
+Запросы HTTP-обработки записывает ``SlowQueryMiddleware``; в командах и
+фоновых задачах - блок ``with capture('имя'):``.
+"""
+import hashlib
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import traceback
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, IntegrityError, connections
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import SlowQuery
+
+logger = logging.getLogger('LibHub.slow_queries')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD_MS': 200,
+    'EXPLAIN_SAMPLE_RATE': 0.1,
+    'EXPLAIN_ANALYZE': False,
+    'QUEUE_SIZE': 1000,
+}
+MAX_SQL_LENGTH = 10_000
+# Промежуточные слои проекта вокруг выполнения запросов - не место вызова
+WRAPPER_MODULES = {
+    'LibHub/slow_queries.py', 'LibHub/query_budget.py', 'LibHub/metrics.py',
+    'LibHub/profiling.py',
+}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+
+# Представление (или задача), в котором выполняется текущий код
+_current_view = ContextVar('libhub_slow_query_view', default='')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SLOW_QUERY_LOG', {})}
+
+
+def normalize(sql):
+    """Текст запроса без значений: одинаковые по форме запросы совпадают."""
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    sql = _ROWS.sub('(...), ...', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def _call_site():
+    """
+    Последняя строка кода проекта в стеке (не Django, не сторонние пакеты и
+    не обёртки запросов).
+    """
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        if (not frame.filename.startswith(base)
+                or 'site-packages' in frame.filename):
+            continue
+        location = frame.filename[len(base) + 1:]
+        if location not in WRAPPER_MODULES:
+            return f"{location}:{frame.lineno} in {frame.name}"
+    return ''
+
+
+@dataclass
+class SlowQueryEvent:
+    alias: str
+    sql: str
+    params: object
+    many: bool
+    duration_ms: float
+    view: str
+    location: str
+
+
+class _Recorder:
+    def __init__(self, alias, threshold_ms):
+        self.alias = alias
+        self.threshold_ms = threshold_ms
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if duration_ms >= self.threshold_ms:
+                _worker().submit(SlowQueryEvent(
+                    self.alias, sql, params, many, duration_ms,
+                    _current_view.get(), _call_site()))
+
+
+def _explain(event, analyze):
+    connection = connections[event.alias]
+    options = ({'analyze': True}
+               if analyze and connection.vendor == 'postgresql' else {})
+    prefix = connection.ops.explain_query_prefix(**options)
+    with connection.cursor() as cursor:
+        cursor.execute(f"{prefix} {event.sql}", event.params)
+        return '\n'.join(' '.join(str(value) for value in row)
+                         for row in cursor.fetchall())
+
+
+def _explainable(event):
+    return not event.many and event.sql.lstrip()[:6].upper() == 'SELECT'
+
+
+def save_event(event, config=None):
+    """
+    Учесть медленный запрос в ``SlowQuery`` и при необходимости снять план.
+    """
+    config = config or get_config()
+    normalized = normalize(event.sql)
+    key = fingerprint(normalized)
+    now = timezone.now()
+    fields = {
+        'sample_sql': event.sql[:MAX_SQL_LENGTH],
+        'view': event.view[:200],
+        'location': event.location[:500],
+        'last_seen': now,
+    }
+    aggregate = SlowQuery.objects.filter(fingerprint=key)
+    updated = aggregate.update(calls=F('calls') + 1,
+                               total_ms=F('total_ms') + event.duration_ms,
+                               max_ms=Greatest('max_ms',
+                                               Value(event.duration_ms)),
+                               **fields)
+    if not updated:
+        try:
+            SlowQuery.objects.create(
+                fingerprint=key, normalized=normalized[:MAX_SQL_LENGTH],
+                calls=1, total_ms=event.duration_ms,
+                max_ms=event.duration_ms, **fields)
+        except IntegrityError:
+            # Тот же отпечаток одновременно записал другой процесс
+            aggregate.update(calls=F('calls') + 1,
+                             total_ms=F('total_ms') + event.duration_ms,
+                             max_ms=Greatest('max_ms',
+                                             Value(event.duration_ms)),
+                             **fields)
+    if not _explainable(event):
+        return
+    if updated and random.random() >= config['EXPLAIN_SAMPLE_RATE']:
+        return
+    try:
+        plan = _explain(event, config['EXPLAIN_ANALYZE'])
+    except DatabaseError as exc:
+        plan = f"EXPLAIN не выполнен: {exc}"
+    aggregate.update(plan=plan, plan_at=timezone.now())
+
+
+class _Worker:
+    """Фоновый поток процесса, записывающий медленные запросы."""
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run,
+                                        name='slow-query-log', daemon=True)
+        self._thread.start()
+
+    def submit(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            try:
+                save_event(event)
+            except Exception:
+                logger.exception("Не удалось записать медленный запрос")
+            finally:
+                self.queue.task_done()
+            if self.queue.empty():
+                # Поток не держит подключения, пока очередь пуста
+                for connection in connections.all(initialized_only=True):
+                    connection.close()
+
+
+_worker_instance = None
+_worker_lock = threading.Lock()
+
+
+def _worker():
+    global _worker_instance
+    if _worker_instance is None:
+        with _worker_lock:
+            if _worker_instance is None:
+                _worker_instance = _Worker(get_config()['QUEUE_SIZE'])
+    return _worker_instance
+
+
+def flush(timeout=None):
+    """
+    Дождаться записи уже поставленных в очередь событий (для команд и
+    проверок).
+    """
+    if _worker_instance is None:
+        return
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while _worker_instance.queue.unfinished_tasks:
+        if deadline is not None and time.monotonic() > deadline:
+            return
+        time.sleep(0.01)
+
+
+@contextmanager
+def capture(view, threshold_ms=None):
+    """Записывать медленные запросы блока кода под именем ``view``."""
+    threshold_ms = (get_config()['THRESHOLD_MS'] if threshold_ms is None
+                    else threshold_ms)
+    token = _current_view.set(view)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(
+                    _Recorder(connection.alias, threshold_ms)))
+            yield
+    finally:
+        _current_view.reset(token)
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        if not get_config()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture(f"{request.method} {request.path}"):
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        _current_view.set(match.view_name if match and match.view_name
+                          else request.path)
+        return None
@@ -0,0 +1,112 @@
+"""
+Обработчики задач очереди (LibHub/jobs.py).
+
+Обработчик получает ``Job`` и ``JobContext``; результат - словарь для
+``Job.result`` (имя файла и тип содержимого для скачивания) и файл,
+записанный через ``context.writer()``.
+"""
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from . import backups, charts, exports, rentals, reports
+from .jobs import PermanentJobError, task
+from .models import Artifact, BackupArchive, Job, RestoreJob
+
+
+@task(Job.Kind.BOOK_EXPORT, concurrency=2)
+def export_books(job, context):
+    export_format = job.params.get('format', 'xlsx')
+    try:
+        content, content_type = exports.export_books(export_format)
+    except exports.ExportFormatUnavailable as exc:
+        raise PermanentJobError(str(exc))
+    filename = f"books.{export_format}"
+    with context.writer(filename) as file:
+        for chunk in content:
+            file.write(chunk)
+            context.progress(file.tell(), message="Записано байт")
+    return {'filename': filename, 'content_type': content_type}
+
+
+# Диаграммы строятся в пуле процессов (LibHub/charts.py), поэтому отчёты могут
+# формироваться параллельно; каждый записывает в Checkpoint согласованные
+# счётчики
+@task(Job.Kind.STATISTICS_REPORT, concurrency=2)
+def rental_statistics(job, context):
+    start, end = (datetime.date.fromisoformat(job.params[name])
+                  if job.params.get(name) else None
+                  for name in ('start', 'end'))
+    counts = reports.rental_counts(start, end)
+    with ThreadPoolExecutor(max_workers=len(charts.FORMATS)) as pool:
+        images = dict(zip(charts.FORMATS, pool.map(
+            lambda image_format: reports.render_chart(counts, image_format),
+            charts.FORMATS)))
+    # Дополнительные файлы результата: /jobs/<pk>/download/?file=chart (PNG)
+    # или chart_svg
+    files = {}
+    for image_format, content_type in charts.FORMATS.items():
+        chart_name = f'returned_books_chart.{image_format}'
+        with context.writer(chart_name) as chart_file:
+            chart_file.write(images[image_format])
+        name = 'chart' if image_format == 'png' else f'chart_{image_format}'
+        files[name] = {'artifact': chart_file.artifact.pk,
+                       'filename': chart_name, 'content_type': content_type}
+    filename = 'returned_books_statistics.docx'
+    with context.writer(filename) as file:
+        reports.write_rental_statistics(file, counts, images['png'], start,
+                                        end)
+    return {'filename': filename, 'content_type': reports.DOCX_CONTENT_TYPE,
+            'files': files}
+
+
+@task(Job.Kind.BACKUP, concurrency=1, max_attempts=2,
+      retry_delay=datetime.timedelta(minutes=5))
+def backup(job, context):
+    compression = job.params.get('compression')
+    if compression not in backups.available_compressions():
+        raise PermanentJobError(f"Сжатие недоступно: {compression}")
+    stream, filename = backups.dump_database(compression)
+    with context.writer(filename, Artifact.Kind.BACKUP) as file:
+        for chunk in stream:
+            file.write(chunk)
+            context.progress(stream.bytes_read,
+                             message="Прочитано байт из pg_dump")
+    content_type = ('application/sql' if compression is None
+                    else 'application/octet-stream')
+    return {'filename': filename, 'content_type': content_type}
+
+
+@task(Job.Kind.BACKUP_ARCHIVE, concurrency=1, max_attempts=2,
+      retry_delay=datetime.timedelta(minutes=5))
+def backup_archive(job, context):
+    archive_id = job.params['archive']
+    backups.run_backup_archive(archive_id)
+    archive = BackupArchive.objects.get(pk=archive_id)
+    if archive.status != BackupArchive.Status.DONE:
+        raise backups.BackupError(archive.error)
+    return {'archive': archive.pk, 'size': archive.size}
+
+
+# Восстановление перезаписывает базу - автоматически не повторяется
+@task(Job.Kind.RESTORE, concurrency=1, max_attempts=1)
+def restore(job, context):
+    restore_id = job.params['restore_job']
+    backups.run_restore_job(restore_id, on_progress=context.progress)
+    restore_job = RestoreJob.objects.get(pk=restore_id)
+    if restore_job.status != RestoreJob.Status.DONE:
+        raise backups.BackupError(restore_job.error)
+    return {'restore_job': restore_job.pk,
+            'statements': restore_job.statements}
+
+
+# Просрочка аренд: воркер ставит задачу раз в час (JOB_QUEUE['SCHEDULE']),
+# за один запуск обрабатывается не больше max_chunks порций
+@task(Job.Kind.EXPIRE_RENTALS, concurrency=1,
+      every=datetime.timedelta(hours=1))
+def expire_rentals(job, context):
+    def progress(result):
+        context.progress(result.expired, message="Просрочено аренд")
+
+    result = rentals.expire_overdue_rentals(
+        max_chunks=job.params.get('max_chunks', 100), progress=progress)
+    return {'expired': result.expired, 'chunks': result.chunks}
@@ -1,3 +1,1099 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import os
+import pstats
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import warnings
+import zlib
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (analytics, artifacts, backups, benchmarks, charts, exports,
+               jobs, logical_backup, profiling, rentals, reports, rollups,
+               slow_queries)
+from .cache import cache_stats
+from .library_data_populator import GeneratorConfig, generate
+from .models import (Artifact, Author, BackupArchive, Book, Genre, Job,
+                     Language, RentalRollup, Request, Tombstone, User)
+from .pagination import encode_cursor
+from .rentals import overdue_requests
+from .search import search_books
+from .views import BOOK_LIST_PAGE_SIZE, active_requests, catalog_books
+
+
+def create_book(name='Silent River', quantity=1, language=None):
+    if language is None:
+        language, _ = Language.objects.get_or_create(
+            name='English', defaults={'chars_code': 'EN'})
+    return Book.objects.create(name=name, publication_year=2000,
+                               language=language, quantity=quantity,
+                               cover_url='http://covers.example/1.jpg')
+
+
+class SearchDocumentTests(TestCase):
+    def setUp(self):
+        self.book = create_book()
+        self.author = Author.objects.create(first_name='Anna',
+                                            last_name='Karenina')
+        self.genre = Genre.objects.create(name='Tragedy')
+        self.book.authors.add(self.author)
+        self.book.genres.add(self.genre)
+
+    def test_document_contains_authors_and_genres(self):
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.search_document,
+                         'Silent River Anna Karenina Tragedy')
+        self.assertEqual(list(search_books(Book.objects.all(), 'karenina')),
+                         [self.book])
+
+    def test_deleted_author_is_not_searchable(self):
+        self.author.delete()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.search_document, 'Silent River Tragedy')
+        self.assertFalse(search_books(Book.objects.all(), 'karenina'))
+
+    def test_deleted_genre_is_not_searchable(self):
+        self.genre.delete()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.search_document,
+                         'Silent River Anna Karenina')
+        self.assertFalse(search_books(Book.objects.all(), 'tragedy'))
+
+
+class QueryBudgetTests(TestCase):
+    def test_write_is_not_checked_against_budget(self):
+        book = create_book()
+        book.authors.add(Author.objects.create(first_name='Anna',
+                                               last_name='Petrova'))
+        # Удаление книги с каскадом превышает бюджет списка (8 запросов)
+        response = self.client.delete(f'/api/books/{book.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Book.objects.filter(pk=book.pk).exists())
+
+
+class BudgetedViewTests(TestCase):
+    """Представления с бюджетом запросов на заполненной генератором базе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        generate(GeneratorConfig(users=20, books=40, authors=15, genres=6,
+                                 publishers=5, languages=3, rentals=0))
+        cls.user = User.objects.order_by('pk').first()
+        cls.user.is_staff = True
+        cls.user.save()
+        today = datetime.date.today()
+        books = list(Book.objects.order_by('pk'))
+        users = list(User.objects.order_by('pk'))
+        Request.objects.bulk_create([
+            Request(user=users[index % len(users)], book=book,
+                    borrow_date=today - datetime.timedelta(days=index),
+                    return_date=today + datetime.timedelta(days=14 - index),
+                    status=Request.RequestStatus.RETURNED)
+            for index, book in enumerate(books)
+        ] + [
+            Request(user=cls.user, book=book, borrow_date=today,
+                    return_date=today + datetime.timedelta(days=14),
+                    status=Request.RequestStatus.RENTED)
+            for book in books[:5]
+        ])
+
+    def setUp(self):
+        # Версии моделей в тестах не меняются (on_commit) - без очистки
+        # ответ мог бы прийти из кэша предыдущего теста
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def assert_within_budget(self, path):
+        # В тестах бюджет строгий: превышение - QueryBudgetExceeded
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, path)
+        return response
+
+    def test_pages(self):
+        for name in ('home', 'book_list', 'profile', 'requests'):
+            with self.subTest(name):
+                self.assert_within_budget(reverse(name))
+        self.assert_within_budget(reverse('book_list') + '?page=2')
+        self.assert_within_budget(reverse('book_list') + '?title=river')
+
+    def test_api_lists(self):
+        for basename in ('user', 'book', 'request', 'genre', 'author'):
+            with self.subTest(basename):
+                self.assert_within_budget(reverse(f'{basename}-list'))
+
+    def test_requests_list_is_paginated(self):
+        response = self.assert_within_budget(reverse('requests'))
+        self.assertNotIn('requests', response.context)
+        self.assertEqual(len(response.context['list_requests']), 12)
+        self.assertContains(response, '?page=2')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = [create_book(f'Book {name}') for name in 'ABC']
+
+    def test_not_modified_until_row_deleted(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Удаляется не самая новая строка: MAX(updated_at) не меняется
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('book-detail', args=[self.books[0].pk]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class ResponseCacheTests(TestCase):
+    """Кэш ответов API сбрасывается увеличением версии модели."""
+
+    def setUp(self):
+        cache.clear()
+        self.book = create_book()
+
+    def get_book(self):
+        response = self.client.get(reverse('book-list'))
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0]
+
+    def test_version_bump_invalidates_cached_list(self):
+        self.get_book()
+        self.get_book()
+        self.assertEqual(cache_stats()['api:book']['hits'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.name = 'Golden Road'
+            self.book.save()
+        self.assertEqual(self.get_book()['name'], 'Golden Road')
+
+        genre = Genre.objects.create(name='Poetry')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.genres.add(genre)
+        self.assertEqual(self.get_book()['genres'], [genre.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.filter(pk=self.book.pk).update(name='Quiet Harbor')
+        self.assertEqual(self.get_book()['name'], 'Quiet Harbor')
+        self.assertEqual(cache_stats()['api:book']['hits'], 1)
+
+
+class KeysetPaginationTests(TestCase):
+    """Курсорная пагинация /api/requests/ по (-borrow_date, -id)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('reader@example.com',
+                                        'Str0ng-passw0rd')
+        book = create_book(quantity=10)
+        today = datetime.date.today()
+        # Одинаковые даты: порядок внутри дня задаёт id
+        Request.objects.bulk_create([
+            Request(user=user, book=book,
+                    borrow_date=today - datetime.timedelta(days=index // 2),
+                    return_date=today + datetime.timedelta(days=14),
+                    status=Request.RequestStatus.RETURNED)
+            for index in range(5)
+        ])
+        cls.expected = list(Request.objects.order_by('-borrow_date', '-id')
+                            .values_list('id', flat=True))
+
+    def setUp(self):
+        cache.clear()
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_next_and_previous_links(self):
+        response = self.client.get(reverse('request-list'), {'page_size': 2})
+        self.assertIsNone(response.data['previous'])
+        pages = [self.ids(response)]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append(self.ids(response))
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+
+        back = []
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            back.append(self.ids(response))
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_invalid_cursor_is_not_found(self):
+        cursors = ['not-a-cursor', encode_cursor([5]),
+                   encode_cursor(['notadate', 5]), encode_cursor([None, 5]),
+                   encode_cursor([{'a': 1}, 1])]
+        for cursor in cursors:
+            with self.subTest(cursor):
+                response = self.client.get(reverse('request-list'),
+                                           {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_page_number_compatibility(self):
+        response = self.client.get(reverse('request-list'),
+                                   {'page': 2, 'page_size': 2})
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(self.ids(response), self.expected[2:4])
+
+
+class RentalStockTests(TestCase):
+    """Экземпляры книги при записи аренд через API, формы и выдачу."""
+
+    def setUp(self):
+        self.book = create_book(quantity=1)
+        self.readers = [
+            User.objects.create_user(f'reader{index}@example.com',
+                                     'Str0ng-passw0rd')
+            for index in range(2)
+        ]
+
+    def rental_data(self, reader, status=Request.RequestStatus.RENTED):
+        today = datetime.date.today()
+        return {'user': reader.pk, 'book': self.book.pk, 'status': status,
+                'borrow_date': today,
+                'return_date': today + datetime.timedelta(days=14)}
+
+    def assert_available(self, expected):
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available, expected)
+
+    def test_api_rental_takes_and_releases_copy(self):
+        url = reverse('request-list')
+        response = self.client.post(url, self.rental_data(self.readers[0]))
+        self.assertEqual(response.status_code, 201)
+        self.assert_available(0)
+        # Последний экземпляр уже выдан
+        response = self.client.post(url, self.rental_data(self.readers[1]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Request.objects.count(), 1)
+
+        detail = reverse('request-detail', args=[Request.objects.get().pk])
+        response = self.client.patch(
+            detail, {'status': Request.RequestStatus.RETURNED},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_available(1)
+        self.client.patch(detail, {'status': Request.RequestStatus.RENTED},
+                          content_type='application/json')
+        self.assert_available(0)
+        self.assertEqual(self.client.delete(detail).status_code, 204)
+        self.assert_available(1)
+
+    def test_available_never_exceeds_quantity(self):
+        rental = rentals.rent_book(self.readers[0], self.book.pk)
+        # Счётчик разошёлся с арендами (например, ручная правка базы)
+        Book.objects.filter(pk=self.book.pk).update(available=1)
+        rentals.return_book(self.readers[0], rental.pk)
+        self.assert_available(1)
+
+    def test_form_reports_missing_copies(self):
+        rentals.rent_book(self.readers[0], self.book.pk)
+        self.client.force_login(self.readers[0])
+        response = self.client.post(reverse('request_create'),
+                                    self.rental_data(self.readers[1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+        self.assertEqual(Request.objects.count(), 1)
+        self.assert_available(0)
+
+    def test_quantity_below_rented_copies_is_rejected(self):
+        self.book.quantity = 2
+        self.book.save()
+        rentals.rent_book(self.readers[0], self.book.pk)
+        rentals.rent_book(self.readers[1], self.book.pk)
+        response = self.client.patch(
+            reverse('book-detail', args=[self.book.pk]), {'quantity': 1},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quantity', response.data)
+        self.book.quantity = 1
+        with self.assertRaises(ValidationError):
+            self.book.full_clean()
+        self.book.quantity = 2
+        self.book.full_clean()
+
+    def test_rollup_rows_are_inserted_in_key_order(self):
+        genres = [Genre.objects.create(name=name)
+                  for name in ('Drama', 'Comedy')]
+        self.book.genres.add(*reversed(genres))
+        bulk_create = RentalRollup.objects.bulk_create
+        with mock.patch.object(RentalRollup.objects, 'bulk_create',
+                               wraps=bulk_create) as insert:
+            rentals.rent_book(self.readers[0], self.book.pk)
+        keys = [(row.dimension, row.object_id)
+                for row in insert.call_args.args[0]]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(keys), 4)
+
+    def test_deleted_book_keeps_rentals(self):
+        other = create_book('Golden Road')
+        today = datetime.date.today()
+        # Аренда другой книги с тем же id, что у удаляемой
+        rental = rentals.save_rental(Request(
+            pk=self.book.pk, user=self.readers[0], book=other,
+            status=Request.RequestStatus.RENTED, borrow_date=today,
+            return_date=today + datetime.timedelta(days=14)))
+        response = self.client.post(reverse('book_delete',
+                                            args=[self.book.pk]))
+        self.assertRedirects(response, reverse('book_list'),
+                             fetch_redirect_response=False)
+        self.book.refresh_from_db()
+        self.assertTrue(self.book.is_deleted)
+        self.assertTrue(Request.objects.filter(pk=rental.pk).exists())
+        other.refresh_from_db()
+        self.assertEqual(other.available, 0)
+
+    def test_cascade_delete_releases_rentals(self):
+        rentals.rent_book(self.readers[0], self.book.pk)
+        self.readers[0].delete()
+        self.assertFalse(Request.objects.exists())
+        self.assert_available(1)
+        self.assertFalse(RentalRollup.objects.filter(rented__gt=0).exists())
+
+        other = create_book('Golden Road')
+        rentals.rent_book(self.readers[1], other.pk)
+        other.delete()
+        self.assertFalse(Request.objects.exists())
+        self.assertFalse(RentalRollup.objects.filter(rented__gt=0).exists())
+
+
+class ReturnDayTests(TransactionTestCase):
+    """День возврата ``returned_at`` в арендах, сводках и генераторе."""
+    # generate пересобирает сводки в потоке - нужен TransactionTestCase
+
+    def returned_rollups(self):
+        return sorted(RentalRollup.objects.filter(returned__gt=0)
+                      .values_list('dimension', 'object_id', 'day',
+                                   'returned'))
+
+    def test_later_edit_keeps_return_day(self):
+        reader = User.objects.create_user('reader@example.com',
+                                          'Str0ng-passw0rd')
+        rental = rentals.rent_book(reader, create_book().pk)
+        rentals.return_book(reader, rental.pk)
+        rental.refresh_from_db()
+        returned_on = timezone.localdate()
+        self.assertEqual(rental.returned_at, returned_on)
+        recorded = self.returned_rollups()
+        self.assertEqual({row[2] for row in recorded}, {returned_on})
+
+        later = returned_on + datetime.timedelta(days=3)
+        with mock.patch.object(timezone, 'localdate', return_value=later):
+            rental.return_date = later
+            rentals.save_rental(rental)
+        rental.refresh_from_db()
+        self.assertEqual(rental.returned_at, returned_on)
+        self.assertEqual(self.returned_rollups(), recorded)
+        rollups.rebuild_days(rental.borrow_date,
+                             later + datetime.timedelta(days=1))
+        self.assertEqual(self.returned_rollups(), recorded)
+
+        rental.status = Request.RequestStatus.RENTED
+        rentals.save_rental(rental)
+        rental.refresh_from_db()
+        self.assertIsNone(rental.returned_at)
+        self.assertEqual(self.returned_rollups(), [])
+        rental.status = Request.RequestStatus.RETURNED
+        rentals.save_rental(rental)
+        self.assertEqual(len(self.returned_rollups()), len(recorded))
+        rentals.delete_rental(rental)
+        self.assertEqual(self.returned_rollups(), [])
+
+    def test_generated_history_spreads_return_days(self):
+        today = datetime.date(2026, 10, 18)
+        generate(GeneratorConfig(users=5, books=5, authors=2, genres=2,
+                                 publishers=1, languages=1, rentals=200,
+                                 active_share=0, today=today))
+        history = Request.objects.filter(
+            status=Request.RequestStatus.RETURNED)
+        self.assertEqual(history.count(), 200)
+        for borrowed, due, returned in history.values_list(
+                'borrow_date', 'return_date', 'returned_at'):
+            self.assertEqual(due, borrowed + datetime.timedelta(days=14))
+            self.assertTrue(borrowed < returned <= today)
+        self.assertGreater(
+            history.values('returned_at').distinct().count(), 1)
+        returns = RentalRollup.objects.filter(
+            dimension=RentalRollup.Dimension.BOOK, returned__gt=0)
+        self.assertEqual(sum(returns.values_list('returned', flat=True)),
+                         200)
+        self.assertGreater(returns.values('day').distinct().count(), 1)
+
+
+class PeriodicJobTests(TransactionTestCase):
+    # jobs.execute закрывает соединения - нужен TransactionTestCase
+
+    def test_expire_rentals_is_scheduled_once_per_interval(self):
+        now = timezone.now()
+        created = jobs.enqueue_periodic(now)
+        self.assertEqual([job.kind for job in created],
+                         [Job.Kind.EXPIRE_RENTALS])
+        self.assertEqual(jobs.enqueue_periodic(now), [])
+        later = jobs.enqueue_periodic(now + datetime.timedelta(hours=1))
+        self.assertEqual(len(later), 1)
+
+    def test_job_queries_go_to_slow_query_log(self):
+        jobs.enqueue_periodic()
+        job = jobs.claim('test')
+        with self.settings(SLOW_QUERY_LOG={'ENABLED': True}), \
+                mock.patch.object(slow_queries, 'capture',
+                                  wraps=slow_queries.capture) as capture:
+            jobs.execute(job)
+        capture.assert_called_once_with(f'job:{Job.Kind.EXPIRE_RENTALS}')
+
+    def test_benchmark_runs_queued_jobs(self):
+        jobs.enqueue_periodic()
+        benchmarks._run_jobs(benchmarks.Endpoint('sweep', '/'))
+        self.assertEqual(
+            list(Job.objects.values_list('status', flat=True)),
+            [Job.Status.DONE])
+
+    def test_scheduled_job_expires_overdue_rentals(self):
+        reader = User.objects.create_user('late@example.com',
+                                          'Str0ng-passw0rd')
+        rental = rentals.rent_book(reader, create_book().pk,
+                                   today=datetime.date(2020, 1, 1))
+        jobs.enqueue_periodic()
+        job = jobs.claim('test')
+        jobs.execute(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.result['expired'], 1)
+        rental.refresh_from_db()
+        self.assertEqual(rental.status, Request.RequestStatus.EXPIRED)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            "Планы запросов проверяются на PostgreSQL")
+class QueryPlanTests(TestCase):
+    """Горячие запросы каталога и аренды используют индексы (EXPLAIN)."""
+
+    def hot_querysets(self):
+        user = User.objects.order_by('pk').first() or User(pk=0)
+        book_id = Book.objects.order_by('pk').values_list(
+            'pk', flat=True).first() or 0
+        active = Request.objects.filter(status__in=Request.ACTIVE_STATUSES)
+        return [
+            ("каталог: первая страница",
+             catalog_books().order_by('name', 'id')[:BOOK_LIST_PAGE_SIZE + 1]),
+            ("профиль: активные аренды", active_requests(user)),
+            ("арендованные пользователем книги",
+             Request.objects.filter(user=user,
+                                    status=Request.RequestStatus.RENTED)),
+            ("активные аренды книги", active.filter(book_id=book_id)),
+            ("выдача книги", Book.objects.filter(pk=book_id, is_deleted=False,
+                                                 available__gt=0)),
+            ("возврат книги", active.filter(pk=0, user=user)),
+            ("список запросов",
+             Request.objects.order_by('-borrow_date', '-id')[:13]),
+            ("просроченные аренды",
+             overdue_requests(timezone.localdate())
+             .order_by('return_date', 'id')[:1000]),
+        ]
+
+    def explain(self, queryset):
+        with transaction.atomic():
+            # На маленькой базе планировщик предпочтёт Seq Scan; проверяем,
+            # что индекс вообще применим к запросу
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
+
+    def test_hot_queries_use_indexes(self):
+        create_book()
+        for name, queryset in self.hot_querysets():
+            with self.subTest(name):
+                table = queryset.model._meta.db_table
+                plan = self.explain(queryset)
+                self.assertNotRegex(
+                    plan, rf'Seq Scan on "?{re.escape(table)}"?', plan)
+
+
+class ExportTests(TestCase):
+    """Потоковая выгрузка каталога порциями книг."""
+
+    @classmethod
+    def setUpTestData(cls):
+        books = [create_book(f'Book {name}') for name in 'ABCDE']
+        anna = Author.objects.create(first_name='Anna', last_name='Gray')
+        boris = Author.objects.create(first_name='Boris', last_name='Stone')
+        poetry = Genre.objects.create(name='Poetry')
+        books[1].authors.add(anna, boris)
+        books[1].genres.add(poetry)
+        books[4].authors.add(boris)
+        cls.expected = [
+            ('Book A', 2000, '', ''),
+            ('Book B', 2000, 'Anna Gray, Boris Stone', 'Poetry'),
+            ('Book C', 2000, '', ''),
+            ('Book D', 2000, '', ''),
+            ('Book E', 2000, 'Boris Stone', ''),
+        ]
+
+    def test_rows_across_chunk_boundaries(self):
+        for chunk_size in (1, 2, 5, 6):
+            with self.subTest(chunk_size=chunk_size):
+                # Порция - книги, авторы и жанры; пустая порция завершает
+                chunks = -(-len(self.expected) // chunk_size)
+                with self.assertNumQueries(chunks * 3 + 1):
+                    rows = list(exports.export_rows(chunk_size=chunk_size))
+                self.assertEqual(rows, self.expected)
+
+    def test_csv_blocks(self):
+        with mock.patch.object(exports, 'STREAM_BLOCK_SIZE', 16):
+            blocks = list(exports.stream_csv(
+                exports.export_rows(chunk_size=2)))
+        # Блок отдаётся, как только буфер дорос до размера блока
+        self.assertGreater(len(blocks), 1)
+        self.assertTrue(all(len(block) >= 16 for block in blocks[:-1]))
+        content = b''.join(blocks).decode('utf-8')
+        self.assertTrue(content.startswith('\ufeff'))
+        rows = list(csv.reader(io.StringIO(content[1:])))
+        self.assertEqual(rows[0], list(exports.EXPORT_COLUMNS))
+        self.assertEqual(rows[1:], [[str(value) for value in row]
+                                    for row in self.expected])
+
+    def test_xlsx_content(self):
+        from openpyxl import load_workbook
+
+        content, content_type = exports.export_books('xlsx')
+        self.assertIn('spreadsheetml', content_type)
+        sheet = load_workbook(io.BytesIO(b''.join(content)))['Books']
+        rows = [tuple('' if value is None else value for value in row)
+                for row in sheet.iter_rows(values_only=True)]
+        self.assertEqual(rows, [exports.EXPORT_COLUMNS, *self.expected])
+
+
+def fake_pg_tool(directory, name, script):
+    """Исполняемый скрипт ``name`` вместо утилиты PostgreSQL."""
+    path = Path(directory) / name
+    path.write_text('#!/bin/sh\n' + script)
+    path.chmod(0o755)
+    return path
+
+
+class FakePgToolsMixin:
+    """Утилиты PostgreSQL заменяются скриптами в PG_BIN_DIR."""
+
+    def setUp(self):
+        super().setUp()
+        bin_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bin_dir)
+        self.bin_dir = bin_dir
+        settings_override = self.settings(PG_BIN_DIR=bin_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Тестовая база может быть не PostgreSQL - параметры подключения
+        # подставляются
+        patcher = mock.patch.object(backups, 'connection_args', return_value=(
+            ['-h', 'db', '-U', 'library'], dict(os.environ), 'library'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class BackupDumpTests(FakePgToolsMixin, TestCase):
+    def test_gzip_dump(self):
+        fake_pg_tool(self.bin_dir, 'pg_dump', 'seq 1 20000\n')
+        stream, filename = backups.dump_database('gzip')
+        self.assertEqual(filename, 'library_backup.sql.gz')
+        dump = gzip.decompress(b''.join(stream)).decode()
+        self.assertEqual(dump.split(), [str(n) for n in range(1, 20001)])
+
+    def test_error_before_output(self):
+        fake_pg_tool(self.bin_dir, 'pg_dump',
+                     'echo "password authentication failed" >&2\nexit 1\n')
+        with self.assertLogs('LibHub.backups', 'ERROR'), \
+                self.assertRaisesRegex(backups.BackupError,
+                                       'password authentication failed'):
+            backups.dump_database('gzip')
+
+    def test_error_mid_dump_breaks_stream(self):
+        fake_pg_tool(self.bin_dir, 'pg_dump',
+                     'seq 1 20000\necho "connection lost" >&2\nexit 1\n')
+        stream, _ = backups.dump_database(None)
+        with self.assertLogs('LibHub.backups', 'ERROR'), \
+                self.assertRaisesRegex(backups.BackupError, 'connection lost'):
+            b''.join(stream)
+
+    def test_view_rejects_unknown_compression(self):
+        staff = User.objects.create_user('admin@example.com',
+                                         'Str0ng-passw0rd', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('backup_database'),
+                                   {'compression': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Job.objects.exists())
+
+
+class RestoreFileTests(FakePgToolsMixin, TestCase):
+    def test_corrupt_file_stops_psql(self):
+        # psql читает stdin до конца: без его закрытия restore_file зависнет
+        fake_pg_tool(self.bin_dir, 'psql', 'cat >/dev/null\n')
+        source = io.BytesIO(backups.GZIP_MAGIC + b'\x08\x00' + b'x' * 1000)
+        outcome = []
+
+        def restore():
+            try:
+                backups.restore_file(source, 'gzip')
+            except Exception as exc:
+                outcome.append(exc)
+
+        thread = threading.Thread(target=restore, daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive(), "restore_file завис")
+        self.assertIsInstance(outcome[0], zlib.error)
+
+
+FAKE_DIRECTORY_DUMP = """\
+while [ $# -gt 0 ]; do
+    [ "$1" = -f ] && target=$2
+    shift
+done
+mkdir -p "$target"
+printf toc > "$target/toc.dat"
+printf rows > "$target/3001.dat.gz"
+"""
+
+
+class ParallelBackupTests(FakePgToolsMixin, TransactionTestCase):
+    """pg_dump -Fd: tar-поток и статус BackupArchive."""
+
+    def setUp(self):
+        super().setUp()
+        storage = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage)
+        settings_override = self.settings(
+            BACKUP_ROOT=Path(storage),
+            ARTIFACT_ROOT=Path(storage) / 'artifacts')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_directory_dump_is_packed_into_tar(self):
+        fake_pg_tool(self.bin_dir, 'pg_dump', FAKE_DIRECTORY_DUMP)
+        output = io.BytesIO()
+        size = backups.dump_directory_archive(output, jobs=2)
+        self.assertEqual(size, len(output.getvalue()))
+        output.seek(0)
+        with tarfile.open(fileobj=output, mode='r|') as tar:
+            files = {member.name: tar.extractfile(member).read()
+                     for member in tar}
+        self.assertEqual(files, {'3001.dat.gz': b'rows', 'toc.dat': b'toc'})
+
+    def test_directory_dump_error(self):
+        fake_pg_tool(self.bin_dir, 'pg_dump',
+                     'echo "database does not exist" >&2\nexit 1\n')
+        with self.assertRaisesRegex(backups.BackupError,
+                                    'database does not exist'):
+            backups.dump_directory_archive(io.BytesIO())
+
+    def test_archive_status(self):
+        fake_pg_tool(self.bin_dir, 'pg_dump', FAKE_DIRECTORY_DUMP)
+        archive = BackupArchive.objects.create(jobs=2)
+        backups.run_backup_archive(archive.pk)
+        archive.refresh_from_db()
+        self.assertEqual(archive.status, BackupArchive.Status.DONE)
+        self.assertGreater(archive.size, 0)
+        with backups.open_backup_archive(archive) as file:
+            with tarfile.open(fileobj=file, mode='r|') as tar:
+                self.assertEqual(sorted(tar.getnames()),
+                                 ['3001.dat.gz', 'toc.dat'])
+
+        fake_pg_tool(self.bin_dir, 'pg_dump', 'exit 1\n')
+        failed = BackupArchive.objects.create(jobs=2)
+        with self.assertLogs('LibHub.backups', 'ERROR'):
+            backups.run_backup_archive(failed.pk)
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, BackupArchive.Status.FAILED)
+        self.assertIn('pg_dump', failed.error)
+
+
+class LogicalBackupRoundTripTests(TransactionTestCase):
+    # Таблицы выгружаются в потоках со своими соединениями
+
+    def rows(self):
+        tables = {}
+        for model in logical_backup.backup_models():
+            columns = [field.attname for field in model._meta.concrete_fields]
+            tables[model._meta.label_lower] = list(
+                model._base_manager.order_by('pk').values_list(*columns))
+        return tables
+
+    def test_dump_and_restore_round_trip(self):
+        generate(GeneratorConfig(users=20, books=60, authors=10, genres=4,
+                                 publishers=3, languages=2, rentals=300))
+        before = self.rows()
+        rollups_before = sorted(RentalRollup.objects.values_list(
+            'dimension', 'object_id', 'day', 'rented', 'returned'))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        # Маленькие порции и файлы: каждая таблица пишется и читается частями
+        call_command('dump_logical', directory, '--workers', '2',
+                     '--chunk-size', '25', '--rows-per-file', '70',
+                     stdout=io.StringIO())
+        manifest = logical_backup.read_manifest(directory)
+        self.assertGreater(
+            len(manifest['tables'][Request._meta.label_lower]['files']), 1)
+        call_command('restore_logical', directory, '--replace',
+                     '--batch-size', '40', stdout=io.StringIO())
+
+        self.assertEqual(self.rows(), before)
+        self.assertEqual(sorted(RentalRollup.objects.values_list(
+            'dimension', 'object_id', 'day', 'rented', 'returned')),
+            rollups_before)
+        # Последовательности сброшены: новые строки не конфликтуют с копией
+        books = before[Book._meta.label_lower]
+        self.assertGreater(create_book().pk, books[-1][0])
+
+
+class LogicalBackupTombstoneTests(TransactionTestCase):
+    # Таблицы выгружаются в потоках со своими соединениями
+
+    def setUp(self):
+        storage = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage)
+        self.storage = Path(storage)
+
+    def dump(self, name, base=None):
+        return logical_backup.dump(self.storage / name, workers=1,
+                                   base=base and self.storage / base)
+
+    def test_full_dump_prunes_tombstones_before_horizon(self):
+        old = Tombstone.objects.create(
+            model=Book._meta.label_lower, object_id=1,
+            deleted_at=timezone.now() - datetime.timedelta(days=1))
+        recent = Tombstone.objects.create(model=Book._meta.label_lower,
+                                          object_id=2)
+        manifest = self.dump('full')
+        horizon = datetime.datetime.fromisoformat(manifest['horizon'])
+        self.assertLess(horizon, datetime.datetime.fromisoformat(
+            manifest['created_at']))
+        self.assertEqual(logical_backup.pruned_before(), horizon)
+        self.assertFalse(Tombstone.objects.filter(pk=old.pk).exists())
+        self.assertTrue(Tombstone.objects.filter(pk=recent.pk).exists())
+
+        # Удаление после копии попадает в инкрементальную
+        book = create_book()
+        book.delete()
+        delta = self.dump('delta', base='full')
+        self.assertEqual(delta['since'], manifest['horizon'])
+        tombstones = delta['tables'][Tombstone._meta.label_lower]
+        self.assertEqual(tombstones['rows'], 2)
+
+    def test_restore_rebuilds_rollups(self):
+        reader = User.objects.create_user('reader@example.com',
+                                          'Str0ng-passw0rd')
+        book = create_book()
+        rentals.rent_book(reader, book.pk)
+        self.dump('full')
+        expected = sorted(RentalRollup.objects.values_list(
+            'dimension', 'object_id', 'day', 'rented', 'returned'))
+        # Устаревшая сводка дня без аренд должна исчезнуть
+        RentalRollup.objects.create(dimension=RentalRollup.Dimension.BOOK,
+                                    object_id=book.pk, rented=3,
+                                    day=datetime.date(2000, 1, 1))
+
+        logical_backup.restore(self.storage / 'full', replace=True)
+        self.assertEqual(sorted(RentalRollup.objects.values_list(
+            'dimension', 'object_id', 'day', 'rented', 'returned')), expected)
+
+    def test_delta_from_base_older_than_pruned_journal_is_refused(self):
+        self.dump('first')
+        self.dump('second')
+        with self.assertRaises(logical_backup.LogicalBackupError):
+            self.dump('delta', base='first')
+        self.dump('delta', base='second')
+
+
+class RestoreAccessTests(TestCase):
+    """Восстановление и поиск содержимого по хешу - только для персонала."""
+
+    def setUp(self):
+        storage = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage)
+        settings_override = self.settings(ARTIFACT_ROOT=Path(storage))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        with artifacts.ArtifactWriter('library.sql',
+                                      Artifact.Kind.BACKUP) as writer:
+            writer.write(b'CREATE TABLE secret (id int);')
+        self.blob = writer.artifact.blob
+        self.reader = User.objects.create_user('reader@example.com',
+                                               'Str0ng-passw0rd')
+
+    def test_anonymous_is_sent_to_login(self):
+        for url in (reverse('restore_database'),
+                    reverse('artifact_lookup', args=[self.blob.sha256])):
+            with self.subTest(url):
+                self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_reader_is_forbidden(self):
+        self.client.force_login(self.reader)
+        for url in (reverse('restore_database'),
+                    reverse('artifact_lookup', args=[self.blob.sha256])):
+            with self.subTest(url):
+                self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_reader_cannot_link_content_by_hash(self):
+        self.client.force_login(self.reader)
+        self.client.post(reverse('upload_file'),
+                         HTTP_X_CONTENT_SHA256=self.blob.sha256)
+        self.assertEqual(Artifact.objects.count(), 1)
+
+
+class BenchmarkBaselineTests(TestCase):
+    def measured(self, **endpoints):
+        return {'scales': {'small': {'endpoints': {
+            name: {'queries': queries, 'p50_ms': 1.0, 'peak_kib': 100}
+            for name, queries in endpoints.items()
+        }}}}
+
+    def test_endpoint_missing_from_baseline_fails(self):
+        regressions = benchmarks.compare(
+            self.measured(book_list=3, search=2),
+            self.measured(book_list=3))
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('small / search', regressions[0])
+        self.assertTrue(benchmarks.compare(self.measured(book_list=3), {}))
+
+    def test_missing_baseline_fails_before_measuring(self):
+        with mock.patch.object(benchmarks, 'run') as run, \
+                self.assertRaisesRegex(CommandError, '--update-baseline'):
+            call_command('bench_endpoints', baseline='/nonexistent.json')
+        run.assert_not_called()
+
+
+class ProfilingTests(TestCase):
+    """Кольцевой буфер профилей и страницы просмотра для персонала."""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user('admin@example.com',
+                                              'Str0ng-passw0rd',
+                                              is_staff=True)
+
+    def test_ring_buffer_keeps_latest_profiles(self):
+        with self.settings(PROFILING={'BUFFER_SIZE': 3}):
+            numbers = [profiling.save_profile(
+                {'mode': 'sampling', 'data': {f'main;step{index}': 1}})
+                for index in range(5)]
+            self.assertEqual(numbers, [1, 2, 3, 4, 5])
+            self.assertEqual([entry['id']
+                              for entry in profiling.list_profiles()],
+                             [5, 4, 3])
+            self.assertNotIn('data', profiling.list_profiles()[0])
+            # Слот второго профиля занят пятым
+            self.assertIsNone(profiling.get_profile(2))
+            self.assertEqual(profiling.get_profile(5)['data'],
+                             {'main;step4': 1})
+
+    def profile_request(self, mode):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('book_list'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        number = int(response['X-Profile-Id'])
+        [entry] = self.client.get(reverse('profiles')).json()['profiles']
+        self.assertEqual((entry['id'], entry['view'], entry['mode']),
+                         (number, 'book_list', mode))
+        self.assertGreater(entry['queries'], 0)
+        return reverse('profile_download', args=[number])
+
+    def test_cprofile_download(self):
+        with self.settings(PROFILING={'ENABLED': True, 'SAMPLE_RATE': 0}):
+            url = self.profile_request('cprofile')
+            self.assertContains(self.client.get(url), 'function calls')
+            response = self.client.get(url, {'format': 'pstats'})
+            with tempfile.NamedTemporaryFile(suffix='.prof') as file:
+                file.write(response.content)
+                file.flush()
+                self.assertGreater(pstats.Stats(file.name).total_calls, 0)
+            self.assertEqual(
+                self.client.get(url, {'format': 'collapsed'}).status_code,
+                400)
+
+    def test_sampling_download(self):
+        with self.settings(PROFILING={'ENABLED': True, 'SAMPLE_RATE': 0,
+                                      'MODE': 'sampling',
+                                      'SAMPLE_INTERVAL': 0.001}):
+            url = self.profile_request('sampling')
+            response = self.client.get(url, {'format': 'collapsed'})
+            self.assertEqual(response.status_code, 200)
+            for line in response.content.decode('utf-8').splitlines():
+                self.assertRegex(line, r'^\S.* \d+$')
+            self.assertEqual(
+                self.client.get(url, {'format': 'pstats'}).status_code, 400)
+
+    def test_profiles_are_staff_only(self):
+        number = profiling.save_profile({'mode': 'sampling', 'data': {}})
+        reader = User.objects.create_user('reader@example.com',
+                                          'Str0ng-passw0rd')
+        self.client.force_login(reader)
+        for url in (reverse('profiles'),
+                    reverse('profile_download', args=[number])):
+            with self.subTest(url):
+                self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class MetricsAccessTests(TestCase):
+    def test_disabled_without_token(self):
+        with self.settings(METRICS={}):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code,
+                             404)
+
+    def test_enabled_without_token_is_staff_only(self):
+        with self.settings(METRICS={'ENABLED': True}):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code,
+                             403)
+            staff = User.objects.create_user('admin@example.com',
+                                             'Str0ng-passw0rd', is_staff=True)
+            self.client.force_login(staff)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code,
+                             200)
+
+    def test_token(self):
+        with self.settings(METRICS={'TOKEN': 'secret'}):
+            url = reverse('metrics')
+            self.assertEqual(self.client.get(url).status_code, 403)
+            response = self.client.get(url,
+                                       HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+
+class BackupAccessTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user('reader@example.com',
+                                               'Str0ng-passw0rd')
+
+    def test_backup_requires_staff(self):
+        url = reverse('backup_database')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertFalse(Job.objects.exists())
+
+    def test_backup_jobs_are_hidden_from_requester(self):
+        self.client.force_login(self.reader)
+        for kind in (Job.Kind.BACKUP, Job.Kind.BACKUP_ARCHIVE,
+                     Job.Kind.RESTORE):
+            job = Job.objects.create(kind=kind, requested_by=self.reader,
+                                     status=Job.Status.DONE)
+            for name in ('job_detail', 'job_download'):
+                with self.subTest(kind=kind, view=name):
+                    response = self.client.get(reverse(name, args=[job.pk]))
+                    self.assertEqual(response.status_code, 404)
+        export = Job.objects.create(kind=Job.Kind.BOOK_EXPORT,
+                                    requested_by=self.reader)
+        response = self.client.get(reverse('job_detail', args=[export.pk]))
+        self.assertEqual(response.status_code, 200)
+
+
+@mock.patch.object(reports, 'SETTLED_LAG', 0)
+class RentalCountsTests(TestCase):
+    def test_changed_rental_resets_checkpoint(self):
+        first, second = create_book('Book A'), create_book('Book B')
+        reader = User.objects.create_user('reader@example.com',
+                                          'Str0ng-passw0rd')
+        rental = rentals.rent_book(reader, first.pk)
+        self.assertEqual(reports.rental_counts(), [('Book A', 1)])
+        version = reports.data_version()
+
+        rental.book = second
+        rentals.save_rental(rental)
+        self.assertNotEqual(reports.data_version(), version)
+        self.assertEqual(reports.rental_counts(), [('Book B', 1)])
+
+
+class ChartTests(TestCase):
+    def test_empty_counts_render_placeholder(self):
+        with self.settings(CHARTS={'PROCESSES': 0}), \
+                warnings.catch_warnings():
+            warnings.simplefilter('error')
+            for counts in ([], [('Book A', 0)]):
+                with self.subTest(counts=counts):
+                    svg = charts.render_pie(counts, 'Статистика', 'svg')
+                    self.assertIn(b'<svg', svg)
+                    png = charts.render_pie(counts, 'Статистика', 'png')
+                    self.assertTrue(png.startswith(b'\x89PNG'))
+
+
+class AnalyticsTests(TestCase):
+    """Периоды и перцентили длительности в аналитике аренд."""
+
+    def test_bucket_alignment(self):
+        days = numpy.array(['2026-10-12', '2026-10-18', '2026-10-19',
+                            '2024-02-29'], dtype='datetime64[D]')
+        self.assertEqual(
+            analytics.bucket_start(days, 'week').astype(str).tolist(),
+            ['2026-10-12', '2026-10-12', '2026-10-19', '2024-02-26'])
+        self.assertEqual(
+            analytics.bucket_start(days, 'month').astype(str).tolist(),
+            ['2026-10-01', '2026-10-01', '2026-10-01', '2024-02-01'])
+        start, end = datetime.date(2026, 9, 30), datetime.date(2026, 10, 18)
+        self.assertEqual(
+            analytics.periods(start, end, 'week').astype(str).tolist(),
+            ['2026-09-28', '2026-10-05', '2026-10-12'])
+        self.assertEqual(
+            analytics.periods(start, end, 'month').astype(str).tolist(),
+            ['2026-09-01', '2026-10-01'])
+
+    def test_series_percentiles(self):
+        reader = User.objects.create_user('reader@example.com',
+                                          'Str0ng-passw0rd')
+        book = create_book()
+        monday = datetime.date(2026, 10, 12)
+        sunday = datetime.date(2026, 10, 18)
+
+        def returned(borrowed, days):
+            return Request(user=reader, book=book, borrow_date=borrowed,
+                           return_date=borrowed + datetime.timedelta(days=14),
+                           returned_at=borrowed + datetime.timedelta(
+                               days=days),
+                           status=Request.RequestStatus.RETURNED)
+
+        # Неделя 12-18 октября: длительности 1..9 и 20 дней (одна просрочка)
+        Request.objects.bulk_create(
+            [returned(monday, days) for days in range(1, 6)]
+            + [returned(sunday, days) for days in (6, 7, 8, 9, 20)]
+            + [returned(sunday - datetime.timedelta(days=7), 3)])
+
+        series = analytics.rental_series(
+            datetime.date(2026, 10, 1), sunday, bucket='week',
+            today=sunday + datetime.timedelta(days=30), chunk_size=3)
+        columns = series['columns']
+        self.assertEqual(series['rows_scanned'], 11)
+        self.assertEqual(columns['period'], ['2026-10-05', '2026-10-12'])
+        self.assertEqual(columns['rentals'], [1, 10])
+        self.assertEqual(columns['overdue'], [0, 1])
+        self.assertEqual(columns['overdue_rate'], [0.0, 0.1])
+        self.assertEqual(columns['avg_duration'], [3.0, 6.5])
+        self.assertEqual(columns['p50_duration'], [3.0, 5.0])
+        self.assertEqual(columns['p90_duration'], [3.0, 9.0])
+        self.assertEqual(series['summary']['p50_duration'], [5.0])
+
+        series = analytics.rental_series(
+            datetime.date(2026, 10, 1), sunday, bucket='month',
+            today=sunday + datetime.timedelta(days=30))
+        self.assertEqual(series['columns']['period'], ['2026-10-01'])
+        self.assertEqual(series['columns']['rentals'], [11])
@@ -1,41 +1,46 @@
 import zipfile
-from datetime import date, timedelta
-import pandas as pd
+from datetime import date
 
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LogoutView
 from django.contrib.auth.views import LoginView as DjangoLoginView  # Переименовали
 from django.core.files.storage import FileSystemStorage
-from django.db.models import Count
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, HttpResponseForbidden
+from django.core.paginator import Paginator
+from django.db.models import Count, Prefetch
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseRedirect, JsonResponse,
+                         HttpResponseForbidden, FileResponse)
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
-import matplotlib.pyplot as plt
-from io import BytesIO
-from docx import Document
-from docx.shared import Inches
-from drf_spectacular.utils import extend_schema
-import io
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 import os
 import csv
-import subprocess
 from django.db import connection
 from django.conf import settings
 from .models import *
 from .forms import *
 from .serializers import (UserSerializer, BookSerializer, RequestSerializer, PublisherSerializer, AuthorSerializer,
                           GenreSerializer, LanguageSerializer)
+from .cache import VersionedCacheMixin, cache_stats, versioned_cache_page
+from .conditional import ConditionalGetMixin
+from .query_budget import query_budget
+from . import (analytics, artifacts, backups, exports, jobs, metrics,
+               profiling, rentals, reports)
+from .pagination import (CustomPagination, InvalidCursor, KeysetPagination,
+                         KeysetPaginator, page_links)
+from .search import search_books
 
 # Authentication Views
 class RegisterView(View):
@@ -76,17 +81,49 @@ def logout_view(request):
     logout(request)
     return redirect('home')
 
+
+def catalog_books():
+    """
+    Книги каталога с авторами и жанрами, загруженными одним запросом на
+    связь.
+    """
+    return Book.objects.filter(is_deleted=False).defer(
+        'search_document').prefetch_related(
+        Prefetch('authors',
+                 queryset=Author.objects.only('id', 'first_name',
+                                              'last_name')),
+        Prefetch('genres', queryset=Genre.objects.only('id', 'name')),
+    )
+
+
+@query_budget(6)
+@versioned_cache_page(Book, Author, Genre)
 def home_view(request):
-    books = Book.objects.filter(is_deleted=False)
+    books = catalog_books()
     user = request.user
     return render(request, 'Books/book_list.html', {'books': books, 'user': user})
 
+
+def active_requests(user):
+    """Активные аренды пользователя с книгами, авторами и жанрами."""
+    return Request.objects.filter(
+        user=user, status__in=Request.ACTIVE_STATUSES).select_related(
+        'book'
+    ).prefetch_related(
+        Prefetch('book__authors',
+                 queryset=Author.objects.only('id', 'first_name',
+                                              'last_name')),
+        Prefetch('book__genres', queryset=Genre.objects.only('id', 'name')),
+    )
+
+
 @login_required
+@query_budget(6)
 def profile(request):
     user = request.user
 
-    # Извлекаем запросы на аренду с их книгами
-    user_requests = Request.objects.filter(user=user, status=Request.RequestStatus.RENTED)
+    # Извлекаем запросы на аренду с их книгами, авторами и жанрами
+    user_requests = active_requests(user)
 
     # Получаем список арендованных книг
     rented_books = [req.book for req in user_requests]
@@ -97,163 +134,231 @@ def profile(request):
         'requests': user_requests,
     })  # 'user': user is already included here.
 
+
+def _remember_job(request, job):
+    # Анонимный пользователь видит задачи, созданные в его сессии
+    request.session['jobs'] = (request.session.get('jobs', [])
+                               + [job.pk])[-50:]
+
+
+def _job_response(request, job):
+    """
+    Ответ на постановку задачи в очередь: 202 с адресом статуса или переход
+    на страницу задачи.
+    """
+    _remember_job(request, job)
+    status_url = reverse('job_detail', args=[job.pk])
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({'id': job.pk, 'status_url': status_url},
+                            status=202)
+    return redirect(status_url)
+
+
+# Задачи с дампом базы: их статус и результат видит только персонал
+STAFF_JOB_KINDS = (Job.Kind.BACKUP, Job.Kind.BACKUP_ARCHIVE,
+                   Job.Kind.RESTORE)
+
+
+def _get_job(request, pk):
+    job = get_object_or_404(Job, pk=pk)
+    user = request.user
+    if user.is_staff:
+        return job
+    if job.kind in STAFF_JOB_KINDS or not (
+            (user.is_authenticated and job.requested_by_id == user.pk)
+            or pk in request.session.get('jobs', [])):
+        raise Http404("Задача не найдена.")
+    return job
+
+
+def job_detail(request, pk):
+    """
+    Статус задачи очереди: JSON (``Accept: application/json``) или страница
+    с обновлением.
+    """
+    job = _get_job(request, pk)
+    download_url = (reverse('job_download', args=[job.pk])
+                    if job.artifact_id else None)
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({
+            'id': job.pk,
+            'kind': job.kind,
+            'status': job.status,
+            'attempts': job.attempts,
+            'progress_done': job.progress_done,
+            'progress_total': job.progress_total,
+            'percent': job.percent,
+            'message': job.progress_message,
+            'error': job.error,
+            'result': job.result,
+            'download_url': download_url,
+        })
+    return render(request, 'job.html',
+                  {'job': job, 'download_url': download_url})
+
+
+def _job_file(job, name=None):
+    """
+    Ответ с файлом результата задачи: основным или дополнительным ``name``
+    из ``result['files']``.
+    """
+    if job.status != Job.Status.DONE or not job.artifact_id:
+        raise Http404("Результат задачи недоступен.")
+    if name:
+        entry = job.result.get('files', {}).get(name)
+        artifact = (Artifact.objects.select_related('blob')
+                    .filter(pk=entry['artifact']).first() if entry else None)
+        if artifact is None:
+            raise Http404("Файл результата недоступен.")
+    else:
+        entry, artifact = job.result, job.artifact
+    filename = entry.get('filename') or artifact.name
+    content_type = entry.get('content_type') or 'application/octet-stream'
+    response = FileResponse(artifacts.open_artifact(artifact),
+                            as_attachment=True, filename=filename,
+                            content_type=content_type)
+    response['Content-Length'] = artifact.blob.size
+    return response
+
+
+def job_download(request, pk):
+    """
+    Скачать результат выполненной задачи (``?file=<имя>`` - дополнительный
+    файл).
+    """
+    return _job_file(_get_job(request, pk), request.GET.get('file'))
+
+
 @login_required
 def rented_books_statistics(request):
+    """
+    Отчёт Word со статистикой аренд (LibHub/reports.py), ``?file=chart``
+    или ``chart_svg`` - только диаграмма.
 
-    # 1. Получаем данные о возвращенных книгах
-    returned_requests = (
-        Request.objects.all()
-        .values('book__name')
-        .annotate(count=Count('id'))
-    )
-    # Преобразуем данные в удобный формат
-    book_names = [req['book__name'] for req in returned_requests]
-    return_counts = [req['count'] for req in returned_requests]
-
-    plt.figure(figsize=(10, 6))
-    plt.pie(return_counts, labels=book_names, autopct='%1.1f%%', startangle=90, colors=plt.cm.tab20.colors)
-    plt.title('Статистика аренды книг')
-    plt.axis('equal')  # Обеспечиваем круговую диаграмму
-
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    plt.close()
-
-    document = Document()
-    document.add_heading('Статистика когда-либо арендованных книг', level=1)
-    document.add_paragraph('Диаграмма ниже отображает статистику по книгам, которые когда-либо были арендованны:')
-
-    # Вставляем диаграмму в Word
-    image_path = 'returned_books_chart.png'
-    with open(image_path, 'wb') as image_file:
-        image_file.write(buffer.getvalue())
-    document.add_picture(image_path, width=Inches(5))
-    os.remove(image_path)
-
-    # Добавляем текстовый список после диаграммы
-    document.add_paragraph('Список статистики по книгам:')
-    for name, count in zip(book_names, return_counts):
-        document.add_paragraph(f"- {name}: {count} раз(а)")
-
-    response_buffer = BytesIO()
-    document.save(response_buffer)
-    response_buffer.seek(0)
-
-    response = HttpResponse(response_buffer,
-                            content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-    response['Content-Disposition'] = 'attachment; filename="returned_books_statistics.docx"'
-    return response
+    ``?from=ГГГГ-ММ-ДД&to=ГГГГ-ММ-ДД`` ограничивает отчёт выдачами за период
+    (по дневным сводкам, LibHub/rollups.py).
 
-def return_book(request, book_id):
-    # Найти запись о книге по ID и объекту пользователя
-    rented_book = get_object_or_404(Request, id=book_id, user=request.user, status=Request.RequestStatus.RENTED)
+    Отчёт формируется в очереди задач с ключом - версией данных аренд: пока
+    аренды не менялись, готовый файл отдаётся сразу из хранилища
+    артефактов.
+    """
+    period = {}
+    for param, name in (('from', 'start'), ('to', 'end')):
+        if request.GET.get(param):
+            try:
+                period[name] = date.fromisoformat(
+                    request.GET[param]).isoformat()
+            except ValueError:
+                return HttpResponseBadRequest(
+                    f"Неверная дата {param}: ожидается ГГГГ-ММ-ДД.")
+    key = ':'.join([reports.data_version(), period.get('start', ''),
+                    period.get('end', '')])
+    job = jobs.enqueue(Job.Kind.STATISTICS_REPORT, period, request.user,
+                       key=key)
+    if (job.status == Job.Status.DONE
+            and 'application/json' not in request.headers.get('Accept', '')):
+        return _job_file(job, request.GET.get('file'))
+    return _job_response(request, job)
 
-    # Выполнить проверку, если это обязательно (например, только владелец может завершить аренду)
-    if rented_book.user != request.user:
-        return HttpResponseForbidden("Вы не можете вернуть эту книгу.")
 
-    # Обновить статус книги на "вернулась"
-    rented_book.status = Request.RequestStatus.RETURNED
-    rented_book.save()
+@login_required
+@require_POST
+def return_book(request, book_id):
+    # book_id - идентификатор записи об аренде; возвращать может только её
+    # владелец
+    try:
+        rentals.return_book(request.user, book_id)
+    except Request.DoesNotExist:
+        raise Http404("Активная аренда не найдена.")
 
     # Добавьте перенаправление на страницу «Профиль» или другую соответствующую страницу
     return redirect('profile')
 
+
+@require_POST
 def rent_book(request, book_id):
     if not request.user.is_authenticated:
         return JsonResponse({'error': 'Вы должны быть авторизованы, чтобы арендовать книгу.'}, status=401)
 
-    book = get_object_or_404(Book, id=book_id, is_deleted=False)
-
-    # Проверка, арендовал ли пользователь эту книгу
-    already_rented = Request.objects.filter(
-        book=book,
-        user=request.user,
-        status=Request.RequestStatus.RENTED
-    ).exists()
-
-    if already_rented:
-        return JsonResponse({'error': 'Вы уже арендовали эту книгу.'}, status=400)
+    # Проверка наличия экземпляров и повторной аренды выполняется атомарно в
+    # базе
+    try:
+        rentals.rent_book(request.user, book_id)
+    except Book.DoesNotExist:
+        raise Http404("Книга не найдена.")
+    except rentals.AlreadyRented as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except rentals.NoCopiesAvailable as e:
+        return JsonResponse({'error': str(e)}, status=409)
 
-    # Создание записи об аренде
-    Request.objects.create(
-        user=request.user,
-        book=book,
-        borrow_date=date.today(),
-        return_date=date.today() + timedelta(days=14),
-        status=Request.RequestStatus.RENTED
-    )
+    return redirect('profile')
 
-    return
 
+@login_required
 def backup_database(request):
     """
-    Создать резервную копию PostgreSQL в SQL формате и скачать файл
+    Создать резервную копию PostgreSQL в SQL формате (только для персонала)
+
+    Дамп создаётся в очереди задач и сохраняется в хранилище артефактов;
+    ``?compression=gzip`` или ``zstd`` сжимает его на лету (LibHub/backups.py).
+    Ответ - страница задачи со ссылкой на скачивание.
     """
-    db_settings = settings.DATABASES['default']
-    db_name = db_settings['NAME']
-    db_user = db_settings['USER']
-    db_password = db_settings['PASSWORD']  # Получить пароль пользователя PostgreSQL
-    db_host = db_settings.get('HOST', 'localhost')
-    db_port = db_settings.get('PORT', 5432)
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Недостаточно прав.")
+    compression = request.GET.get('compression') or None
+    if compression not in backups.available_compressions():
+        return HttpResponseBadRequest(f"Сжатие недоступно: {compression}")
+    return _job_response(request, jobs.enqueue(
+        Job.Kind.BACKUP, {'compression': compression}, request.user))
 
-    try:
-        # Создаем буфер в памяти
-        buffer = io.BytesIO()
-
-        # Устанавливаем переменную окружения для пароля PostgreSQL
-        env = os.environ.copy()
-        env['PGPASSWORD'] = db_password
-
-        # Выполняем `pg_dump` и записываем вывод в буфер
-        process = subprocess.Popen(
-            [
-                'C:\\Program Files\\PostgreSQL\\16\\bin\\pg_dump.exe',
-                '-h', db_host,
-                '-p', str(db_port),
-                '-U', db_user,
-                '-F', 'p',  # Формат plain text
-                db_name
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=False,  # Считываем байтовые данные
-            env=env  # Передаем окружение с паролем
-        )
-        stdout, stderr = process.communicate()
-
-        # Проверяем ошибки
-        if process.returncode != 0:
-            return HttpResponse(f"Ошибка при создании резервной копии: {stderr.decode('utf-8')}", status=500)
-
-        # Пишем результат в буфер
-        buffer.write(stdout)
-        buffer.seek(0)
-
-        # Настраиваем HTTP-ответ для скачивания
-        response = HttpResponse(buffer, content_type='application/sql')
-        response['Content-Disposition'] = f'attachment; filename="{db_name}_backup.sql"'
-        return response
 
-    except Exception as e:
-        return HttpResponse(f"Ошибка: {str(e)}", status=500)
+def _known_upload(request, kind):
+    """
+    Артефакт для уже хранящегося содержимого, если клиент передал его SHA-256 в
+    заголовке ``X-Content-SHA256`` (имя - в ``X-File-Name``). Тело запроса при
+    этом не разбирается и не пишется на диск.
+
+    Только для персонала: иначе по известной контрольной сумме можно было бы
+    получить ссылку на чужое содержимое (например, резервную копию).
+    """
+    if not request.user.is_staff:
+        return None
+    checksum = request.headers.get('X-Content-SHA256')
+    blob = artifacts.find_blob(checksum) if checksum else None
+    if blob is None:
+        return None
+    return artifacts.link(
+        blob, request.headers.get('X-File-Name') or blob.sha256, kind)
+
+
+def _checksum_mismatch(request, artifact):
+    checksum = request.headers.get('X-Content-SHA256')
+    if checksum and checksum.lower() != artifact.blob.sha256:
+        artifact.delete()
+        return HttpResponseBadRequest(
+            "Контрольная сумма X-Content-SHA256 не совпадает с содержимым "
+            "файла.")
+    return None
+
 
 def upload_file_view(request):
+    """
+    Загрузка файла в хранилище артефактов (LibHub/artifacts.py) с
+    дедупликацией.
+    """
     if request.method == "POST":
+        artifact = _known_upload(request, Artifact.Kind.UPLOAD)
+        if artifact is not None:
+            return HttpResponse(f"Файл {artifact.name} уже хранится, "
+                                f"повторная загрузка не потребовалась.")
         form = FileUploadForm(request.POST, request.FILES)  # Используем request.FILES для получения загруженного файла
         if form.is_valid():
             uploaded_file = request.FILES['file']
-
-            # Сохраняем файл в папку "uploads" в корневой директории проекта
-            upload_path = os.path.join(settings.BASE_DIR, 'uploads', uploaded_file.name)
-            os.makedirs(os.path.dirname(upload_path), exist_ok=True)
-
-            with open(upload_path, 'wb') as f:
-                for chunk in uploaded_file.chunks():
-                    f.write(chunk)
-
-            # Можно сразу вызывать обработку файла (например, импорт данных в базу)
+            artifact = artifacts.store_upload(uploaded_file,
+                                              Artifact.Kind.UPLOAD)
+            mismatch = _checksum_mismatch(request, artifact)
+            if mismatch is not None:
+                return mismatch
             return HttpResponse(f"Файл {uploaded_file.name} успешно загружен и сохранен.")
     else:
         form = FileUploadForm()
@@ -261,57 +366,105 @@ def upload_file_view(request):
     user = request.user
     return render(request, 'import_backup.html', {'form': form, 'user': user})
 
+
+@login_required
 def restore_database(request):
     """
-    Восстановление базы данных из загруженной резервной копии SQL
+    Восстановление базы данных из загруженной резервной копии SQL (только
+    для персонала)
+
+    Файл (можно сжатый gzip/zstd) сохраняется в хранилище артефактов и
+    восстанавливается в фоне; ответ содержит адрес, по которому можно следить
+    за прогрессом. Уже известную копию можно указать заголовком
+    ``X-Content-SHA256`` без повторной загрузки.
     """
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Недостаточно прав.")
     if request.method == 'GET':
         # При GET запросе отображаем форму
         form = FileUploadForm()
         return render(request, 'import_backup.html', {'form': form})
 
-    # При POST запросе обрабатываем загруженный файл
-    form = FileUploadForm(request.POST, request.FILES)
+    artifact = _known_upload(request, Artifact.Kind.BACKUP)
+    if artifact is None:
+        # При POST запросе обрабатываем загруженный файл
+        form = FileUploadForm(request.POST, request.FILES)
 
-    if not form.is_valid():
-        return HttpResponse("Неверная форма. Убедитесь, что прикреплен файл.", status=400)
+        if not form.is_valid():
+            return HttpResponse(
+                "Неверная форма. Убедитесь, что прикреплен файл.", status=400)
 
-    # Достаём файл из формы
-    uploaded_file = request.FILES['file']
+        artifact = artifacts.store_upload(request.FILES['file'],
+                                          Artifact.Kind.BACKUP)
+        mismatch = _checksum_mismatch(request, artifact)
+        if mismatch is not None:
+            return mismatch
 
-    # Параметры базы данных из Django settings
-    db_settings = settings.DATABASES['default']
-    db_name = db_settings['NAME']
-    db_user = db_settings['USER']
-    db_password = db_settings['PASSWORD']
-    db_host = db_settings.get('HOST', 'localhost')
-    db_port = db_settings.get('PORT', 5432)
+    job = backups.start_restore(artifact, request.user)
+    progress_url = reverse('restore_progress', args=[job.pk])
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({'id': job.pk, 'progress_url': progress_url},
+                            status=202)
+    return render(request, 'import_backup.html',
+                  {'form': FileUploadForm(), 'job': job,
+                   'progress_url': progress_url},
+                  status=202)
+
+
+@login_required
+def download_backup(request, pk):
+    """
+    Скачать готовый архив параллельной резервной копии (только для
+    персонала)
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Недостаточно прав.")
+    archive = get_object_or_404(BackupArchive, pk=pk,
+                                status=BackupArchive.Status.DONE)
+    if not archive.artifact_id and not archive.file:
+        raise Http404("Копия удалена политикой хранения.")
+    filename = (archive.artifact.name if archive.artifact_id
+                else os.path.basename(archive.file))
+    response = FileResponse(backups.open_backup_archive(archive),
+                            as_attachment=True, filename=filename,
+                            content_type='application/x-tar')
+    response['Content-Length'] = archive.size
+    return response
+
+
+@login_required
+def artifact_lookup(request, sha256):
+    """
+    Хранится ли содержимое с данной контрольной суммой (проверка перед
+    загрузкой, только для персонала).
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Недостаточно прав.")
+    blob = artifacts.find_blob(sha256)
+    if blob is None:
+        raise Http404("Содержимое не найдено.")
+    return JsonResponse({'sha256': blob.sha256, 'size': blob.size})
 
-    try:
-        # Устанавливаем переменную окружения для пароля PostgreSQL
-        env = os.environ.copy()
-        env['PGPASSWORD'] = db_password
-
-        # Выполняем команду psql для восстановления базы данслоаных
-        subprocess.run(
-            [
-                r'C:\Program Files\PostgreSQL\16\bin\psql.exe',  # Добавьте полный путь к psql
-                '-h', db_host,
-                '-p', str(db_port),
-                '-U', db_user,
-                '-d', db_name
-            ],
-            input=uploaded_file.read().decode('utf-8'),
-            text=True,
-            env=env,
-            check=True
-        )
-
-        return HttpResponse("База данных успешно восстановлена из загруженной резервной копии.")
-    except subprocess.CalledProcessError as e:
-        return HttpResponse(f"Ошибка при восстановлении базы данных: {e.stderr}", status=500)
-    except Exception as e:
-        return HttpResponse(f"Ошибка: {str(e)}", status=500)
+
+@login_required
+def restore_progress(request, pk):
+    """
+    Прогресс фонового восстановления: байты, выполненные команды, статус
+    (только для персонала).
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Недостаточно прав.")
+    job = get_object_or_404(RestoreJob, pk=pk)
+    return JsonResponse({
+        'id': job.pk,
+        'status': job.status,
+        'bytes_total': job.bytes_total,
+        'bytes_processed': job.bytes_processed,
+        'percent': (round(100 * job.bytes_processed / job.bytes_total, 1)
+                    if job.bytes_total else None),
+        'statements': job.statements,
+        'error': job.error,
+    })
 
 def restore_db(request):
     """Restore the database from an uploaded SQL file."""
@@ -438,11 +591,11 @@ class BookDeleteView(DeleteView):
     model = Book
     success_url = reverse_lazy('book_list')
 
-    def delete(self, request, *args, **kwargs):
-        self.object = self.get_object()
+    def form_valid(self, form):
+        # Книга только помечается удалённой: её аренды и сводки остаются
         self.object.is_deleted = True
         self.object.save()
-        return HttpResponseRedirect(self.success_url)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class PublisherCreateView(CreateView):
@@ -514,7 +667,19 @@ class LanguageDeleteView(DeleteView):
             return super().dispatch(request, *args, **kwargs)
 
 
-class RequestCreateView(CreateView):
+class RentalFormMixin:
+    """Сохранение аренды из формы с учётом экземпляров (LibHub/rentals.py)."""
+
+    def form_valid(self, form):
+        try:
+            self.object = rentals.save_rental(form.save(commit=False))
+        except rentals.RentalError as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class RequestCreateView(RentalFormMixin, CreateView):
     model = Request
     template_name = 'Requests/request_create.html'
     form_class = RequestForm
@@ -528,7 +693,7 @@ class RequestListView(ListView):
     paginate_by = 12
 
 
-class RequestUpdateView(UpdateView):
+class RequestUpdateView(RentalFormMixin, UpdateView):
     model = Request
     template_name = 'Requests/request_create.html'  # Updated to use create.html template
     form_class = RequestForm
@@ -545,11 +710,9 @@ class RequestDeleteView(DeleteView):
     model = Request
     success_url = reverse_lazy('requests')
 
-    def delete(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        self.object.is_deleted = True
-        self.object.save()
-        return HttpResponseRedirect(self.success_url)
+    def form_valid(self, form):
+        rentals.delete_rental(self.object)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class AuthorsList(ListView):
@@ -612,10 +775,14 @@ class RequestsList(ListView):
     template_name = 'Requests/request_list.html'
     context_object_name = 'list_requests'
     paginate_by = 12
+    query_budget = 6
+
+    def get_queryset(self):
+        return Request.objects.select_related('user', 'book').order_by(
+            '-borrow_date', '-id')
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['requests'] = Request.objects.all()
         context['title'] = 'Запросы'
         return context
 
@@ -658,8 +825,14 @@ class BookList(ListView):
 def index(request):
     return render(request, 'index.html')
 
+
+BOOK_LIST_PAGE_SIZE = 12
+
+
+@query_budget(10)
+@versioned_cache_page(Book, Author, Genre)
 def book_list(request):
-    books = Book.objects.filter(is_deleted=False)
+    books = catalog_books()
     genres = Genre.objects.all()
     authors = Author.objects.all()
     user = request.user
@@ -673,23 +846,37 @@ def book_list(request):
     if selected_author:
         books = books.filter(authors__id=selected_author)
 
+    ordering = ('name', 'id')
     if title_query:
-        books = books.filter(name__icontains=title_query)
+        # Полнотекстовый поиск по названию, авторам и жанрам с ранжированием
+        books = search_books(books, title_query)
+        ordering = ('-search_rank', 'id')
 
-    return render(request, 'Books/book_list.html', {
-        'books': books,
+    context = {
         'genres': genres,
         'authors': authors,
         'selected_genre': selected_genre,
         'selected_author': selected_author,
         'user': user,
-    })
-
+    }
+    if 'page' in request.GET:
+        # Режим совместимости: постраничная навигация через OFFSET
+        page = Paginator(books.order_by(*ordering),
+                         BOOK_LIST_PAGE_SIZE).get_page(request.GET.get('page'))
+        context['books'] = page
+        context['page_obj'] = page
+    else:
+        # Курсорная пагинация по (sort_key, id) - стоимость не зависит от
+        # номера страницы
+        try:
+            page = KeysetPaginator(books, ordering, BOOK_LIST_PAGE_SIZE).page(
+                request.GET.get('cursor'))
+        except InvalidCursor:
+            page = KeysetPaginator(books, ordering, BOOK_LIST_PAGE_SIZE).page()
+        context['books'] = page
+        context.update(page_links(request, page))
 
-class CustomPagination(PageNumberPagination):
-    page_size = 1  # Количество объектов на странице
-    page_size_query_param = 'page_size'
-    max_page_size = 1000  # Максимальное количество объектов на странице
+    return render(request, 'Books/book_list.html', context)
 
 def user_rented_books_view(request):
     # Проверяем, что пользователь авторизован
@@ -710,11 +897,18 @@ def user_rented_books_view(request):
 
 class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
-    queryset = User.objects.all()
-    pagination_class = CustomPagination
+    queryset = User.objects.prefetch_related('groups', 'user_permissions')
+    query_budget = 8
+    pagination_class = KeysetPagination
+    keyset_ordering = ('email', 'id')
 
 
-class CustomModelViewSet(viewsets.ModelViewSet):
+class CustomModelViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    """
+    Базовый ViewSet каталога: логическое удаление/восстановление и условные
+    GET-запросы (ETag, ответ 304 без сериализации данных).
+    """
+
     @action(detail=False, methods=['patch'], url_path='delete-multiple')
     def delete_multiple(self, request):
         """
@@ -751,25 +945,31 @@ class CustomModelViewSet(viewsets.ModelViewSet):
 
 
 @extend_schema(tags=['Книги'])
-class BookViewSet(CustomModelViewSet):
-    queryset = Book.objects.all()
+class BookViewSet(VersionedCacheMixin, CustomModelViewSet):
+    queryset = Book.objects.prefetch_related('publishers', 'genres', 'authors')
     serializer_class = BookSerializer
+    cache_models = (Book, Publisher, Genre, Author, Language)
+    query_budget = 8
+    pagination_class = KeysetPagination
+    keyset_ordering = ('name', 'id')
 
     def get_queryset(self):
         return self.queryset.filter(is_deleted=False)
 
 @extend_schema(tags=['Жанры'])
-class GenreViewSet(CustomModelViewSet):
+class GenreViewSet(VersionedCacheMixin, CustomModelViewSet):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
+    query_budget = 5
 
     def get_queryset(self):
         return self.queryset.filter(is_deleted=False)
 
 @extend_schema(tags=['Авторы'])
-class AuthorViewSet(CustomModelViewSet):
+class AuthorViewSet(VersionedCacheMixin, CustomModelViewSet):
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
+    query_budget = 5
 
     def get_queryset(self):
         return self.queryset.filter(is_deleted=False)
@@ -778,7 +978,12 @@ class AuthorViewSet(CustomModelViewSet):
 class RequestViewSet(viewsets.ModelViewSet):
     serializer_class = RequestSerializer
     queryset = Request.objects.all()
-    pagination_class = CustomPagination
+    query_budget = 5
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-borrow_date', '-id')
+
+    def perform_destroy(self, instance):
+        rentals.delete_rental(instance)
 
 
 @extend_schema(tags=['Языки'])
@@ -791,24 +996,134 @@ class LanguageViewSet(viewsets.ModelViewSet):
 @extend_schema(tags=['Издатели'])
 class PublisherViewSet(viewsets.ModelViewSet):
     serializer_class = PublisherSerializer
-    queryset = Genre.objects.all()
+    queryset = Publisher.objects.all()
     pagination_class = CustomPagination
 
 
+@extend_schema(tags=['Аналитика'], responses=OpenApiTypes.OBJECT, parameters=[
+    OpenApiParameter('bucket', str, enum=list(analytics.BUCKETS),
+                     description="Период агрегации (по умолчанию day)"),
+    OpenApiParameter('group', str, enum=list(analytics.GROUPS),
+                     description="Разбивка по жанрам"),
+    OpenApiParameter('from', OpenApiTypes.DATE,
+                     description="Начало периода выдачи "
+                                 "(по умолчанию - год до конца)"),
+    OpenApiParameter('to', OpenApiTypes.DATE,
+                     description="Конец периода выдачи включительно "
+                                 "(по умолчанию - сегодня)"),
+])
+class RentalAnalyticsView(APIView):
+    """
+    Объём выдач, длительность аренды (среднее, перцентили) и доля просрочек
+    по периодам и жанрам в столбцовом JSON (LibHub/analytics.py). Только для
+    персонала.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            start, end = (date.fromisoformat(params[name])
+                          if params.get(name) else None
+                          for name in ('from', 'to'))
+        except ValueError:
+            return Response({'error': "Неверная дата: ожидается ГГГГ-ММ-ДД."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data = analytics.rental_series(start, end,
+                                           params.get('bucket', 'day'),
+                                           params.get('group') or None)
+        except analytics.AnalyticsError as e:
+            return Response({'error': str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+
 def api(request):
     return render(request, 'api.html')
 
 
+@login_required
+def cache_stats_view(request):
+    """Статистика попаданий/промахов кэша ответов (только для персонала)"""
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Недостаточно прав.")
+    return JsonResponse(cache_stats())
+
+
+def metrics_view(request):
+    """
+    Метрики в текстовом формате Prometheus (LibHub/metrics.py): по токену
+    Bearer или для персонала
+    """
+    config = metrics.get_config()
+    if not config['ENABLED']:
+        raise Http404
+    if config['TOKEN']:
+        allowed = (request.headers.get('Authorization')
+                   == f"Bearer {config['TOKEN']}")
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden("Недостаточно прав.")
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@login_required
+def profiles_view(request):
+    """
+    Профили запросов из кольцевого буфера (только для персонала,
+    LibHub/profiling.py)
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Недостаточно прав.")
+    return JsonResponse({'profiles': profiling.list_profiles()})
+
+
+@login_required
+def profile_download_view(request, pk):
+    """
+    Профиль запроса: ``?format=text`` (по умолчанию) - сводка, ``pstats`` -
+    файл для ``python -m pstats``/snakeviz (режим cprofile), ``collapsed`` -
+    свёрнутые стеки для flamegraph (режим sampling).
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Недостаточно прав.")
+    entry = profiling.get_profile(pk)
+    if entry is None:
+        raise Http404("Профиль вытеснен из буфера или не существует.")
+    output_format = request.GET.get('format', 'text')
+    if output_format == 'text':
+        return HttpResponse(profiling.render_text(entry),
+                            content_type='text/plain; charset=utf-8')
+    if output_format == 'pstats' and entry['mode'] == 'cprofile':
+        response = HttpResponse(entry['data'],
+                                content_type='application/octet-stream')
+        response['Content-Disposition'] = (
+            f'attachment; filename="profile-{pk}.prof"')
+        return response
+    if output_format == 'collapsed' and entry['mode'] == 'sampling':
+        response = HttpResponse(profiling.render_collapsed(entry),
+                                content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = (
+            f'attachment; filename="profile-{pk}.folded"')
+        return response
+    return HttpResponseBadRequest(
+        f"Формат {output_format} недоступен для профиля в режиме "
+        f"{entry['mode']}.")
+
+
 def export_books_to_excel(request):
-    books = Book.objects.all()
-    data = {
-        'Title': [book.name for book in books],
-        'Publication Year': [book.publication_year for book in books],
-        'Authors': [", ".join(f"{author.first_name} {author.last_name}" for author in book.authors.all()) for book in books],
-        'Genres': [", ".join(genre.name for genre in book.genres.all()) for book in books],
-    }
-    df = pd.DataFrame(data)
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = 'attachment; filename="books.xlsx"'
-    df.to_excel(response, index=False)
-    return response
+    """
+    Выгрузка каталога: ``?format=xlsx`` (по умолчанию), ``csv`` или
+    ``parquet``.
+
+    Файл формируется в очереди задач (LibHub/exports.py, LibHub/tasks.py);
+    ответ - страница задачи со ссылкой на скачивание.
+    """
+    export_format = request.GET.get('format', 'xlsx')
+    if export_format not in exports.available_formats():
+        return HttpResponseBadRequest(
+            f"Формат выгрузки недоступен: {export_format}")
+    return _job_response(request, jobs.enqueue(
+        Job.Kind.BOOK_EXPORT, {'format': export_format}, request.user))